@@ -0,0 +1,63 @@
+"""
+Time to connect to many peers, one after another and in parallel.
+
+A second process runs --peers listening nodes. This process runs one more,
+which connects to all of them with connect_many, as connect-many does:
+first one handshake at a time, then with network.connect_parallelism at
+a time, then once more while still connected, when every string is a peer
+it already has.
+"""
+import argparse
+import multiprocessing
+import time
+
+from common import Nodes, ms, percentile, quiet, table, wait_for
+
+from src.bootstrap import CONNECTED, connect_many
+from src.utils.config import SCHEMA
+
+
+def listeners(count, strings, stop):
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0}) as nodes:
+        started = [nodes.start(f"Peer{i}") for i in range(count)]
+        strings.put([node.connection_string(node.secret) for node in started])
+        stop.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=200)
+    parser.add_argument('--parallelism', type=int, default=SCHEMA['network']['connect_parallelism'].default)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    strings, stop = context.Queue(), context.Event()
+    peers = context.Process(target=listeners, args=(args.peers, strings, stop), daemon=True)
+    peers.start()
+    connection_strings = strings.get(timeout=300)
+
+    rows = []
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0}) as nodes:
+        node = nodes.start('Bootstrap', listen=False)
+        for name, parallelism, fresh in (('one at a time', 1, True),
+                                         (f"{args.parallelism} at a time", args.parallelism, True),
+                                         ('again, all connected', args.parallelism, False)):
+            if fresh:
+                nodes.disconnect(node)
+                wait_for(lambda: not node.peers, 10)
+            started = time.perf_counter()
+            with quiet():
+                results = connect_many(node, connection_strings, parallelism)
+            elapsed = time.perf_counter() - started
+            connected = [result.elapsed for result in results if result.status == CONNECTED]
+            rows.append([name, sum(1 for result in results if result.status == CONNECTED),
+                         len(results) - len(connected), f"{elapsed:.2f} s",
+                         ms(percentile(connected, 0.5)) if connected else '-',
+                         ms(max(connected)) if connected else '-'])
+    stop.set()
+    peers.join(30)
+    table([f"{args.peers} peers", 'connected', 'skipped or failed', 'total', 'p50 per peer', 'max per peer'], rows)
+
+
+if __name__ == '__main__':
+    main()
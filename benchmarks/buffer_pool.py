@@ -0,0 +1,64 @@
+"""
+Read path allocations and throughput with and without the buffer pool.
+
+For each size in --sizes Alice sends Bob --megabytes MiB of direct messages
+of that many characters, once with network.buffer_pool at its default and
+once at 0, which allocates every buffer afresh. The figures are Bob's
+throughput, the buffers his read path took from the allocator rather than
+the pool per message, and the minor page faults of the process per message,
+which is where fresh allocations of that size cost.
+"""
+import argparse
+import resource
+import time
+
+from common import MiB, Nodes, table, wait_for
+
+from src.utils.buffers import SMALL
+from src.utils.config import SCHEMA
+
+
+def run(pool, size, megabytes):
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0, 'network.buffer_pool': pool,
+                  'pipeline.handlers': 'common:Probe'}) as nodes:
+        alice, bob = nodes.start('Alice'), nodes.start('Bob', listen=False)
+        nodes.connect(bob, alice)
+        messages = max(1, megabytes * MiB // size)
+        body = 'x' * size
+        buffers = bob.network.buffers.stats()
+        faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+        started = time.perf_counter()
+        for _ in range(messages):
+            alice.network.send_to_peer('Bob', f"{time.perf_counter()} {body}")
+        if not wait_for(lambda: bob.probe.count >= messages, 120):
+            raise SystemExit(f"Bob got only {bob.probe.count} of {messages}")
+        elapsed = time.perf_counter() - started
+        faults = resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults
+        after = bob.network.buffers.stats()
+        fresh = (after['acquired'] - buffers['acquired']) - (after['reused'] - buffers['reused'])
+        return messages / elapsed, fresh / messages if size > SMALL else None, faults / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1024,16384,262144', help="comma separated message lengths")
+    parser.add_argument('--megabytes', type=int, default=64, help="MiB sent for each figure")
+    args = parser.parse_args()
+
+    default = SCHEMA['network']['buffer_pool'].default
+    # The first nodes in the process fault in pages any run would, so they do not count
+    run(default, 16384, 4)
+    rows = []
+    for size in (int(value) for value in args.sizes.split(',')):
+        for pool in (0, default):
+            rate, fresh, faults = run(pool, size, args.megabytes)
+            rows.append([size, f"{pool // MiB} MiB" if pool else 'off', f"{rate:,.0f}",
+                         f"{rate * size / 1e6:,.0f} MB/s",
+                         f"{fresh:.2f}" if fresh is not None else 'allocator', f"{faults:.2f}"])
+    table(['message size', 'pool', 'messages/s', 'throughput', 'fresh buffers per message',
+           'page faults per message'], rows)
+    print(f"buffers of {SMALL} bytes or less always come from the allocator")
+
+
+if __name__ == '__main__':
+    main()
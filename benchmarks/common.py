@@ -0,0 +1,215 @@
+"""
+Shared setup for the benchmark scripts. Each one runs from a checkout with
+plain python, for example `python benchmarks/message_log.py --help`, and
+prints its figures; none of them needs anything the node itself does not.
+"""
+import contextlib
+import io
+import os
+import selectors
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from src.pipeline import Handler
+
+MiB = 1024 * 1024
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else float('nan')
+
+
+def ms(seconds: float) -> str:
+    return f"{seconds * 1000:.2f} ms"
+
+
+def quiet():
+    """Swallows what the node prints to stdout while connecting and handling commands"""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def wait_for(condition, timeout: float, interval: float = 0.001) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def table(headers: List[str], rows: List[List]) -> None:
+    """Prints rows under headers, each column as wide as its widest cell and figures aligned right"""
+    cells = [headers] + [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(headers))]
+    for row in cells:
+        print('  '.join([row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]))
+
+
+class Probe(Handler):
+    """
+    Handler that records how long each message took from the time.perf_counter()
+    its text starts with. Register it with 'pipeline.handlers': 'common:Probe';
+    the node it runs on gets it as node.probe.
+    """
+    name = 'probe'
+
+    def __init__(self, peer):
+        self.latencies = []
+        self.count = 0
+        self.arrived = threading.Event()
+        peer.probe = self
+
+    def handle(self, messages):
+        now = time.perf_counter()
+        for message in messages:
+            self.latencies.append(now - float(message.text.split(' ', 1)[0]))
+        self.count += len(messages)
+        self.arrived.set()
+
+
+class Nodes:
+    """
+    Nodes on 127.0.0.1, each with its own history and outbox directories under
+    a temporary directory, all stopped when the block ends
+    """
+
+    def __init__(self, **overrides):
+        self.directory = tempfile.mkdtemp(prefix='n0ctua-bench-')
+        self.overrides = overrides
+        self.nodes = []
+
+    def __enter__(self) -> 'Nodes':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for node in self.nodes:
+            self.stop(node)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def settings(self, peer_id: str, overrides: Optional[Dict] = None):
+        from src.utils.config import Settings
+        values = {
+            'network.bind_address': '127.0.0.1',
+            'storage.history_dir': os.path.join(self.directory, peer_id, 'history'),
+            'storage.outbox_dir': os.path.join(self.directory, peer_id, 'outbox'),
+            'pipeline.plugins': 0
+        }
+        values.update(self.overrides)
+        values.update(overrides or {})
+        return Settings(path=os.path.join(self.directory, 'none.conf'), overrides=values)
+
+    def start(self, peer_id: str, listen: bool = True, **overrides):
+        """Starts a node that prints nothing, listening unless told otherwise"""
+        from src.peer import SecurePeer
+        with quiet():
+            node = SecurePeer(peer_id=peer_id, settings=self.settings(peer_id, overrides))
+        node.print_message = node.message_handler.print_message = lambda *args, **kwargs: None
+        if listen:
+            threading.Thread(target=node.start_listening, daemon=True).start()
+        self.nodes.append(node)
+        return node
+
+    @staticmethod
+    def connect(dialer, listener, timeout: float = 10, connection_string: Optional[str] = None) -> float:
+        """
+        Connects dialer to listener, by default through its own connection string,
+        returning the seconds until both sides see each other
+        """
+        started = time.perf_counter()
+        with quiet():
+            dialer.connect_to_peer(connection_string or listener.connection_string(listener.secret))
+        if not wait_for(lambda: listener.peers.has_peer_id(dialer.peer_id)
+                        and dialer.peers.has_peer_id(listener.peer_id), timeout):
+            raise RuntimeError(f"{dialer.peer_id} did not connect to {listener.peer_id}")
+        return time.perf_counter() - started
+
+    @staticmethod
+    def disconnect(node) -> None:
+        for record in node.peers.snapshot():
+            node.remove_peer(record.socket)
+
+    def stop(self, node) -> None:
+        if not node.running:
+            return
+        node.running = False
+        with quiet():
+            self.disconnect(node)
+            node.listen_socket.close()
+            node.admission.shutdown()
+            node.crypto_pool.shutdown()
+            node.pipeline.close()
+            for component in (node.datagram, node.message_log, node.outbox):
+                if component:
+                    component.close()
+
+
+class Sinks:
+    """
+    Peers that are only the far end of a socket pair: registered with a node as
+    connected, with one thread reading whatever reaches them and counting the
+    bytes. They never acknowledge, so the node needs a flow window large
+    enough for everything a run sends.
+    """
+
+    def __init__(self, node, count: int, prefix: str = 'peer'):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        self.node = node
+        self.received = 0
+        self.selector = selectors.DefaultSelector()
+        self.records = []
+        self.ends = []
+        for i in range(count):
+            near, far = socket.socketpair()
+            far.setblocking(False)
+            self.selector.register(far, selectors.EVENT_READ)
+            self.ends.append(far)
+            peer_id, key = f"{prefix}{i}", os.urandom(32)
+            session_id = node.session_manager.create_session(peer_id)
+            self.records.append(node.peers.add(near, peer_id, ('sink', i), session_id, AESGCM(key), key))
+        self.running = True
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def __enter__(self) -> 'Sinks':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _drain(self) -> None:
+        while self.running:
+            for key, _ in self.selector.select(0.05):
+                try:
+                    self.received += len(key.fileobj.recv(1 << 20))
+                except BlockingIOError:
+                    pass
+
+    def settle(self) -> int:
+        """Waits until nothing more arrives and returns the bytes received so far"""
+        previous = -1
+        while previous != self.received:
+            previous = self.received
+            time.sleep(0.05)
+        return self.received
+
+    def close(self) -> None:
+        self.running = False
+        self.thread.join()
+        for record in self.records:
+            self.node.peers.remove(record.socket)
+            self.node.network.forget_socket(record.socket, record)
+            record.socket.close()
+        for far in self.ends:
+            self.selector.unregister(far)
+            far.close()
+        self.selector.close()
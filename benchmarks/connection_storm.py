@@ -0,0 +1,107 @@
+"""
+Legitimate connects during a connection storm.
+
+A separate process runs --attackers threads that connect to Alice from
+--sources loopback addresses other than 127.0.0.1. Each holds its connection
+open without a handshake until she closes it, then connects again after
+--pause seconds. Meanwhile --peers nodes connect to her from 127.0.0.1 one
+after another, retrying every half second as a user would. The connect
+times are compared with the same connects without the storm.
+"""
+import argparse
+import multiprocessing
+import socket
+import threading
+import time
+
+from common import Nodes, ms, percentile, table
+
+
+def attack(address, source, pause, stop, connects):
+    while not stop.is_set():
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            connection.bind((source, 0))
+            connection.settimeout(30)
+            connection.connect(address)
+            with connects.get_lock():
+                connects.value += 1
+            # Returns once the node closes it: at once when rejected, at the deadline otherwise
+            connection.recv(1)
+        except OSError:
+            pass
+        finally:
+            connection.close()
+        time.sleep(pause)
+
+
+def storm(address, sources, pause, stop, connects):
+    """Runs the attacking threads, in a process of their own so they do not share the node's interpreter"""
+    threads = [threading.Thread(target=attack, args=(address, source, pause, stop, connects), daemon=True)
+               for source in sources]
+    for thread in threads:
+        thread.start()
+    stop.wait()
+
+
+def join(nodes, peers, alice, attempts):
+    """Connects each peer to alice in turn, returning the connect times and the failures"""
+    times, failed = [], 0
+    for peer in peers:
+        started = time.perf_counter()
+        for _ in range(attempts):
+            try:
+                nodes.connect(peer, alice, timeout=5)
+                times.append(time.perf_counter() - started)
+                break
+            except RuntimeError:
+                time.sleep(0.5)
+        else:
+            failed += 1
+    for peer in peers:
+        nodes.disconnect(peer)
+    return times, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--attackers', type=int, default=64, help="storm threads")
+    parser.add_argument('--sources', type=int, default=2, help="loopback addresses the storm comes from")
+    parser.add_argument('--peers', type=int, default=8, help="legitimate peers")
+    parser.add_argument('--attempts', type=int, default=20, help="connect attempts per legitimate peer")
+    parser.add_argument('--pause', type=float, default=0.01, help="seconds an attacker waits before connecting again")
+    parser.add_argument('--warmup', type=float, default=2.0, help="seconds of storm before the peers connect")
+    args = parser.parse_args()
+
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0}) as nodes:
+        alice = nodes.start('Alice')
+        peers = [nodes.start(f"Peer{i}", listen=False) for i in range(args.peers)]
+        admission = alice.admission
+
+        rows = []
+        times, failed = join(nodes, peers, alice, args.attempts)
+        rows.append(['no storm', len(times), failed, ms(percentile(times, 0.5)), ms(max(times, default=0))])
+
+        # The peers share 127.0.0.1, so they start the storm with a full bucket again
+        admission.configure(admission.rate, admission.burst, admission.handshake_timeout, admission.max_sources)
+        context = multiprocessing.get_context('spawn')
+        stop, connects = context.Event(), context.Value('q', 0)
+        sources = [f"127.0.0.{2 + i % args.sources}" for i in range(args.attackers)]
+        attacker = context.Process(target=storm, args=(('127.0.0.1', alice.listen_port), sources, args.pause,
+                                                       stop, connects), daemon=True)
+        attacker.start()
+        time.sleep(args.warmup)
+        started = time.perf_counter()
+        times, failed = join(nodes, peers, alice, args.attempts)
+        duration = time.perf_counter() - started + args.warmup
+        stop.set()
+        attacker.join(5)
+        rows.append(['during the storm', len(times), failed, ms(percentile(times, 0.5)), ms(max(times, default=0))])
+
+        table(['', 'connected', 'failed', 'p50 connect', 'max connect'], rows)
+        print(f"storm: {connects.value} connections in {duration:.1f} s from {args.sources} addresses")
+        print("admission:", ', '.join(f"{key} {value}" for key, value in admission.stats.items()))
+
+
+if __name__ == '__main__':
+    main()
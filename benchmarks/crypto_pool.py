@@ -0,0 +1,63 @@
+"""
+Crossover and core scaling of the crypto pool.
+
+Seals batches of --frames frames of each size in --sizes, on the calling
+thread and on pools of 2, 4, ... workers up to the number of cores, and
+prints the throughput of each. Where a pool beats the calling thread is
+the batch size to use for network.crypto_inline_threshold. The pool never
+has more workers than cores, so on a single core only the calling thread
+is measured.
+"""
+import argparse
+import os
+import time
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from common import table
+
+from src.crypto_pool import CryptoPool
+
+
+def throughput(pool, jobs, seconds):
+    """Returns MB/s sealing the batch over and over for about the given seconds"""
+    size = sum(len(data) for _, data, _ in jobs)
+    done = 0
+    started = time.perf_counter()
+    while True:
+        pool.seal_many(jobs)
+        done += size
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return done / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='64,1024,16384,262144,1048576', help="comma separated frame sizes")
+    parser.add_argument('--frames', type=int, default=64, help="frames per batch")
+    parser.add_argument('--seconds', type=float, default=0.5, help="time spent on each figure")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    counts = [workers for workers in (2, 4, 8, 16, 32) if workers <= cores]
+    if cores > 2 and cores not in counts:
+        counts.append(cores)
+    pools = [('calling thread', CryptoPool(1, 0))]
+    pools += [(f"{workers} workers", CryptoPool(workers, 0)) for workers in counts]
+    if not counts:
+        print(f"{cores} core: every batch runs on the calling thread")
+
+    aes_gcm = AESGCM(os.urandom(32))
+    rows = []
+    for size in (int(value) for value in args.sizes.split(',')):
+        jobs = [(aes_gcm, os.urandom(size), b'header') for _ in range(args.frames)]
+        rows.append([f"{args.frames} x {size} B"] +
+                    [f"{throughput(pool, jobs, args.seconds):,.0f} MB/s" for _, pool in pools])
+    for _, pool in pools:
+        pool.shutdown()
+    table(['batch'] + [name for name, _ in pools], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Message latency under loss, over datagrams and over TCP.
+
+Alice sends --messages direct messages to Bob, one every --interval seconds,
+and each is timed from the send to Bob's handlers. Over datagrams both nodes
+drop --loss of what they send with network.datagram_loss. TCP on loopback
+loses nothing, so for TCP Bob connects through a relay that, for the same
+fraction of the chunks it forwards, holds that chunk and everything behind
+it for --rto seconds: what a lost segment costs a TCP stream that has to
+wait for its retransmission.
+"""
+import argparse
+import random
+import socket
+import threading
+import time
+
+from common import Nodes, ms, percentile, table, wait_for
+
+
+class StallingRelay:
+    """Forwards connections to target, stalling the stream on a fraction of its chunks once lossy is set"""
+
+    def __init__(self, target, loss, rto, seed=7):
+        self.target = target
+        self.loss = loss
+        self.rto = rto
+        self.random = random.Random(seed)
+        self.lossy = False
+        self.listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                inbound, _ = self.listener.accept()
+            except OSError:
+                return
+            outbound = socket.create_connection(self.target)
+            for source, destination in ((inbound, outbound), (outbound, inbound)):
+                source.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=self._pump, args=(source, destination), daemon=True).start()
+
+    def _pump(self, source, destination):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                if self.lossy and self.random.random() < self.loss:
+                    time.sleep(self.rto)
+                destination.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, destination):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        self.listener.close()
+
+
+def measure(alice, bob, messages, interval):
+    probe = bob.probe
+    start = len(probe.latencies)
+    for _ in range(messages):
+        alice.network.send_to_peer('Bob', f"{time.perf_counter()} ping")
+        time.sleep(interval)
+    if not wait_for(lambda: probe.count >= start + messages, 30, 0.01):
+        raise SystemExit(f"Bob got only {probe.count - start} of {messages}")
+    return probe.latencies[start:]
+
+
+def row(name, latencies):
+    return [name] + [ms(percentile(latencies, fraction)) for fraction in (0.5, 0.99, 0.999)] + [ms(max(latencies))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=0.002, help="seconds between messages")
+    parser.add_argument('--loss', type=float, default=0.02)
+    parser.add_argument('--rto', type=float, default=0.2, help="seconds a lost TCP segment holds the stream")
+    args = parser.parse_args()
+
+    base = {'storage.history_enabled': 0, 'storage.outbox_enabled': 0, 'pipeline.handlers': 'common:Probe'}
+    rows = []
+
+    with Nodes(**base) as nodes:
+        alice, bob = nodes.start('Alice'), nodes.start('Bob', listen=False)
+        relay = StallingRelay(('127.0.0.1', alice.listen_port), args.loss, args.rto)
+        nodes.connect(bob, alice, connection_string=f"127.0.0.1:{relay.port}:{alice.secret}")
+        rows.append(row('TCP', measure(alice, bob, args.messages, args.interval)))
+        relay.lossy = True
+        rows.append(row(f"TCP, {args.loss:.0%} stalled", measure(alice, bob, args.messages, args.interval)))
+        relay.close()
+
+    for loss in (0.0, args.loss):
+        with Nodes(**base, **{'network.datagram': 1, 'network.datagram_loss': loss}) as nodes:
+            alice, bob = nodes.start('Alice'), nodes.start('Bob', listen=False)
+            nodes.connect(bob, alice)
+            record = alice.peers.get_by_peer_id('Bob')
+            if not wait_for(lambda: alice.datagram.has_path(record.socket), 10):
+                raise SystemExit("The datagram path did not open")
+            latencies = measure(alice, bob, args.messages, args.interval)
+            rows.append(row(f"datagram, {loss:.0%} lost" if loss else 'datagram', latencies))
+
+    table([f"{args.messages} messages", 'p50', 'p99', 'p99.9', 'max'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+A fast producer against a slow consumer.
+
+Alice sends --size character direct messages to Bob as fast as she can for
+--seconds seconds, while Bob's only handler spends --delay seconds on each.
+Flow control should hold Alice back instead of letting either side buffer
+what Bob has not handled: the figures are how much was produced and
+consumed, the peaks of what waited on each side, and the resident memory of
+the process, which runs both nodes, sampled throughout.
+"""
+import argparse
+import threading
+import time
+
+from common import MiB, Nodes, table, wait_for
+
+from src.pipeline import Handler
+from src.utils.memory import process_rss
+
+
+class Slow(Handler):
+    """Spends a fixed time on every message"""
+    name = 'slow'
+    delay = 0.001
+
+    def __init__(self, peer):
+        self.count = 0
+        peer.slow = self
+
+    def handle(self, messages):
+        for _ in messages:
+            time.sleep(self.delay)
+        self.count += len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--size', type=int, default=4096, help="message length in characters")
+    parser.add_argument('--delay', type=float, default=0.001, help="seconds Bob spends on each message")
+    args = parser.parse_args()
+    Slow.delay = args.delay
+
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0,
+                  'pipeline.handlers': f'{__name__}:Slow'}) as nodes:
+        alice, bob = nodes.start('Alice'), nodes.start('Bob', listen=False)
+        nodes.connect(bob, alice)
+        record = alice.peers.get_by_peer_id('Bob')
+        baseline = process_rss()
+
+        samples = {'rss': baseline, 'in_flight_bytes': 0, 'pipeline': 0}
+        sampling = True
+
+        def sample():
+            while sampling:
+                stream = alice.network.stream_stats(record)
+                pipeline, _ = bob.pipeline.snapshot()
+                samples['rss'] = max(samples['rss'], process_rss())
+                samples['in_flight_bytes'] = max(samples['in_flight_bytes'], stream['in_flight_bytes'])
+                samples['pipeline'] = max(samples['pipeline'], pipeline['in_flight'])
+                time.sleep(0.05)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+
+        body = 'x' * args.size
+        produced = 0
+        deadline = time.monotonic() + args.seconds
+        while time.monotonic() < deadline:
+            if not alice.network.send_to_peer('Bob', body):
+                raise SystemExit("A send failed")
+            produced += 1
+        consumed_in_time = bob.slow.count
+        wait_for(lambda: bob.slow.count >= produced, 120, 0.01)
+        sampling = False
+        sampler.join()
+        stream = alice.network.stream_stats(record)
+
+    table(['', 'value'], [
+        ['messages produced', produced],
+        ['produced, MiB', f"{produced * args.size / MiB:,.1f}"],
+        ['messages Bob handled in that time', consumed_in_time],
+        ["peak of Alice's queue", f"{stream['queue_peak'] / MiB:,.2f} MiB"],
+        ["peak of Alice's bytes in flight", f"{samples['in_flight_bytes'] / MiB:,.2f} MiB"],
+        ["peak of Bob's messages in the pipeline", samples['pipeline']],
+        ['times Alice waited for space', stream['producer_waits']],
+        ['time Alice spent waiting', f"{stream['producer_wait_time']:.1f} s"],
+        ['resident memory before', f"{baseline / MiB:,.1f} MiB"],
+        ['resident memory, peak', f"{samples['rss'] / MiB:,.1f} MiB"],
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Broadcast CPU against peer count, sealed per peer or once with a group key.
+
+For each count in --counts and size in --sizes Alice broadcasts --messages
+messages to that many connected peers, first with pairwise sealing and then
+with network.group_broadcast on. One broadcast before each timing hands out the
+sender key, so the figures are for the steady state. CPU is the sending
+thread's own time, with sealing kept on that thread.
+"""
+import argparse
+import time
+
+from common import Nodes, Sinks, table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='10,50,100,250,500', help="comma separated peer counts")
+    parser.add_argument('--sizes', default='100,16384', help="comma separated message lengths in characters")
+    parser.add_argument('--messages', type=int, default=50)
+    args = parser.parse_args()
+
+    overrides = {'storage.history_enabled': 0, 'storage.outbox_enabled': 0,
+                 'network.crypto_inline_threshold': 1024 ** 3,
+                 'network.flow_window': 256 * 1024 * 1024, 'network.flow_frames': 1000000}
+    rows = []
+    with Nodes(**overrides) as nodes:
+        alice = nodes.start('Alice', listen=False)
+        for count in (int(value) for value in args.counts.split(',')):
+            with Sinks(alice, count) as sinks:
+                for size in (int(value) for value in args.sizes.split(',')):
+                    message = 'x' * size
+                    row = [count, size]
+                    for mode in (0, 1):
+                        alice.network_config['group_broadcast'] = mode
+                        alice.network.broadcast_message(message)
+                        started = time.thread_time()
+                        for _ in range(args.messages):
+                            alice.network.broadcast_message(message)
+                        row.append(f"{(time.thread_time() - started) / args.messages * 1e6:,.0f} us")
+                    rows.append(row)
+                    sinks.settle()
+    table(['peers', 'message size', 'pairwise CPU per broadcast', 'group key CPU per broadcast'], rows)
+
+
+if __name__ == '__main__':
+    main()
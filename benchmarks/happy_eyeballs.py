@@ -0,0 +1,79 @@
+"""
+Connect time with a blackholed address listed first.
+
+The blackhole is a listener on 127.0.0.2 whose backlog is full and never
+accepted, so the kernel drops every further SYN, as a firewall would. Bob
+connects to Alice with a connection string that lists it before her real
+address. The figures are a blocking connect to each candidate in turn, as
+before candidates were raced, with --timeout per attempt; the racing dial;
+and Bob's whole connect including the handshake.
+"""
+import argparse
+import socket
+import statistics
+import time
+
+from common import Nodes, ms, table
+
+from src.admission import HandshakeDeadline
+from src.dialer import CONNECTION_ATTEMPT_DELAY, dial
+from src.utils.helpers import parse_connection_string
+
+
+def sequential(candidates, timeout):
+    for host, port in candidates:
+        try:
+            return socket.create_connection((host, port), timeout=timeout)
+        except OSError:
+            pass
+    raise OSError("No candidate answered")
+
+
+def timed(connect, runs):
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        connect().close()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=5.0, help="seconds a blocking connect waits")
+    args = parser.parse_args()
+
+    blackhole = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    blackhole.bind(('127.0.0.2', 0))
+    blackhole.listen(0)
+    # Fills the backlog; nothing accepts it
+    filler = socket.create_connection(blackhole.getsockname())
+
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0}) as nodes:
+        alice, bob = nodes.start('Alice'), nodes.start('Bob', listen=False)
+        connection_string = f"127.0.0.2:{blackhole.getsockname()[1]},{alice.connection_string(alice.secret)}"
+        candidates, _ = parse_connection_string(connection_string)
+
+        rows = []
+        for name, connect in (
+                ('blocking connect, one candidate after another',
+                 lambda: sequential(candidates, args.timeout)),
+                ('racing dial', lambda: dial(candidates, HandshakeDeadline(args.timeout)))):
+            times = timed(connect, args.runs)
+            rows.append([name, ms(statistics.median(times)), ms(max(times))])
+
+        times = []
+        for _ in range(args.runs):
+            times.append(nodes.connect(bob, alice, connection_string=connection_string))
+            nodes.disconnect(bob)
+        rows.append(['node connect with handshake', ms(statistics.median(times)), ms(max(times))])
+
+    filler.close()
+    blackhole.close()
+    table([f"blackholed first, {args.runs} runs", 'median', 'max'], rows)
+    print(f"attempts are raced {ms(CONNECTION_ATTEMPT_DELAY)} apart")
+
+
+if __name__ == '__main__':
+    main()
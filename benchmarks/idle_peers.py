@@ -0,0 +1,78 @@
+"""
+Resident memory per idle peer.
+
+This process runs one node. A second process runs --clients nodes that
+connect to it, in steps, until it has --peers connections, each through a
+full handshake and then left idle. After each step the figures are the
+process's resident memory and the growth per peer since before the first
+connection, next to the Python objects each connection holds as the memory
+command counts them. Kernel socket buffers are not part of either.
+"""
+import argparse
+import gc
+import multiprocessing
+import threading
+
+from common import MiB, Nodes, quiet, table, wait_for
+
+from src.utils.memory import connection_footprint, process_rss
+
+HUB_OVERRIDES = {'storage.history_enabled': 0, 'storage.outbox_enabled': 0,
+                 'network.rate_limit': 10000, 'network.rate_burst': 100000}
+
+
+def clients(connection_string, count, targets, done):
+    """Connects count nodes to the hub, each step spreading the new connections over them"""
+    with Nodes(**HUB_OVERRIDES) as nodes:
+        nodes = [nodes.start(f"Client{i}", listen=False) for i in range(count)]
+        opened = 0
+        while True:
+            target = targets.get()
+            if target is None:
+                break
+            while opened < target:
+                with quiet():
+                    nodes[opened % count].open_connection(connection_string)
+                opened += 1
+            done.put(opened)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=10, help="nodes the connections come from")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    targets, done = context.Queue(), context.Queue()
+    rows = []
+    with Nodes(**HUB_OVERRIDES) as nodes:
+        hub = nodes.start('Hub')
+        client = context.Process(target=clients, args=(hub.connection_string(hub.secret), args.clients,
+                                                       targets, done), daemon=True)
+        client.start()
+        gc.collect()
+        baseline = process_rss()
+
+        for step in range(1, args.steps + 1):
+            target = args.peers * step // args.steps
+            targets.put(target)
+            done.get()
+            if not wait_for(lambda: len(hub.peers) >= target, 60, 0.01):
+                raise SystemExit(f"Only {len(hub.peers)} of {target} peers connected")
+            gc.collect()
+            rss = process_rss()
+            count, totals = connection_footprint(hub)
+            rows.append([count, f"{rss / MiB:,.1f} MiB", f"{(rss - baseline) / count / 1024:,.1f} KiB",
+                         f"{sum(totals.values()) / count / 1024:,.1f} KiB", threading.active_count()])
+
+        targets.put(None)
+        client.join(30)
+
+    print(f"resident memory before any peer: {baseline / MiB:,.1f} MiB")
+    table(['peers', 'resident memory', 'growth per peer', 'Python state per peer', 'threads'], rows)
+
+
+if __name__ == '__main__':
+    main()
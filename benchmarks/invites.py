@@ -0,0 +1,48 @@
+"""
+Invite verification cost against the number of outstanding invites.
+
+Fills an invite table to each size in --sizes and times --checks verifications
+of a valid token, of a known key id with the wrong secret, and of an unknown
+key id. All three should cost the same, and none should grow with the table.
+"""
+import argparse
+import random
+import time
+
+from common import table
+
+from src.invites import InviteTable
+
+
+def per_check(invite_table, tokens):
+    started = time.perf_counter()
+    for token in tokens:
+        invite_table.verify(token)
+    return (time.perf_counter() - started) / len(tokens)
+
+
+def us(seconds):
+    return f"{seconds * 1e6:.2f} us"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1,1000,10000,100000', help="comma separated invite counts")
+    parser.add_argument('--checks', type=int, default=100000, help="verifications of each kind")
+    args = parser.parse_args()
+
+    invites, tokens = InviteTable(), []
+    rows = []
+    for size in (int(value) for value in args.sizes.split(',')):
+        while len(tokens) < size:
+            tokens.append(invites.create())
+        picks = [random.choice(tokens) for _ in range(args.checks)]
+        valid = per_check(invites, picks)
+        wrong = per_check(invites, [token[:-4] + 'AAAA' for token in picks])
+        unknown = per_check(invites, ['00000000.' + token.partition('.')[2] for token in picks])
+        rows.append([f"{size:,}", us(valid), us(wrong), us(unknown)])
+    table(['invites', 'valid token', 'wrong secret', 'unknown key id'], rows)
+
+
+if __name__ == '__main__':
+    main()
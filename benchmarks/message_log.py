@@ -0,0 +1,76 @@
+"""
+Append throughput and history lookup latency of the message log.
+
+Fills a log with --messages records spread over --peers peers, then times
+history lookups of the latest 50 records and of those since a point in the
+middle, and how long the log takes to open again. For a 10M-message log
+pass --messages 10000000, which needs about 2 GB of disk.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from common import ms, percentile, table
+
+from src.storage import MessageLog, OUTBOUND
+
+
+def lookups(log, peers, count, since=None):
+    latencies = []
+    for _ in range(count):
+        peer_id = random.choice(peers)
+        started = time.perf_counter()
+        log.history(peer_id, since=since)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--peers', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=100, help="message length in characters")
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--segment-size', type=int, default=64 * 1024 * 1024)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='n0ctua-bench-')
+    key = os.urandom(32)
+    peers = [f"peer{i}" for i in range(args.peers)]
+    body = 'x' * args.size
+    try:
+        log = MessageLog(directory, segment_size=args.segment_size, key=key)
+        started = time.perf_counter()
+        middle = None
+        for i in range(args.messages):
+            log.append(peers[i % args.peers], None, body, OUTBOUND if i & 1 else 0)
+            if i == args.messages // 2:
+                middle = datetime.now()
+        log.flush()
+        elapsed = time.perf_counter() - started
+        log.close()
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print(f"appended {args.messages} messages of {args.size} characters in {elapsed:.2f} s: "
+              f"{args.messages / elapsed:,.0f} messages/s, {size / 2 ** 20:.0f} MiB on disk")
+
+        started = time.perf_counter()
+        log = MessageLog(directory, segment_size=args.segment_size, key=key)
+        print(f"opened the log again in {ms(time.perf_counter() - started)}")
+
+        rows = []
+        for name, since in (('latest 50', None), ('since the middle, latest 50', middle)):
+            latencies = lookups(log, peers, args.lookups, since)
+            rows.append([name, ms(percentile(latencies, 0.5)), ms(percentile(latencies, 0.99)),
+                         ms(max(latencies))])
+        log.close()
+        table(['history lookup', 'p50', 'p99', 'max'], rows)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
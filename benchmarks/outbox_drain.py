@@ -0,0 +1,63 @@
+"""
+Drain throughput of the outbox after a reconnect.
+
+Bob connects to Alice once and leaves; Alice then stores --messages messages
+for him. The figure is the time from Bob's reconnect until his handlers have
+every message, and until Alice's outbox is acknowledged empty.
+"""
+import argparse
+import time
+
+from common import Nodes, wait_for
+
+from src.pipeline import Handler
+
+
+class Counter(Handler):
+    """Counts the messages a node's pipeline delivers"""
+    name = 'counter'
+
+    def __init__(self, peer):
+        self.count = 0
+        peer.counter = self
+
+    def handle(self, messages):
+        self.count += len(messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--size', type=int, default=100, help="message length in characters")
+    parser.add_argument('--batch', type=int, default=256, help="storage.outbox_batch")
+    args = parser.parse_args()
+
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_capacity': 256 * 1024 * 1024,
+                  'storage.outbox_batch': args.batch, 'pipeline.handlers': f'{__name__}:Counter'}) as nodes:
+        alice, bob = nodes.start('Alice'), nodes.start('Bob')
+        nodes.connect(bob, alice)
+        nodes.disconnect(bob)
+        wait_for(lambda: not alice.peers, 10)
+
+        body = 'x' * args.size
+        started = time.perf_counter()
+        for i in range(args.messages):
+            alice.outbox.enqueue('Bob', f"{i} {body}")
+        elapsed = time.perf_counter() - started
+        print(f"stored {args.messages} messages in {elapsed:.2f} s: {args.messages / elapsed:,.0f} messages/s "
+              f"(one fsync each)")
+
+        ring = alice.outbox.get('Bob')
+        started = time.perf_counter()
+        nodes.connect(bob, alice)
+        if not wait_for(lambda: bob.counter.count >= args.messages, 600):
+            raise SystemExit(f"Bob got only {bob.counter.count} of {args.messages}")
+        delivered = time.perf_counter() - started
+        wait_for(lambda: not len(ring), 60)
+        trimmed = time.perf_counter() - started
+        print(f"drained {args.messages} messages in {delivered:.2f} s after the reconnect: "
+              f"{args.messages / delivered:,.0f} messages/s; outbox empty after {trimmed:.2f} s")
+
+
+if __name__ == '__main__':
+    main()
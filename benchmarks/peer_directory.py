@@ -0,0 +1,102 @@
+"""
+Lookup and iteration cost of the peer directory.
+
+Fills a PeerDirectory with --peers records and times each kind of lookup,
+iteration over a snapshot, and add plus remove. For comparison it times the
+same lookups on a plain dict of socket -> (peer_id, address, session_id),
+which has to be scanned for anything but the socket.
+"""
+import argparse
+import random
+import time
+
+from common import table
+
+from src.directory import PeerDirectory
+
+
+def per_call(function, keys):
+    """Returns the mean seconds of function(key) over keys"""
+    started = time.perf_counter()
+    for key in keys:
+        function(key)
+    return (time.perf_counter() - started) / len(keys)
+
+
+def scan(peers, position, value):
+    for peer_socket, entry in peers.items():
+        if entry[position] == value:
+            return peer_socket
+    return None
+
+
+def ns(seconds):
+    return f"{seconds * 1e9:,.0f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=100000, help="lookups of each kind in the directory")
+    parser.add_argument('--scans', type=int, default=1000, help="lookups of each kind that scan the plain dict")
+    args = parser.parse_args()
+
+    directory, plain = PeerDirectory(), {}
+    sockets = [object() for _ in range(args.peers)]
+    for i, peer_socket in enumerate(sockets):
+        peer_id, address, session_id = f"peer{i}", ('10.0.0.1', 10000 + i), f"session{i}"
+        directory.add(peer_socket, peer_id, address, session_id, None)
+        plain[peer_socket] = (peer_id, address, session_id)
+
+    picks = [random.randrange(args.peers) for _ in range(args.lookups)]
+    scans = picks[:args.scans]
+    rows = [
+        ['socket', ns(per_call(directory.get, [sockets[i] for i in picks])),
+         ns(per_call(plain.get, [sockets[i] for i in picks]))],
+        ['peer ID', ns(per_call(directory.get_by_peer_id, [f"peer{i}" for i in picks])),
+         ns(per_call(lambda value: scan(plain, 0, value), [f"peer{i}" for i in scans]))],
+        ['session ID', ns(per_call(directory.get_by_session, [f"session{i}" for i in picks])),
+         ns(per_call(lambda value: scan(plain, 2, value), [f"session{i}" for i in scans]))],
+        ['address', ns(per_call(directory.get_by_address, [('10.0.0.1', 10000 + i) for i in picks])),
+         ns(per_call(lambda value: scan(plain, 1, value), [('10.0.0.1', 10000 + i) for i in scans]))],
+    ]
+    table([f"lookup by ({args.peers} peers)", 'directory', 'dict scan'], rows)
+    print()
+
+    rounds = 100
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for _ in directory.snapshot():
+            pass
+    iterate = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for _ in list(plain.items()):
+            pass
+    iterate_plain = (time.perf_counter() - started) / rounds
+
+    churn = sockets[:rounds]
+    started = time.perf_counter()
+    for peer_socket in churn:
+        record = directory.remove(peer_socket)
+        directory.add(peer_socket, record.peer_id, record.address, record.session_id, None)
+        directory.snapshot()
+    rebuild = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    for peer_socket in churn:
+        record = directory.remove(peer_socket)
+        directory.add(peer_socket, record.peer_id, record.address, record.session_id, None)
+    change = (time.perf_counter() - started) / rounds
+
+    table(['operation', 'time'], [
+        ['iterate a snapshot', ns(iterate)],
+        ['iterate a copy of the plain dict', ns(iterate_plain)],
+        ['remove and add a peer', ns(change)],
+        ['remove and add a peer, then take a snapshot', ns(rebuild)],
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Handler latency with and without a slow handler next to it, by stage.
+
+Alice sends Bob --messages direct messages, one every --interval seconds.
+Bob's pipeline runs a handler that times each message from the send, once
+on its own and once next to one that sleeps --stall seconds on every batch.
+The fast handler's latency should not depend on the slow one. The stage
+table is Bob's pipeline snapshot after the second run, as the pipeline
+command shows it.
+"""
+import argparse
+import time
+
+from common import Nodes, ms, percentile, table, wait_for
+
+from src.pipeline import Handler
+
+
+class Stalling(Handler):
+    """Sleeps on every batch"""
+    name = 'stalling'
+    stall = 0.05
+
+    def __init__(self, peer):
+        pass
+
+    def handle(self, messages):
+        time.sleep(self.stall)
+
+
+def latency(seconds):
+    return ms(seconds) if seconds is not None else '-'
+
+
+def run(handlers, messages, interval):
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0,
+                  'pipeline.handlers': handlers}) as nodes:
+        alice, bob = nodes.start('Alice'), nodes.start('Bob', listen=False)
+        nodes.connect(bob, alice)
+        for _ in range(messages):
+            alice.network.send_to_peer('Bob', f"{time.perf_counter()} hello")
+            time.sleep(interval)
+        if not wait_for(lambda: bob.probe.count >= messages, 60):
+            raise SystemExit(f"Bob's probe got only {bob.probe.count} of {messages}")
+        bob.pipeline.drain(60)
+        return bob.probe.latencies, bob.pipeline.snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--interval', type=float, default=0.002, help="seconds between messages")
+    parser.add_argument('--stall', type=float, default=0.05, help="seconds the slow handler sleeps per batch")
+    args = parser.parse_args()
+    Stalling.stall = args.stall
+
+    rows = []
+    for name, handlers in (('on its own', 'common:Probe'),
+                           ('next to a slow handler', f'common:Probe,{__name__}:Stalling')):
+        latencies, (stats, stages) = run(handlers, args.messages, args.interval)
+        rows.append([name, ms(percentile(latencies, 0.5)), ms(percentile(latencies, 0.99)), ms(max(latencies))])
+    table(['fast handler', 'p50', 'p99', 'max'], rows)
+    print()
+
+    table(['stage', 'items', 'per batch', 'peak queued', 'overflow', 'p50', 'p99'], [
+        [stage['name'], stage['items'], f"{stage['items'] / stage['batches']:.1f}" if stage['batches'] else '-',
+         stage['peak'], stage['overflow'], latency(stage['p50']), latency(stage['p99'])]
+        for stage in stages
+    ])
+    print(f"end to end, with the slow handler: p50 {latency(stats['p50'])}, p99 {latency(stats['p99'])}")
+
+
+if __name__ == '__main__':
+    main()
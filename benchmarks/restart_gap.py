@@ -0,0 +1,138 @@
+"""
+The gap in delivery while a node restarts with --takeover.
+
+Bob runs as main.py with network.handoff_socket set, and Alice, in this
+process, sends him a numbered direct message every --interval seconds. Then
+--restarts times a new main.py --takeover replaces the running one. For each
+restart the figures are how long the old process took to hand over and exit,
+the longest wait between two messages reaching Bob's output around it, and
+whether any message went missing or arrived twice. Alice's connection to
+Bob must survive all of it.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from common import ROOT, Nodes, ms, percentile, quiet, table, wait_for
+
+TICK = re.compile(r'tick (\d+)')
+ANSI = re.compile(r'\x1b\[[0-9;]*m')
+
+
+class Bob:
+    """The main.py processes that are Bob in turn, and when each tick reached their output"""
+
+    def __init__(self, directory):
+        self.arguments = [f"--config={os.path.join(directory, 'none.conf')}",
+                          '--set=network.bind_address=127.0.0.1',
+                          f"--set=network.handoff_socket={os.path.join(directory, 'bob.sock')}",
+                          f"--set=storage.history_dir={os.path.join(directory, 'history')}",
+                          f"--set=storage.outbox_dir={os.path.join(directory, 'outbox')}"]
+        self.arrivals = {}
+        self.duplicates = 0
+        self.lines = []
+        self.lock = threading.Lock()
+
+    def launch(self, *arguments):
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'main.py'), *arguments, *self.arguments],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   env=dict(os.environ, PYTHONUNBUFFERED='1'))
+        threading.Thread(target=self._read, args=(process,), daemon=True).start()
+        return process
+
+    def _read(self, process):
+        for line in iter(process.stdout.readline, b''):
+            now = time.perf_counter()
+            text = ANSI.sub('', line.decode(errors='replace'))
+            with self.lock:
+                self.lines.append(text)
+                for match in TICK.finditer(text):
+                    number = int(match.group(1))
+                    if number in self.arrivals:
+                        self.duplicates += 1
+                    self.arrivals[number] = now
+
+    def connection_string(self):
+        for i, line in enumerate(self.lines):
+            if 'Connection string' in line and i + 1 < len(self.lines):
+                return self.lines[i + 1].strip()
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--restarts', type=int, default=3)
+    parser.add_argument('--interval', type=float, default=0.005, help="seconds between messages")
+    parser.add_argument('--settle', type=float, default=2.0, help="seconds of traffic before and after a restart")
+    args = parser.parse_args()
+
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0}) as nodes:
+        bob = Bob(nodes.directory)
+        current = bob.launch('--id=Bob')
+        if not wait_for(bob.connection_string, 30, 0.05):
+            raise SystemExit("Bob did not start: " + ''.join(bob.lines))
+        alice = nodes.start('Alice', listen=False)
+        with quiet():
+            alice.connect_to_peer(bob.connection_string())
+        if not wait_for(lambda: alice.peers.has_peer_id('Bob'), 10):
+            raise SystemExit("Alice could not connect to Bob")
+        record = alice.peers.get_by_peer_id('Bob')
+
+        stop = threading.Event()
+        sent = []
+
+        def send():
+            number = 0
+            while not stop.is_set():
+                sent.append(time.perf_counter())
+                alice.network.send_to_peer('Bob', f"tick {number}")
+                number += 1
+                time.sleep(args.interval)
+
+        sender = threading.Thread(target=send, daemon=True)
+        sender.start()
+        time.sleep(args.settle)
+
+        restarts = []
+        for _ in range(args.restarts):
+            started = time.perf_counter()
+            successor = bob.launch('--takeover')
+            code = current.wait(30)
+            handed_over = time.perf_counter() - started
+            time.sleep(args.settle)
+            restarts.append((started, handed_over, code))
+            current = successor
+
+        stop.set()
+        sender.join()
+        wait_for(lambda: len(bob.arrivals) >= len(sent), 5, 0.01)
+        kept = alice.peers.get_by_peer_id('Bob') is record
+        current.stdin.write(b'quit\n')
+        current.stdin.flush()
+        try:
+            current.wait(5)
+        except subprocess.TimeoutExpired:
+            current.kill()
+
+    arrivals = bob.arrivals
+    times = sorted(arrivals.values())
+    gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+    rows = []
+    for i, (started, handed_over, code) in enumerate(restarts, 1):
+        around = [later - earlier for earlier, later in zip(times, times[1:])
+                  if started - args.settle / 2 <= earlier <= started + args.settle]
+        rows.append([i, ms(handed_over), code, ms(max(around, default=0))])
+    table(['restart', 'old process exited after', 'exit code', 'longest gap between messages'], rows)
+    print(f"messages sent {len(sent)}, received {len(arrivals)}, missing {len(sent) - len(arrivals)}, "
+          f"duplicates {bob.duplicates}")
+    print(f"gap between messages over the whole run: p50 {ms(percentile(gaps, 0.5))}, "
+          f"p99 {ms(percentile(gaps, 0.99))}")
+    print(f"Alice kept her connection to Bob: {'yes' if kept else 'no'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Throughput while sessions rotate continuously.
+
+Alice sends Bob --size character direct messages as fast as flow control
+lets her, for --seconds without rotations and then for --seconds with one
+every --every seconds. A rotation is forced by moving Alice's session clock
+on by session.rotation_interval, at its minimum here, so the next message she
+sends rotates the session and rekeys the connection as it would after that
+much time. Bob's throughput is sampled every --window seconds; it should be
+as flat with rotations as without.
+"""
+import argparse
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+
+from common import Nodes, table, wait_for
+
+from src.utils.config import SCHEMA
+
+
+class SessionClock:
+    """Wall clock for a session manager, moved on by a rotation interval at a time"""
+
+    def __init__(self):
+        self.offset = timedelta()
+
+    def __call__(self):
+        return datetime.now() + self.offset
+
+
+def phase(alice, bob, clock, body, seconds, window, rotate_every):
+    """Returns the messages per second Bob handled in each window, and the rotations done"""
+    interval = timedelta(seconds=alice.session_manager.config['rotation_interval'])
+    rotations = alice.session_manager.rotations
+    stop = threading.Event()
+
+    def rotate():
+        while not stop.wait(rotate_every):
+            clock.offset += interval
+
+    rotator = threading.Thread(target=rotate, daemon=True)
+    if rotate_every:
+        rotator.start()
+
+    rates = []
+    last_count, last_time = bob.probe.count, time.perf_counter()
+    deadline = last_time + seconds
+    next_sample = last_time + window
+    while True:
+        if not alice.network.send_to_peer('Bob', f"{time.perf_counter()} {body}"):
+            raise SystemExit("A send failed")
+        now = time.perf_counter()
+        if now >= next_sample:
+            count = bob.probe.count
+            rates.append((count - last_count) / (now - last_time))
+            last_count, last_time = count, now
+            next_sample = now + window
+            if now >= deadline:
+                break
+    stop.set()
+    if rotate_every:
+        rotator.join()
+    return rates, alice.session_manager.rotations - rotations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--every', type=float, default=0.05, help="seconds between rotations")
+    parser.add_argument('--window', type=float, default=0.25, help="seconds per throughput sample")
+    parser.add_argument('--size', type=int, default=1024, help="message length in characters")
+    args = parser.parse_args()
+
+    minimum = SCHEMA['session']['rotation_interval'].bounds[0]
+    with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0, 'pipeline.handlers': 'common:Probe',
+                  'session.rotation_interval': minimum}) as nodes:
+        alice, bob = nodes.start('Alice'), nodes.start('Bob', listen=False)
+        clock = alice.session_manager.clock = SessionClock()
+        nodes.connect(bob, alice)
+        record = alice.peers.get_by_peer_id('Bob')
+
+        rows = []
+        body = 'x' * args.size
+        for name, every in (('no rotations', 0), (f"rotating every {args.every * 1000:.0f} ms", args.every)):
+            rates, rotations = phase(alice, bob, clock, body, args.seconds, args.window, every)
+            rows.append([name, rotations, f"{statistics.mean(rates):,.0f}", f"{min(rates):,.0f}",
+                         f"{max(rates):,.0f}"])
+        sent = alice.network.stream_stats(record)['sent']
+        acked = wait_for(lambda: alice.network.stream_stats(record)['acked'] >= sent, 10)
+        kept = alice.peers.get_by_peer_id('Bob') is record
+
+    table(['', 'rotations', 'messages/s, mean', 'lowest window', 'highest window'], rows)
+    print(f"Bob handled {bob.probe.count} messages; connection kept: {'yes' if kept else 'no'}, "
+          f"every frame acknowledged: {'yes' if acked else 'no'}")
+
+
+if __name__ == '__main__':
+    main()
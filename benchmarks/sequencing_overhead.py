@@ -0,0 +1,107 @@
+"""
+Per-message overhead of sequence numbers and acknowledgements.
+
+First the CPU the sender spends on them for each frame: recording the frame
+in its send window, releasing it again on a cumulative acknowledgement every
+--ack-every frames, and packing the two u32 fields into the header. Then the
+bytes on the wire between two nodes: Alice sends --messages direct messages
+to Bob, once one way only and once as a conversation where they take turns,
+which lets acknowledgements ride on messages going the other way. Standalone
+acknowledgements count with their frame header and seal.
+"""
+import argparse
+import struct
+import time
+
+from common import Nodes, table, wait_for
+
+from src.network import FRAME_HEADER, SEAL_OVERHEAD
+from src.sequencing import SendWindow
+
+# The frame header without the sequence and acknowledgement fields
+BARE_HEADER = struct.Struct('>IB')
+
+
+def per_frame(function, frames):
+    started = time.perf_counter()
+    function(frames)
+    return (time.perf_counter() - started) / frames
+
+
+def window_cost(frames, ack_every):
+    def run(count):
+        window = SendWindow()
+        for seq in range(1, count + 1):
+            window.push(141)
+            if not seq % ack_every:
+                window.ack(seq)
+    return per_frame(run, frames)
+
+
+def header_cost(header, frames):
+    def run(count):
+        pack = header.pack
+        if header is FRAME_HEADER:
+            for seq in range(1, count + 1):
+                pack(141, 3, seq, seq)
+        else:
+            for _ in range(count):
+                pack(141, 3)
+    return per_frame(run, frames)
+
+
+def conversation(alice, bob, messages, both_ways):
+    senders = (alice, bob) if both_ways else (alice,)
+    for i in range(messages):
+        sender = senders[i % len(senders)]
+        sender.network.send_to_peer('Bob' if sender is alice else 'Alice', f"{time.perf_counter()} hello there")
+        time.sleep(0.001)
+
+
+def stats(node, peer_id):
+    return node.network.stream_stats(node.peers.get_by_peer_id(peer_id))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=1000000, help="frames for the CPU figures")
+    parser.add_argument('--ack-every', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    window = window_cost(args.frames, args.ack_every)
+    bare, full = header_cost(BARE_HEADER, args.frames), header_cost(FRAME_HEADER, args.frames)
+    table(['sender CPU per frame', 'time'], [
+        ['send window push, and release', f"{window * 1e9:,.0f} ns"],
+        ['header with sequence fields', f"{full * 1e9:,.0f} ns"],
+        ['header without them', f"{bare * 1e9:,.0f} ns"],
+    ])
+    print()
+
+    ack_frame = FRAME_HEADER.size + SEAL_OVERHEAD
+    sequence_fields = FRAME_HEADER.size - BARE_HEADER.size
+    rows = []
+    for name, both_ways in (('one way', False), ('taking turns', True)):
+        with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0,
+                      'pipeline.handlers': 'common:Probe'}) as nodes:
+            alice, bob = nodes.start('Alice'), nodes.start('Bob', listen=False)
+            nodes.connect(bob, alice)
+            before = [dict(stats(alice, 'Bob')), dict(stats(bob, 'Alice'))]
+            conversation(alice, bob, args.messages, both_ways)
+            expected = args.messages if not both_ways else args.messages // 2
+            wait_for(lambda: bob.probe.count >= expected, 30)
+            # Lets the delayed acknowledgements go out
+            time.sleep(0.5)
+            after = [stats(alice, 'Bob'), stats(bob, 'Alice')]
+            standalone = sum(a['acks_sent'] - b['acks_sent'] for a, b in zip(after, before))
+            piggybacked = sum(a['acks_piggybacked'] - b['acks_piggybacked'] for a, b in zip(after, before))
+            overhead = sequence_fields + standalone * ack_frame / args.messages
+            rows.append([name, f"{standalone / args.messages:.3f}", f"{piggybacked / args.messages:.3f}",
+                         f"{overhead:.1f} B"])
+    table([f"{args.messages} messages", 'standalone acks per message', 'piggybacked per message',
+           'sequencing bytes per message'], rows)
+    print(f"every frame carries {sequence_fields} B of sequence fields; a standalone ack is {ack_frame} B")
+
+
+if __name__ == '__main__':
+    main()
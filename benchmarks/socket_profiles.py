@@ -0,0 +1,57 @@
+"""
+Loopback latency and throughput under each socket profile.
+
+For each profile Bob connects to Alice, both with network.socket_profile set
+to it. Alice then sends --pings short direct messages one at a time, each
+after Bob's handlers got the previous one, and times each from the send to
+the handler. Then she sends --bulk messages of --bulk-size characters back
+to back, timed until Bob's handlers have them all.
+"""
+import argparse
+import time
+
+from common import Nodes, ms, percentile, table
+
+from src.sockopts import PROFILES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pings', type=int, default=200)
+    parser.add_argument('--bulk', type=int, default=2000)
+    parser.add_argument('--bulk-size', type=int, default=64 * 1024)
+    args = parser.parse_args()
+
+    rows = []
+    for profile in PROFILES:
+        with Nodes(**{'storage.history_enabled': 0, 'storage.outbox_enabled': 0,
+                      'network.socket_profile': profile, 'pipeline.handlers': 'common:Probe'}) as nodes:
+            alice, bob = nodes.start('Alice'), nodes.start('Bob', listen=False)
+            nodes.connect(bob, alice)
+            probe = bob.probe
+
+            for _ in range(args.pings):
+                probe.arrived.clear()
+                alice.network.send_to_peer('Bob', f"{time.perf_counter()} ping")
+                if not probe.arrived.wait(10):
+                    raise SystemExit(f"{profile}: a ping did not arrive")
+            latencies = probe.latencies[:]
+
+            body = 'x' * args.bulk_size
+            expected = probe.count + args.bulk
+            started = time.perf_counter()
+            for _ in range(args.bulk):
+                alice.network.send_to_peer('Bob', f"{time.perf_counter()} {body}")
+            while probe.count < expected:
+                if not probe.arrived.wait(30):
+                    raise SystemExit(f"{profile}: Bob got {probe.count - expected + args.bulk} of {args.bulk}")
+                probe.arrived.clear()
+            elapsed = time.perf_counter() - started
+
+            rows.append([profile, ms(percentile(latencies, 0.5)), ms(percentile(latencies, 0.99)),
+                         f"{args.bulk * args.bulk_size / elapsed / 1e6:,.0f} MB/s"])
+    table(['profile', 'ping p50', 'ping p99', 'bulk throughput'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Node startup time, from launching main.py until it accepts a connection.
+
+Starts main.py --startup-trace --runs times. Each time a connection to its
+port is attempted every millisecond until one is accepted, which makes the
+node print its startup trace. Prints the median of each trace milestone,
+counted from the first line of main.py, the time from launch until the port
+took a connection, and for reference how long the interpreter takes to run
+nothing. Connections the port takes before the node is ready wait in the
+listen backlog.
+"""
+import argparse
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, ms, table
+
+MARK = re.compile(r'^\s+(.+?)\s+([\d.]+) ms\s')
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def launch(directory):
+    """Starts one node and returns the seconds until its port took a connection, and its trace"""
+    port = free_port()
+    command = [sys.executable, os.path.join(ROOT, 'main.py'), '--startup-trace', '--id=Bench', f"--port={port}",
+               f"--config={os.path.join(directory, 'none.conf')}", '--set=network.bind_address=127.0.0.1',
+               f"--set=storage.history_dir={os.path.join(directory, 'history')}",
+               f"--set=storage.outbox_dir={os.path.join(directory, 'outbox')}"]
+    started = time.perf_counter()
+    node = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            env=dict(os.environ, PYTHONUNBUFFERED='1'), text=True)
+    try:
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                if node.poll() is not None:
+                    raise SystemExit(f"main.py exited: {node.stdout.read()}")
+                time.sleep(0.001)
+        connectable = time.perf_counter() - started
+
+        marks = {}
+        for line in node.stdout:
+            match = MARK.match(line)
+            if match:
+                marks[match.group(1)] = float(match.group(2)) / 1000
+                if match.group(1) == 'first accept':
+                    break
+        return connectable, marks
+    finally:
+        node.kill()
+        node.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], check=True)
+        baseline.append(time.perf_counter() - started)
+
+    connectable, marks = [], {}
+    with tempfile.TemporaryDirectory(prefix='n0ctua-bench-') as directory:
+        for _ in range(args.runs):
+            seconds, trace = launch(directory)
+            connectable.append(seconds)
+            for name, at in trace.items():
+                marks.setdefault(name, []).append(at)
+
+    rows = [[f"trace: {name}", ms(statistics.median(values))] for name, values in marks.items()]
+    rows.append(['port took a connection, from launch', ms(statistics.median(connectable))])
+    rows.append(['python -c pass, for reference', ms(statistics.median(baseline))])
+    table([f"median of {args.runs} runs", 'time'], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+CPU and bytes per message for one recipient out of many, sent directly or
+broadcast.
+
+Alice has --peers connected peers. She sends --messages messages to one of
+them with send_to_peer, as the msg command does, and then broadcasts the
+same number to everyone, which is how a message for one peer went out
+before direct messages. CPU is the sending thread's own time, with sealing
+kept on that thread.
+"""
+import argparse
+import time
+
+from common import Nodes, Sinks, table
+
+
+def run(sinks, send, messages):
+    before = sinks.settle()
+    started = time.thread_time()
+    for _ in range(messages):
+        send()
+    cpu = time.thread_time() - started
+    return cpu / messages, (sinks.settle() - before) / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--peers', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--size', type=int, default=100, help="message length in characters")
+    args = parser.parse_args()
+
+    overrides = {'storage.history_enabled': 0, 'storage.outbox_enabled': 0,
+                 'network.crypto_inline_threshold': 1024 ** 3,
+                 'network.flow_window': 256 * 1024 * 1024, 'network.flow_frames': 1000000}
+    with Nodes(**overrides) as nodes:
+        alice = nodes.start('Alice', listen=False)
+        with Sinks(alice, args.peers) as sinks:
+            message = 'x' * args.size
+            rows = []
+            for name, send in (('msg to one peer', lambda: alice.network.send_to_peer('peer7', message)),
+                               ('broadcast', lambda: alice.network.broadcast_message(message))):
+                cpu, sent = run(sinks, send, args.messages)
+                rows.append([name, f"{cpu * 1e6:,.0f} us", f"{sent:,.0f} B"])
+            table([f"1 of {args.peers} peers", 'CPU per message', 'bytes written per message'], rows)
+
+
+if __name__ == '__main__':
+    main()
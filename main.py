@@ -1,16 +1,32 @@
 #!/usr/bin/env python3
 
+import time
+STARTED = time.perf_counter()
+
 import sys
-from src.peer import SecurePeer
+# Only light modules here: the listener is bound before the node itself is imported
+from src.utils.config import load_settings, parse_overrides
+from src.utils.trace import StartupTrace
+from src.sockopts import create_listener
 
 def main():
     peer_id = None
     listen_port = None
+    config_path = None
+    trace = None
+    takeover = None
+    inherit = False
 
     if len(sys.argv) > 1:
         for arg in sys.argv[1:]:
             if arg.startswith('--id='):
                 peer_id = arg.split('=')[1]
+            elif arg.startswith('--config='):
+                config_path = arg.split('=', 1)[1]
+            elif arg == '--startup-trace':
+                trace = StartupTrace(STARTED)
+            elif arg == '--takeover':
+                inherit = True
             elif arg.startswith('--port='):
                 try:
                     listen_port = int(arg.split('=')[1])
@@ -18,7 +34,46 @@ def main():
                     print("[-] Invalid port")
                     return
 
-    peer = SecurePeer(listen_port=listen_port, peer_id=peer_id)
+    try:
+        settings = load_settings(config_path, parse_overrides(sys.argv[1:]))
+    except ValueError as e:
+        print(f"[-] Invalid configuration: {e}")
+        sys.exit(1)
+
+    if inherit:
+        # Loaded first, so the connections wait on the imports as little as possible
+        from src.peer import SecurePeer
+        from src.handoff import take_over
+        if not settings.network['handoff_socket']:
+            print("[-] --takeover needs network.handoff_socket")
+            sys.exit(1)
+        try:
+            takeover = take_over(settings.network['handoff_socket'], settings.network['handoff_timeout'])
+        except (OSError, ValueError) as e:
+            print(f"[-] Cannot take over from the running node: {e}")
+            sys.exit(1)
+        listen_socket = takeover.listen_socket
+    else:
+        try:
+            listen_socket = create_listener(settings.network, listen_port or 0)
+        except OSError as e:
+            print(f"[-] Cannot listen on port {listen_port or 0}: {e}")
+            sys.exit(1)
+        if trace:
+            trace.mark('listening')
+
+        from src.peer import SecurePeer
+        if trace:
+            trace.mark('modules loaded')
+
+    try:
+        peer = SecurePeer(listen_port=listen_port, peer_id=peer_id, settings=settings,
+                          listen_socket=listen_socket, trace=trace, takeover=takeover)
+    except Exception as e:
+        if takeover:
+            takeover.abort()
+        print(f"[-] Error starting peer: {e}")
+        sys.exit(1)
 
     try:
         peer.start()
@@ -27,4 +82,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
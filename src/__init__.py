@@ -1,4 +1,10 @@
-from .peer import SecurePeer
-
 __version__ = '1.0.0'
-__all__ = ['SecurePeer']
\ No newline at end of file
+__all__ = ['SecurePeer']
+
+
+def __getattr__(name):
+    # Deferred so that importing a submodule does not load the whole node
+    if name == 'SecurePeer':
+        from .peer import SecurePeer
+        return SecurePeer
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,160 @@
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TokenBucket:
+    """Refilling token bucket used to rate limit one source address"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def consume(self, now, amount=1.0):
+        """Takes tokens if available, returning False when the source is over its rate"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class HandshakeDeadline:
+    """Absolute deadline for a handshake, applied to each blocking socket step"""
+    __slots__ = ('expires_at',)
+
+    def __init__(self, timeout):
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def apply(self, peer_socket):
+        """Bounds the next socket operation by the time left on the deadline"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise socket.timeout("Handshake deadline exceeded")
+        peer_socket.settimeout(remaining)
+
+
+class AdmissionController:
+    """
+    Decides which accepted connections get a handshake worker.
+
+    Each source IP has a token bucket, and handshakes run on a bounded pool with
+    a bounded backlog of waiting connections. Connections over either limit are
+    closed right away instead of tying up a thread.
+    """
+
+    def __init__(self, workers=16, queue_size=64, rate=2.0, burst=10,
+                 handshake_timeout=10, max_sources=10000):
+        self.rate = rate
+        self.burst = burst
+        self.handshake_timeout = handshake_timeout
+        self.max_sources = max_sources
+
+        self.buckets = OrderedDict()  # {ip: TokenBucket}, least recently seen first
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handshake')
+
+        self.stats = {
+            'accepted': 0,
+            'rejected_rate': 0,
+            'rejected_busy': 0,
+            'timed_out': 0,
+            'failed': 0
+        }
+
+    def _bucket(self, ip):
+        bucket = self.buckets.get(ip)
+        if bucket is None:
+            bucket = self.buckets[ip] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_sources:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(ip)
+        return bucket
+
+    def allow(self, address):
+        """Checks the per-source rate limit for a new connection"""
+        with self.lock:
+            if self._bucket(address[0]).consume(time.monotonic()):
+                return True
+            self.stats['rejected_rate'] += 1
+            return False
+
+    def penalize(self, address):
+        """Spends the remaining burst of a source that failed authentication"""
+        with self.lock:
+            self.stats['failed'] += 1
+            bucket = self.buckets.get(address[0])
+            if bucket is not None:
+                bucket.tokens = 0.0
+
+    def timed_out(self):
+        with self.lock:
+            self.stats['timed_out'] += 1
+
+    def configure(self, rate, burst, handshake_timeout, max_sources):
+        """Applies new limits; sources start over with a full bucket at the new rate"""
+        with self.lock:
+            self.rate = rate
+            self.burst = burst
+            self.handshake_timeout = handshake_timeout
+            self.max_sources = max_sources
+            self.buckets.clear()
+
+    def deadline(self):
+        return HandshakeDeadline(self.handshake_timeout)
+
+    def submit(self, handler, peer_socket, address):
+        """
+        Runs handler(peer_socket, address, deadline) on the handshake pool.
+        Returns False and closes the socket if the connection is not admitted.
+        """
+        if not self.allow(address):
+            self._reject(peer_socket)
+            return False
+
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.stats['rejected_busy'] += 1
+            self._reject(peer_socket)
+            return False
+
+        with self.lock:
+            self.stats['accepted'] += 1
+
+        # The deadline starts at accept time, so time spent queued counts against it
+        deadline = self.deadline()
+
+        def run():
+            try:
+                handler(peer_socket, address, deadline)
+            finally:
+                self.slots.release()
+
+        try:
+            self.executor.submit(run)
+        except RuntimeError:
+            self.slots.release()
+            self._reject(peer_socket)
+            return False
+        return True
+
+    @staticmethod
+    def _reject(peer_socket):
+        try:
+            peer_socket.close()
+        except OSError:
+            pass
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,71 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+from .utils.helpers import parse_connection_string
+
+CONNECTED = 'connected'
+DUPLICATE = 'already connected'
+FAILED = 'failed'
+
+
+@dataclass(frozen=True)
+class ConnectResult:
+    connection_string: str
+    peer_id: Optional[str]
+    status: str
+    elapsed: float  # seconds from the start of this connection until it succeeded or failed
+    error: Optional[str] = None
+
+
+def read_connection_strings(path: str) -> List[str]:
+    """Connection strings in a file, one per line, skipping blank lines, # comments and repeats"""
+    with open(path, encoding='utf-8') as strings_file:
+        lines = (line.strip() for line in strings_file)
+        return list(dict.fromkeys(line for line in lines if line and not line.startswith('#')))
+
+
+def connect_many(peer, connection_strings: Sequence[str], parallelism: int) -> List[ConnectResult]:
+    """
+    Connects to every peer in connection_strings, running up to parallelism
+    handshakes at a time. Returns one result per string, in the same order.
+
+    A string whose address is this node's own or already has a connection is
+    skipped without dialing. Otherwise each handshake stops once the remote ID
+    is known if that peer is already connected, or being connected by another
+    string in the batch, so a peer is linked once and its RSA key exchange
+    runs once.
+    """
+    claimed = set()
+    lock = threading.Lock()
+
+    def claim(peer_id: str) -> bool:
+        with lock:
+            if peer_id == peer.peer_id or peer_id in claimed or peer.peers.has_peer_id(peer_id):
+                return False
+            claimed.add(peer_id)
+            return True
+
+    def connect(connection_string: str) -> ConnectResult:
+        started = time.perf_counter()
+        try:
+            candidates, _ = parse_connection_string(connection_string)
+            for candidate in candidates:
+                if candidate[1] == peer.listen_port and candidate[0] in peer.hosts:
+                    return ConnectResult(connection_string, peer.peer_id, DUPLICATE, 0.0)
+                record = peer.peers.get_by_address(candidate)
+                if record is not None:
+                    return ConnectResult(connection_string, record.peer_id, DUPLICATE, 0.0)
+            peer_id, connected = peer.open_connection(connection_string, claim)
+        except Exception as e:
+            return ConnectResult(connection_string, None, FAILED, time.perf_counter() - started,
+                                 str(e) or type(e).__name__)
+        return ConnectResult(connection_string, peer_id, CONNECTED if connected else DUPLICATE,
+                             time.perf_counter() - started)
+
+    if not connection_strings:
+        return []
+    workers = max(1, min(parallelism, len(connection_strings)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='connect') as executor:
+        return list(executor.map(connect, connection_strings))
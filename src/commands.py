@@ -1,7 +1,13 @@
+import threading
+import time
 from datetime import datetime
 from .ui import format_error_message, format_chat_message, format_prompt
-from .utils.helpers import clear_screen
+from .utils.helpers import clear_screen, parse_duration, parse_since
+from .bootstrap import CONNECTED, DUPLICATE, read_connection_strings
+from .utils.memory import connection_footprint, process_rss
 from .session import SessionError
+from .storage import StorageError, OUTBOUND
+from .sockopts import format_socket_info, socket_info
 from .ui.formatting import Fore, Style
 
 class CommandHandler:
@@ -10,6 +16,7 @@ class CommandHandler:
         self.commands = {
             'c': self.handle_connect,
             'connect': self.handle_connect,
+            'connect-many': self.handle_connect_many,
             'h': self.show_help,
             'help': self.show_help,
             'clear': lambda x: clear_screen() or True,
@@ -17,7 +24,14 @@ class CommandHandler:
             'exit': self.handle_exit,
             'quit': self.handle_exit,
             'sair': self.handle_exit,
-            'sessions': self.show_active_sessions
+            'sessions': self.show_active_sessions,
+            'memory': self.show_memory,
+            'pipeline': self.show_pipeline,
+            'history': self.show_history,
+            'invite': self.handle_invite,
+            'msg': self.handle_direct_message,
+            'room': self.handle_room,
+            'say': self.handle_room_message
         }
 
     def show_help(self, *args):
@@ -25,7 +39,17 @@ class CommandHandler:
         help_text = f"""
 {Fore.CYAN}=== Available Commands ==={Style.RESET_ALL}
     {Fore.GREEN}c, connect{Fore.RESET} <string>  - Connects to another peer using the connection string
+    {Fore.GREEN}connect-many{Fore.RESET} <file> [n] - Connects to every connection string in a file, n at a time
+    {Fore.GREEN}msg{Fore.RESET} <peer> <text>     - Sends a message to a single peer
+    {Fore.GREEN}room{Fore.RESET} create <name> [peers] - Creates a room (also: add, remove, delete, list)
+    {Fore.GREEN}say{Fore.RESET} <room> <text>     - Sends a message to the members of a room
     {Fore.GREEN}sessions{Fore.RESET}           - Shows information about active sessions
+    {Fore.GREEN}memory{Fore.RESET}             - Shows the memory held per connected peer, by component
+    {Fore.GREEN}pipeline{Fore.RESET}           - Shows the message handler stages and their latency
+    {Fore.GREEN}history{Fore.RESET} <peer> [since] - Shows stored messages (since: 30m, 2h, 1d, HH:MM or ISO date)
+    {Fore.GREEN}invite{Fore.RESET} [ttl] [uses]   - Creates an invite (ttl: 45s, 30m, 2h, 1d)
+    {Fore.GREEN}invite list{Fore.RESET}          - Lists outstanding invites
+    {Fore.GREEN}invite revoke{Fore.RESET} <id>   - Revokes an invite
     {Fore.GREEN}h, help{Fore.RESET}             - Shows this help message
     {Fore.GREEN}clear, cls{Fore.RESET}          - Clears the screen
     {Fore.GREEN}exit, quit, sair{Fore.RESET}    - Closes the program
@@ -37,24 +61,60 @@ class CommandHandler:
         """Shows currently active sessions"""
         try:
             active_sessions = []
-            for socket, (peer_id, address, session_id) in self.peer.peers.items():
-                if self.peer.session_manager.is_session_valid(session_id):
-                    session_info = self.peer.session_manager.get_session_info(session_id)
-                    active_sessions.append(f"Peer: {peer_id}, Session: {session_id[:8]}..., "
-                                           f"Created: {session_info['created_at'].strftime('%H:%M:%S')}")
+            for record in self.peer.peers.snapshot():
+                if self.peer.session_manager.is_session_valid(record.session_id):
+                    session_info = self.peer.session_manager.get_session_info(record.session_id)
+                    details = []
+                    try:
+                        details.append(f"TCP: {format_socket_info(socket_info(record.socket))}")
+                    except OSError:
+                        pass
+                    stream = self.peer.network.stream_stats(record)
+                    if stream:
+                        details.append(f"Frames: sent={stream['sent']}, acked={stream['acked']}, "
+                                       f"in flight={stream['in_flight']} ({stream['in_flight_bytes']} bytes), "
+                                       f"received={stream['received']}, acks={stream['acks_sent']} standalone + "
+                                       f"{stream['acks_piggybacked']} piggybacked")
+                        details.append(f"Flow: credit={stream['credit_bytes'] // 1024}K/{stream['credit_frames']} frames, "
+                                       f"queued={stream['queued']} ({stream['queued_bytes']} bytes, "
+                                       f"peak {stream['queue_peak']}), stalls={stream['stalls']} "
+                                       f"({stream['stalled_time']:.2f}s), producer waits={stream['producer_waits']} "
+                                       f"({stream['producer_wait_time']:.2f}s)")
+                    datagram = self.peer.datagram.path_stats(record.socket) if self.peer.datagram else None
+                    if datagram:
+                        rtt = f"{datagram['rtt'] * 1000:.2f}ms" if datagram['rtt'] is not None else "-"
+                        details.append(f"UDP: rtt={rtt}, sent={datagram['sent']}, "
+                                       f"retransmitted={datagram['retransmitted']}, "
+                                       f"received={datagram['received']}, duplicates={datagram['duplicates']}, "
+                                       f"fell back to TCP={datagram['fallbacks']}")
+                    active_sessions.append((f"Peer: {record.peer_id}, Session: {record.session_id[:8]}..., "
+                                            f"Created: {session_info.created_at.strftime('%H:%M:%S')}", details))
 
             if active_sessions:
                 self.peer.message_handler.print_message(
                     format_chat_message("System", "Active sessions:")
                 )
-                for session in active_sessions:
+                for session, details in active_sessions:
                     self.peer.message_handler.print_message(
                         format_chat_message("System", f"  - {session}")
                     )
+                    for line in details:
+                        self.peer.message_handler.print_message(
+                            format_chat_message("System", f"    {line}")
+                        )
             else:
                 self.peer.message_handler.print_message(
                     format_chat_message("System", "No active sessions")
                 )
+
+            stats = self.peer.admission.stats
+            self.peer.message_handler.print_message(
+                format_chat_message("System", f"Admission: {stats['accepted']} accepted, "
+                                              f"{stats['rejected_rate']} rate limited, "
+                                              f"{stats['rejected_busy']} rejected busy, "
+                                              f"{stats['timed_out']} timed out, "
+                                              f"{stats['failed']} failed authentication")
+            )
             return True
         except Exception as e:
             self.peer.message_handler.print_message(
@@ -62,6 +122,254 @@ class CommandHandler:
             )
             return True
 
+    def show_memory(self, *args):
+        """Shows the bytes of per-connection state, in total and per peer"""
+        count, totals = connection_footprint(self.peer)
+        lines = [f"Memory held for {count} connected peers:"]
+        for component, size in totals.items():
+            per_peer = f" ({size // count} per peer)" if count else ""
+            lines.append(f"  {component:<12} {size:>12} bytes{per_peer}")
+        total = sum(totals.values())
+        lines.append(f"  {'total':<12} {total:>12} bytes" + (f" ({total // count} per peer)" if count else ""))
+        lines.append(f"  Threads: {threading.active_count()} running, "
+                     f"{self.peer.network_config['thread_stack_size']} KiB stack reserved for each")
+        buffers = self.peer.network.buffers
+        stats = buffers.stats()
+        lines.append(f"  Buffer pool: {stats['in_use']} in use (peak {stats['peak_in_use']}), "
+                     f"{stats['pooled_slabs']} idle ({stats['pooled_bytes']} bytes), "
+                     f"{stats['reused']} of {stats['acquired']} reused, {stats['discarded']} discarded")
+        rss = process_rss()
+        if rss is not None:
+            lines.append(f"  Process RSS: {rss / (1024 * 1024):.1f} MiB")
+        for stack in buffers.leaks():
+            lines.append("  Buffer not yet released, acquired at:")
+            lines.extend(f"    {line}" for line in stack.splitlines())
+        for line in lines:
+            self.peer.message_handler.print_message(format_chat_message("System", line))
+        return True
+
+    def show_pipeline(self, *args):
+        """Shows the stages received messages go through, with their queues and latency"""
+        def ms(seconds):
+            return f"{seconds * 1000:.2f} ms" if seconds is not None else "-"
+
+        stats, stages = self.peer.pipeline.snapshot()
+        lines = [f"Pipeline: {stats['submitted']} messages, {stats['in_flight']} in flight, "
+                 f"{stats['undecodable']} undecodable, latency p50 {ms(stats['p50'])}, p99 {ms(stats['p99'])}"]
+        for stage in stages:
+            capacity = stage['capacity'] if stage['capacity'] is not None else "credit"
+            per_batch = stage['items'] / stage['batches'] if stage['batches'] else 0
+            busy = stage['busy_time'] / stage['batches'] if stage['batches'] else None
+            lines.append(f"  {stage['name']:<18} workers={stage['workers']}, queued={stage['queued']}/{capacity} "
+                         f"(peak {stage['peak']}, overflow {stage['overflow']}), "
+                         f"items={stage['items']} ({per_batch:.1f} per batch), errors={stage['errors']}, "
+                         f"latency p50 {ms(stage['p50'])}, p99 {ms(stage['p99'])}, batch time {ms(busy)}")
+        for line in lines:
+            self.peer.message_handler.print_message(format_chat_message("System", line))
+        return True
+
+    def show_history(self, args):
+        """Shows stored messages exchanged with a peer"""
+        if not args:
+            self.peer.message_handler.print_message(
+                format_error_message("[-] Usage: history <peer_id> [since]")
+            )
+            return True
+
+        if not self.peer.message_log:
+            self.peer.message_handler.print_message(
+                format_error_message("[-] Message history is disabled")
+            )
+            return True
+
+        try:
+            since = parse_since(args[1]) if len(args) > 1 else None
+            # Make messages still waiting for group commit visible
+            self.peer.message_log.flush(timeout=1)
+            records = self.peer.message_log.history(args[0], since=since)
+
+            if not records:
+                self.peer.message_handler.print_message(
+                    format_chat_message("System", f"No stored messages for {args[0]}")
+                )
+            for record in records:
+                arrow = '->' if record.direction == OUTBOUND else '<-'
+                self.peer.message_handler.print_message(
+                    f"{Fore.BLUE}[{record.timestamp.strftime('%Y-%m-%d %H:%M:%S')}] "
+                    f"{arrow} {Fore.GREEN}{record.peer_id}{Fore.RESET}: {record.message}"
+                )
+            return True
+        except ValueError as e:
+            self.peer.message_handler.print_message(
+                format_error_message(f"[-] Invalid time: {e}")
+            )
+            return True
+        except StorageError as e:
+            self.peer.message_handler.print_message(
+                format_error_message(f"[-] Error reading history: {e}")
+            )
+            return True
+
+    def handle_invite(self, args):
+        """Creates, lists or revokes connection invites"""
+        invites = self.peer.invites
+        try:
+            if args and args[0] == 'list':
+                invites.purge_expired()
+                entries = invites.list()
+                self.peer.message_handler.print_message(
+                    format_chat_message("System", f"Outstanding invites: {len(entries)}")
+                )
+                for invite in entries[:50]:
+                    expires = (datetime.fromtimestamp(invite.expires_at).strftime('%Y-%m-%d %H:%M:%S')
+                               if invite.expires_at else 'never')
+                    uses = invite.uses_left if invite.uses_left is not None else 'unlimited'
+                    self.peer.message_handler.print_message(
+                        format_chat_message("System", f"  - {invite.key_id}: expires {expires}, uses left {uses}")
+                    )
+                return True
+
+            if args and args[0] == 'revoke':
+                if len(args) < 2:
+                    self.peer.message_handler.print_message(
+                        format_error_message("[-] Usage: invite revoke <id>")
+                    )
+                elif invites.revoke(args[1]):
+                    self.peer.message_handler.print_message(
+                        format_chat_message("System", f"Invite {args[1]} revoked")
+                    )
+                else:
+                    self.peer.message_handler.print_message(
+                        format_error_message(f"[-] No invite with id {args[1]}")
+                    )
+                return True
+
+            ttl = parse_duration(args[0]) if args else None
+            max_uses = int(args[1]) if len(args) > 1 else None
+            if max_uses is not None and max_uses < 1:
+                raise ValueError("uses must be at least 1")
+
+            token = invites.create(ttl=ttl, max_uses=max_uses)
+            self.peer.message_handler.print_message(
+                f"{Fore.YELLOW}Connection string (copy this line):{Style.RESET_ALL}\n"
+                f"{Fore.GREEN}{self.peer.connection_string(token)}{Style.RESET_ALL}"
+            )
+            return True
+
+        except ValueError as e:
+            self.peer.message_handler.print_message(
+                format_error_message(f"[-] Invalid invite options: {e}")
+            )
+            return True
+
+    def report_delivery(self, target, result):
+        """Tells the user how an addressed message was delivered"""
+        if result == 'stored':
+            self.peer.message_handler.print_message(
+                format_chat_message("System", f"{target} is offline, message stored for delivery")
+            )
+        elif result is None:
+            self.peer.message_handler.print_message(
+                format_error_message(f"[-] Unknown or unreachable peer: {target}")
+            )
+
+    def record_sent(self, peer_ids, message):
+        """Records a message in the history of every peer it was sent or stored for"""
+        for peer_id in peer_ids:
+            self.peer.record_message(peer_id, None, message, OUTBOUND)
+
+    def handle_direct_message(self, args):
+        """Sends a message to one peer only"""
+        if len(args) < 2:
+            self.peer.message_handler.print_message(
+                format_error_message("[-] Usage: msg <peer_id> <text>")
+            )
+            return True
+
+        peer_id, message = args[0], ' '.join(args[1:])
+        self.peer.message_handler.print_message(
+            format_chat_message(f"{self.peer.peer_id} -> {peer_id}", message)
+        )
+        self.peer.record_message(peer_id, None, message, OUTBOUND)
+        self.report_delivery(peer_id, self.peer.network.send_to_peer(peer_id, message))
+        return True
+
+    def handle_room(self, args):
+        """Manages rooms: create, add, remove, delete and list"""
+        usage = "[-] Usage: room create|add|remove <name> [peers...], room delete <name>, room list"
+        rooms = self.peer.rooms
+        try:
+            action = args[0].lower() if args else 'list'
+            if action == 'list':
+                entries = rooms.list()
+                if not entries:
+                    self.peer.message_handler.print_message(format_chat_message("System", "No rooms"))
+                for name, members in entries:
+                    self.peer.message_handler.print_message(
+                        format_chat_message("System", f"  - {name}: {', '.join(sorted(members)) or '(empty)'}")
+                    )
+                return True
+
+            if len(args) < 2:
+                self.peer.message_handler.print_message(format_error_message(usage))
+                return True
+
+            name, peer_ids = args[1], args[2:]
+            if action == 'create':
+                members = rooms.create(name, peer_ids)
+            elif action == 'add':
+                members = rooms.add(name, peer_ids)
+            elif action == 'remove':
+                members = rooms.remove(name, peer_ids)
+            elif action == 'delete':
+                if not rooms.delete(name):
+                    raise KeyError(name)
+                self.peer.network.group_keys.rotate(name)
+                self.peer.message_handler.print_message(format_chat_message("System", f"Room {name} deleted"))
+                return True
+            else:
+                self.peer.message_handler.print_message(format_error_message(usage))
+                return True
+
+            self.peer.message_handler.print_message(
+                format_chat_message("System", f"Room {name}: {', '.join(sorted(members)) or '(empty)'}")
+            )
+            return True
+
+        except KeyError as e:
+            self.peer.message_handler.print_message(format_error_message(f"[-] No room named {e.args[0]}"))
+            return True
+        except ValueError as e:
+            self.peer.message_handler.print_message(format_error_message(f"[-] {e}"))
+            return True
+
+    def handle_room_message(self, args):
+        """Sends a message to the members of a room"""
+        if len(args) < 2:
+            self.peer.message_handler.print_message(
+                format_error_message("[-] Usage: say <room> <text>")
+            )
+            return True
+
+        room, message = args[0], ' '.join(args[1:])
+        try:
+            results = self.peer.network.send_to_room(room, message)
+        except KeyError:
+            self.peer.message_handler.print_message(format_error_message(f"[-] No room named {room}"))
+            return True
+
+        self.peer.message_handler.print_message(
+            format_chat_message(f"{self.peer.peer_id} [{room}]", message)
+        )
+        self.record_sent(results['reached'], f"[{room}] {message}")
+        if results['stored'] or results['unreachable']:
+            self.peer.message_handler.print_message(
+                format_chat_message("System", f"Room {room}: {results['sent']} sent, "
+                                              f"{results['stored']} stored, "
+                                              f"{results['unreachable']} unreachable")
+            )
+        return True
+
     def process_user_input(self, user_input):
         """Processes user input with session validation"""
         try:
@@ -75,18 +383,18 @@ class CommandHandler:
             args = parts[1:] if len(parts) > 1 else []
 
             # Check session validity for all peers except for connect command
-            if command not in ['c', 'connect', 'help', 'h', 'clear', 'cls', 'sessions']:
-                invalid_sessions = []
-                for socket, (peer_id, address, session_id) in self.peer.peers.items():
-                    if not self.peer.session_manager.is_session_valid(session_id):
-                        invalid_sessions.append((socket, peer_id, session_id))
+            if command not in ['c', 'connect', 'connect-many', 'help', 'h', 'clear', 'cls', 'sessions', 'memory', 'pipeline', 'history', 'invite', 'room']:
+                invalid_sessions = [
+                    record for record in self.peer.peers.snapshot()
+                    if not self.peer.session_manager.is_session_valid(record.session_id)
+                ]
 
                 # Handle invalid sessions
-                for socket, peer_id, session_id in invalid_sessions:
+                for record in invalid_sessions:
                     self.peer.message_handler.print_message(
-                        format_error_message(f"[-] Invalid session detected for {peer_id}")
+                        format_error_message(f"[-] Invalid session detected for {record.peer_id}")
                     )
-                    self.peer.remove_peer(socket)
+                    self.peer.remove_peer(record.socket)
 
                 if invalid_sessions and not self.peer.peers:
                     self.peer.message_handler.print_message(
@@ -105,17 +413,21 @@ class CommandHandler:
 
             if self.peer.peers:
                 # Verify sessions before broadcasting
-                valid_peers = {
-                    socket: data for socket, data in self.peer.peers.items()
-                    if self.peer.session_manager.is_session_valid(data[2])
-                }
+                valid_peers = [
+                    record for record in self.peer.peers.snapshot()
+                    if self.peer.session_manager.is_session_valid(record.session_id)
+                ]
 
                 if valid_peers:
-                    self.peer.network.broadcast_message(full_message)
-                else:
-                    self.peer.message_handler.print_message(
-                        format_error_message("[-] No valid peer connections available")
-                    )
+                    self.record_sent(self.peer.network.broadcast_message(full_message), user_input)
+                    return True
+
+                self.peer.message_handler.print_message(
+                    format_error_message("[-] No valid peer connections available")
+                )
+
+            # Nobody is reachable right now, keep it for known peers
+            self.record_sent(self.peer.network.store_for_offline_peers(full_message), user_input)
             return True
 
         except SessionError as e:
@@ -150,13 +462,59 @@ class CommandHandler:
             )
             return True
 
+    def handle_connect_many(self, args):
+        """Connects to the peers listed in a file, several handshakes at a time"""
+        if not args or len(args) > 2:
+            self.peer.message_handler.print_message(
+                format_error_message("[-] Usage: connect-many <file> [parallelism]")
+            )
+            return True
+
+        try:
+            parallelism = int(args[1]) if len(args) > 1 else None
+            if parallelism is not None and parallelism < 1:
+                raise ValueError(args[1])
+        except ValueError:
+            self.peer.message_handler.print_message(
+                format_error_message(f"[-] Invalid parallelism: {args[1]}")
+            )
+            return True
+
+        try:
+            connection_strings = read_connection_strings(args[0])
+        except (OSError, UnicodeDecodeError) as e:
+            self.peer.message_handler.print_message(
+                format_error_message(f"[-] Cannot read {args[0]}: {e}")
+            )
+            return True
+
+        started = time.perf_counter()
+        results = self.peer.connect_many(connection_strings, parallelism)
+        elapsed = time.perf_counter() - started
+
+        lines = []
+        for result in results:
+            name = result.peer_id or result.connection_string.rpartition(':')[0] or result.connection_string
+            line = f"  {name:<24} {result.status:<17} {result.elapsed * 1000:8.1f} ms"
+            lines.append(line + (f"  {result.error}" if result.error else ""))
+        connected = [result.elapsed for result in results if result.status == CONNECTED]
+        duplicates = sum(1 for result in results if result.status == DUPLICATE)
+        summary = (f"Connected {len(connected)} of {len(results)} peers in {elapsed:.2f} s "
+                   f"({duplicates} already connected, {len(results) - len(connected) - duplicates} failed)")
+        if connected:
+            summary += f"; handshakes took {1000 * sum(connected) / len(connected):.1f} ms on average, " \
+                       f"{1000 * max(connected):.1f} ms at most"
+        for line in lines + [summary]:
+            self.peer.message_handler.print_message(format_chat_message("System", line))
+        return True
+
     def handle_exit(self, *args):
         """Handles the exit command and cleans up sessions"""
         try:
             # Invalidate all active sessions
-            for socket, (peer_id, address, session_id) in self.peer.peers.items():
+            for record in self.peer.peers.snapshot():
                 try:
-                    self.peer.session_manager.invalidate_session(session_id)
+                    self.peer.session_manager.invalidate_session(record.session_id)
                 except:
                     pass  # Ignore errors during cleanup
 
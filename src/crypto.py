@@ -1,22 +1,43 @@
 import secrets
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import serialization, hashes
+import threading
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
+# The RSA modules are only needed for the key exchange, so they are imported there
+
 class CryptoManager:
-    def __init__(self):
-        self.generate_keys()
+    def __init__(self, background=False):
+        self._private_key = None
+        self._public_key = None
+        self._keys_ready = threading.Event()
+        if background:
+            # Key generation takes a noticeable part of startup; finish it off the main thread
+            threading.Thread(target=self.generate_keys, daemon=True).start()
+        else:
+            self.generate_keys()
 
     def generate_keys(self):
         """Generates the RSA key pair"""
-        self.private_key = rsa.generate_private_key(
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        self._private_key = rsa.generate_private_key(
             public_exponent=65537,
             key_size=2048
         )
-        self.public_key = self.private_key.public_key()
+        self._public_key = self._private_key.public_key()
+        self._keys_ready.set()
+
+    @property
+    def private_key(self):
+        self._keys_ready.wait()
+        return self._private_key
+
+    @property
+    def public_key(self):
+        self._keys_ready.wait()
+        return self._public_key
 
     def get_public_key_pem(self):
         """Returns the public key in PEM format"""
+        from cryptography.hazmat.primitives import serialization
         return self.public_key.public_bytes(
             encoding=serialization.Encoding.PEM,
             format=serialization.PublicFormat.SubjectPublicKeyInfo
@@ -24,6 +45,8 @@ class CryptoManager:
 
     def decrypt_aes_key(self, encrypted_aes_key):
         """Decrypts the AES key using the RSA private key"""
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
         return self.private_key.decrypt(
             encrypted_aes_key,
             padding.OAEP(
@@ -35,6 +58,8 @@ class CryptoManager:
 
     def encrypt_aes_key(self, aes_key, public_key_pem):
         """Encrypts the AES key using the provided public key"""
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import padding
         remote_public_key = serialization.load_pem_public_key(public_key_pem)
         return remote_public_key.encrypt(
             aes_key,
@@ -52,19 +77,38 @@ class CryptoManager:
         return aes_key, AESGCM(aes_key)
 
     @staticmethod
-    def encrypt_message(aes_gcm, message):
-        """Encrypts a message using AES-GCM"""
+    def encrypt_bytes(aes_gcm, data, associated_data=None):
+        """Encrypts raw bytes using AES-GCM, authenticating the associated data"""
         nonce = secrets.token_bytes(12)
-        encrypted_message = aes_gcm.encrypt(
-            nonce,
-            message.encode(),
-            None
-        )
-        return nonce + encrypted_message
+        return nonce + aes_gcm.encrypt(nonce, data, associated_data)
 
     @staticmethod
-    def decrypt_message(aes_gcm, encrypted_data):
-        """Decrypts a message using AES-GCM"""
+    def decrypt_bytes(aes_gcm, encrypted_data, associated_data=None):
+        """Decrypts raw bytes using AES-GCM"""
+        nonce = encrypted_data[:12]
+        ciphertext = encrypted_data[12:]
+        return aes_gcm.decrypt(nonce, ciphertext, associated_data)
+
+    @staticmethod
+    def decrypt_into(aes_gcm, encrypted_data, associated_data, buffer):
+        """Decrypts raw bytes into a writable buffer of exactly the plaintext size"""
+        if not isinstance(encrypted_data, memoryview):
+            # Slices of a view do not copy the ciphertext
+            encrypted_data = memoryview(encrypted_data)
         nonce = encrypted_data[:12]
         ciphertext = encrypted_data[12:]
-        return aes_gcm.decrypt(nonce, ciphertext, None).decode()
+        if hasattr(aes_gcm, 'decrypt_into'):
+            aes_gcm.decrypt_into(nonce, ciphertext, associated_data, buffer)
+        else:
+            # cryptography releases before 44 can only return a new object
+            buffer[:] = aes_gcm.decrypt(nonce, ciphertext, associated_data)
+
+    @staticmethod
+    def encrypt_message(aes_gcm, message, associated_data=None):
+        """Encrypts a message using AES-GCM"""
+        return CryptoManager.encrypt_bytes(aes_gcm, message.encode(), associated_data)
+
+    @staticmethod
+    def decrypt_message(aes_gcm, encrypted_data, associated_data=None):
+        """Decrypts a message using AES-GCM"""
+        return CryptoManager.decrypt_bytes(aes_gcm, encrypted_data, associated_data).decode()
@@ -0,0 +1,44 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+from .crypto import CryptoManager
+
+# (aes_gcm, data, associated data)
+SealJob = Tuple[object, bytes, Optional[bytes]]
+
+
+class CryptoPool:
+    """
+    Runs batches of AES-GCM operations across worker threads.
+
+    The AES-GCM implementation releases the GIL while it encrypts, so threads
+    use every core without pickling frames or sending keys to other processes.
+    Handing a job to a worker costs tens of microseconds, so batches smaller
+    than inline_threshold bytes, and every batch on a single core, run on the
+    calling thread. Results always come back in submission order.
+    """
+
+    def __init__(self, workers: int, inline_threshold: int):
+        self.workers = max(1, min(workers, os.cpu_count() or 1))
+        self.inline_threshold = inline_threshold
+        self.executor = None
+        if self.workers > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crypto')
+
+    def _inline(self, count: int, size: int) -> bool:
+        return self.executor is None or count < 2 or size < self.inline_threshold
+
+    def map(self, function: Callable, items: Sequence, size: int) -> List:
+        """Applies function to each item, where size is the bytes the batch encrypts"""
+        if self._inline(len(items), size):
+            return [function(item) for item in items]
+        return list(self.executor.map(function, items))
+
+    def seal_many(self, jobs: Sequence[SealJob]) -> List[bytes]:
+        """Encrypts each job, returning nonce + ciphertext per job"""
+        size = sum(len(data) for _, data, _ in jobs)
+        return self.map(lambda job: CryptoManager.encrypt_bytes(*job), jobs, size)
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
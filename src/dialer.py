@@ -0,0 +1,105 @@
+import errno
+import os
+import selectors
+import socket
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# Delay before racing the next candidate while earlier attempts are still pending (RFC 8305)
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+_IN_PROGRESS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY,
+                getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK)}
+
+
+def resolve_candidates(candidates: Sequence[Tuple[str, int]]) -> List[Tuple[int, tuple]]:
+    """
+    Expands (host, port) candidates into socket addresses, alternating address
+    families so that one unreachable family cannot hold up the other.
+    """
+    by_family = {}
+    seen = set()
+    for host, port in candidates:
+        try:
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            continue
+        for family, _, _, _, sockaddr in infos:
+            if sockaddr not in seen:
+                seen.add(sockaddr)
+                by_family.setdefault(family, []).append((family, sockaddr))
+
+    ordered = []
+    queues = sorted(by_family.values(), key=lambda queue: queue[0][0] != socket.AF_INET6)
+    while any(queues):
+        for queue in queues:
+            if queue:
+                ordered.append(queue.pop(0))
+    return ordered
+
+
+def dial(candidates: Sequence[Tuple[str, int]], deadline,
+         prepare: Optional[Callable[[socket.socket], None]] = None,
+         attempt_delay: float = CONNECTION_ATTEMPT_DELAY) -> socket.socket:
+    """
+    Connects to the first candidate that answers. Attempts start one after
+    another, each attempt_delay after the previous one or as soon as one fails,
+    and run concurrently, so a blackholed address costs attempt_delay instead of
+    a full TCP timeout. Returns a blocking socket; the losing attempts are closed.
+    """
+    addresses = resolve_candidates(candidates)
+    if not addresses:
+        raise OSError("No usable address in connection string")
+
+    selector = selectors.DefaultSelector()
+    pending = {}
+    errors = []
+    index = 0
+    next_attempt = time.monotonic()
+
+    try:
+        while True:
+            now = time.monotonic()
+            if index < len(addresses) and (now >= next_attempt or not pending):
+                family, sockaddr = addresses[index]
+                index += 1
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                if prepare:
+                    prepare(sock)
+                sock.setblocking(False)
+                error = sock.connect_ex(sockaddr)
+                if error == 0 or error in _IN_PROGRESS:
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    pending[sock] = sockaddr
+                    next_attempt = now + attempt_delay
+                else:
+                    errors.append(f"{sockaddr[0]}: {os.strerror(error)}")
+                    sock.close()
+                continue
+
+            if not pending:
+                raise OSError("; ".join(errors))
+
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise socket.timeout("Connection timed out")
+            wait = remaining
+            if index < len(addresses):
+                wait = min(wait, max(0.0, next_attempt - now))
+
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                selector.unregister(sock)
+                sockaddr = pending.pop(sock)
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error == 0:
+                    sock.setblocking(True)
+                    return sock
+                errors.append(f"{sockaddr[0]}: {os.strerror(error)}")
+                sock.close()
+                # A failed attempt lets the next candidate start right away
+                next_attempt = 0.0
+    finally:
+        for sock in pending:
+            sock.close()
+        selector.close()
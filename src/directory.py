@@ -0,0 +1,132 @@
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class PeerRecord:
+    """Everything kept per connection to an authenticated peer, in one compact object"""
+    __slots__ = ('socket', 'peer_id', 'address', 'session_id', 'aes_gcm', 'aes_key', 'ratchet', 'connected_at',
+                 'stream')
+
+    def __init__(self, socket, peer_id, address, session_id, aes_gcm, aes_key=None):
+        self.socket = socket
+        self.peer_id = peer_id
+        self.address = address
+        self.session_id = session_id
+        self.aes_gcm = aes_gcm
+        self.aes_key = aes_key  # derives the next key when the session rotates
+        self.ratchet = None  # key rotation state, created by the first rotation
+        self.connected_at = datetime.now()
+        self.stream = None  # sequencing and flow control, created on first use by the network layer
+
+    def __repr__(self):
+        return f"PeerRecord(peer_id={self.peer_id!r}, address={self.address!r})"
+
+
+class PeerDirectory:
+    """
+    Connected peers indexed by socket, peer ID, session ID and address.
+
+    Writers take the lock; readers use plain dict lookups, which are atomic under
+    the GIL, so they never block. Iteration goes through snapshot(), an immutable
+    tuple that is rebuilt only after the directory changes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._by_socket: Dict[object, PeerRecord] = {}
+        self._by_peer_id: Dict[str, Tuple[PeerRecord, ...]] = {}
+        self._by_session: Dict[str, PeerRecord] = {}
+        self._by_address: Dict[tuple, PeerRecord] = {}
+        self._snapshot: Optional[Tuple[PeerRecord, ...]] = ()
+
+    def add(self, socket, peer_id, address, session_id, aes_gcm, aes_key=None) -> PeerRecord:
+        """Registers a connected peer and returns its record"""
+        record = PeerRecord(socket, peer_id, address, session_id, aes_gcm, aes_key)
+        with self.lock:
+            previous = self._by_socket.get(socket)
+            if previous is not None:
+                self._unindex(previous)
+            self._by_socket[socket] = record
+            # Newest connection first, so lookups by peer ID prefer it
+            self._by_peer_id[peer_id] = (record,) + self._by_peer_id.get(peer_id, ())
+            self._by_session[session_id] = record
+            self._by_address[address] = record
+            self._snapshot = None
+        return record
+
+    def _unindex(self, record: PeerRecord) -> None:
+        remaining = tuple(r for r in self._by_peer_id.get(record.peer_id, ()) if r is not record)
+        if remaining:
+            self._by_peer_id[record.peer_id] = remaining
+        else:
+            self._by_peer_id.pop(record.peer_id, None)
+        if self._by_session.get(record.session_id) is record:
+            del self._by_session[record.session_id]
+        if self._by_address.get(record.address) is record:
+            del self._by_address[record.address]
+
+    def remove(self, socket) -> Optional[PeerRecord]:
+        """Removes a peer by socket, returning its record if it was present"""
+        with self.lock:
+            record = self._by_socket.pop(socket, None)
+            if record is not None:
+                self._unindex(record)
+                self._snapshot = None
+            return record
+
+    def update_session(self, socket, session_id: str) -> None:
+        """Re-indexes a peer after its session rotated"""
+        with self.lock:
+            record = self._by_socket.get(socket)
+            if record is None:
+                return
+            if self._by_session.get(record.session_id) is record:
+                del self._by_session[record.session_id]
+            record.session_id = session_id
+            self._by_session[session_id] = record
+
+    def get(self, socket) -> Optional[PeerRecord]:
+        return self._by_socket.get(socket)
+
+    def get_by_peer_id(self, peer_id: str) -> Optional[PeerRecord]:
+        """Returns the most recent connection to a peer"""
+        records = self._by_peer_id.get(peer_id)
+        return records[0] if records else None
+
+    def get_all_by_peer_id(self, peer_id: str) -> Tuple[PeerRecord, ...]:
+        return self._by_peer_id.get(peer_id, ())
+
+    def get_by_session(self, session_id: str) -> Optional[PeerRecord]:
+        return self._by_session.get(session_id)
+
+    def get_by_address(self, address: tuple) -> Optional[PeerRecord]:
+        return self._by_address.get(address)
+
+    def has_peer_id(self, peer_id: str) -> bool:
+        return peer_id in self._by_peer_id
+
+    def peer_ids(self) -> List[str]:
+        return list(self._by_peer_id)
+
+    def snapshot(self) -> Tuple[PeerRecord, ...]:
+        """Returns an immutable view of every record, safe to iterate while peers change"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self.lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    snapshot = self._snapshot = tuple(self._by_socket.values())
+        return snapshot
+
+    def __contains__(self, socket) -> bool:
+        return socket in self._by_socket
+
+    def __len__(self) -> int:
+        return len(self._by_socket)
+
+    def __bool__(self) -> bool:
+        return bool(self._by_socket)
+
+    def __iter__(self) -> Iterator[PeerRecord]:
+        return iter(self.snapshot())
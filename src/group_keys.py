@@ -0,0 +1,112 @@
+import secrets
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# Identifies which sender key sealed a group frame
+KEY_ID = struct.Struct('>I')
+
+
+class SenderKey:
+    """A broadcast key of this node and the connections it was handed to"""
+    __slots__ = ('key_id', 'key', 'aes_gcm', 'created_at', 'recipients')
+
+    def __init__(self, created_at: float):
+        self.key_id = secrets.randbits(32)
+        self.key = AESGCM.generate_key(bit_length=256)
+        self.aes_gcm = AESGCM(self.key)
+        self.created_at = created_at
+        self.recipients: Set[object] = set()
+
+
+class GroupKeyManager:
+    """
+    Sender keys for group broadcast.
+
+    This node seals a broadcast once with its own sender key, which each peer
+    receives over its pairwise channel before the first frame sealed with it.
+    Plain broadcasts share one key and every room has its own, handed only to
+    the room's members. A key is replaced after the session rotation interval,
+    as soon as a peer that held it disconnects, and, for a room, once a peer
+    that held it is no longer among the members sent to, so departed peers
+    cannot read later messages. Keys received from peers are kept per
+    connection and room, the newest few each, so frames already in flight
+    during a rotation still open.
+    """
+
+    def __init__(self, rotation_interval: float, keys_per_peer: int = 2, rooms_per_peer: int = 64,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rotation_interval = rotation_interval
+        self.clock = clock
+        self.keys_per_peer = keys_per_peer
+        self.rooms_per_peer = rooms_per_peer
+        self.lock = threading.Lock()
+        self._current: Dict[Optional[str], SenderKey] = {}
+        self._received: Dict[object, OrderedDict] = {}
+
+    def current(self, room: Optional[str] = None, members: Optional[Set[object]] = None) -> SenderKey:
+        """
+        Returns the sender key to seal with, for plain broadcasts or for a room,
+        rotating it when due. members are the sockets of the room's members;
+        the key is replaced if it was handed to anyone else.
+        """
+        with self.lock:
+            key = self._current.get(room)
+            if (key is None or self.clock() - key.created_at >= self.rotation_interval
+                    or (members is not None and not key.recipients <= members)):
+                key = self._current[room] = SenderKey(self.clock())
+            return key
+
+    def rotate(self, room: Optional[str] = None) -> None:
+        """Forces a new sender key for the next broadcast, or the next message to a room"""
+        with self.lock:
+            self._current.pop(room, None)
+
+    def needs_key(self, key: SenderKey, socket) -> bool:
+        return socket not in key.recipients
+
+    def mark_sent(self, key: SenderKey, socket) -> None:
+        with self.lock:
+            key.recipients.add(socket)
+
+    def install(self, socket, key_id: int, key: bytes, room: Optional[str] = None) -> None:
+        """Stores a sender key received from the peer on this connection, for a room or for broadcasts"""
+        with self.lock:
+            rooms = self._received.setdefault(socket, OrderedDict())
+            keys = rooms.pop(room, None) or OrderedDict()
+            # Most recently used last, so a peer cannot grow this without bound
+            rooms[room] = keys
+            while len(rooms) > self.rooms_per_peer:
+                rooms.popitem(last=False)
+            # The raw key is kept so a handoff can carry it to another process
+            keys[key_id] = (AESGCM(key), key)
+            while len(keys) > self.keys_per_peer:
+                keys.popitem(last=False)
+
+    def lookup(self, socket, key_id: int) -> Optional[AESGCM]:
+        rooms = self._received.get(socket)
+        if not rooms:
+            return None
+        for keys in list(rooms.values()):
+            entry = keys.get(key_id)
+            if entry is not None:
+                return entry[0]
+        return None
+
+    def keys_for(self, socket) -> Optional[OrderedDict]:
+        """
+        Sender keys received on a connection, as {room: {key_id: (aes_gcm, key)}}
+        oldest first, with None as the room of broadcast keys
+        """
+        return self._received.get(socket)
+
+    def forget_socket(self, socket) -> None:
+        """Drops the keys of a closed connection and retires ours that it held"""
+        with self.lock:
+            self._received.pop(socket, None)
+            for room, key in list(self._current.items()):
+                if socket in key.recipients:
+                    del self._current[room]
@@ -0,0 +1,404 @@
+import array
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+from typing import Dict, List
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .invites import Invite
+from .network import NetworkManager
+from .session import SessionError
+from .snapshot import (NodeSnapshot, NodeRow, SessionRow, TokenRow, InviteRow, RoomRow,
+                       DeliveredRow, FrameRow, SenderKeyRow, read_snapshot, write_snapshot)
+from .ui.formatting import Fore, Style
+
+# magic, protocol version
+REQUEST = struct.Struct('>4sH')
+# magic, protocol version, snapshot key, handoff start, reads stopped, descriptors that follow
+REPLY = struct.Struct('>4sH32sddI')
+HANDOFF_MAGIC = b'N0HO'
+HANDOFF_VERSION = 1
+# The new process has restored everything and asks for the sockets
+CONFIRM = b'C'
+# The old process has let go of the sockets and is exiting
+RELEASED = b'R'
+# Linux passes at most 253 descriptors in one message
+FDS_PER_MESSAGE = 250
+
+
+def send_fds(channel, fds: List[int]) -> None:
+    """Passes file descriptors over a Unix socket, one byte of data per batch"""
+    for start in range(0, len(fds), FDS_PER_MESSAGE):
+        batch = array.array('i', fds[start:start + FDS_PER_MESSAGE])
+        channel.sendmsg([b'F'], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, batch)])
+
+
+def recv_fds(channel, count: int) -> List[int]:
+    """Receives count file descriptors sent with send_fds()"""
+    fds = array.array('i')
+    while len(fds) < count:
+        wanted = min(count - len(fds), FDS_PER_MESSAGE)
+        data, ancdata, flags, _ = channel.recvmsg(1, socket.CMSG_SPACE(wanted * fds.itemsize))
+        for level, kind, payload in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(payload[:len(payload) - len(payload) % fds.itemsize])
+        if not data or flags & socket.MSG_CTRUNC:
+            for fd in fds:
+                os.close(fd)
+            raise ConnectionError("Handoff closed before every socket arrived")
+    return list(fds)
+
+
+class Takeover:
+    """Sockets and state received from the process this one replaces"""
+
+    def __init__(self, channel, snapshot: NodeSnapshot, snapshot_path: str, fds: List[int],
+                 started: float, stopped: float):
+        self.channel = channel
+        self.snapshot = snapshot
+        self.snapshot_path = snapshot_path
+        self.listen_socket = socket.socket(fileno=fds[0])
+        self.fds = fds[1:]  # one per row of snapshot.connections
+        self.started = started  # when the old process began handing over
+        self.stopped = stopped  # when it stopped writing
+
+    def abort(self) -> None:
+        """Lets the old process keep its connections"""
+        self.channel.close()
+        self.listen_socket.close()
+        for fd in self.fds:
+            os.close(fd)
+
+
+def take_over(path: str, timeout: float) -> Takeover:
+    """
+    Asks the node listening on the handoff socket at path for its sockets and
+    session snapshot. It keeps its connections until the caller confirms.
+    """
+    channel = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # The old process waits up to timeout for its peers, then again for this one
+    channel.settimeout(2 * timeout)
+    try:
+        channel.connect(path)
+        channel.sendall(REQUEST.pack(HANDOFF_MAGIC, HANDOFF_VERSION))
+        header = NetworkManager.recv_exact(channel, REPLY.size)
+        if header is None:
+            raise ConnectionError("The running node refused the handoff")
+        magic, version, key, started, stopped, count = REPLY.unpack(header)
+        if magic != HANDOFF_MAGIC or version != HANDOFF_VERSION:
+            raise ValueError("The running node speaks another handoff protocol")
+        fds = recv_fds(channel, count)
+    except BaseException:
+        channel.close()
+        raise
+
+    snapshot_path = f"{path}.snapshot"
+    try:
+        snapshot = read_snapshot(snapshot_path, key)
+        if len(snapshot.connections) != len(fds) - 1:
+            raise ValueError("Snapshot does not match the sockets received")
+    except BaseException:
+        channel.close()
+        for fd in fds:
+            os.close(fd)
+        raise
+    return Takeover(channel, snapshot, snapshot_path, fds, started, stopped)
+
+
+class Handoff:
+    """
+    Restarts without dropping connections.
+
+    The running node listens on a Unix socket. A new process started with
+    --takeover connects to it, and the running node asks each peer to mark the
+    point where it stops reading: the peer answers a handoff control frame
+    with handoff_ack, and the receive thread of that connection parks right
+    after it. Anything the peer sends later waits in the kernel for the next
+    process. Writes then stop, and sessions, sequencing, credit, queued frames
+    and group keys go into a snapshot sealed with a one-time key. The key, the
+    listening socket and every connected socket are passed over the Unix
+    socket, and the running node exits once the new one confirms. Until then
+    it owns everything, so a failed takeover resumes the connections in place.
+
+    Peers that do not acknowledge within network.handoff_timeout seconds are
+    disconnected, like any other peer that goes silent.
+    """
+
+    def __init__(self, peer, path: str):
+        self.peer = peer
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot"
+        self.active = False  # while handing over; new connections are turned away
+        self._parked: Dict[object, threading.Event] = {}
+        self._server = None
+
+    def listen(self) -> bool:
+        """Starts accepting takeover requests, replacing a stale socket file"""
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+            self.peer.print_message(
+                f"{Fore.RED}[-] Handoff disabled: another node listens on {self.path}{Style.RESET_ALL}"
+            )
+            return False
+        except OSError:
+            pass
+        finally:
+            probe.close()
+
+        # Bound under a temporary name and renamed, so the path never lacks a listener
+        temporary = f"{self.path}.{os.getpid()}"
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            server.bind(temporary)
+            os.chmod(temporary, 0o600)
+            server.listen(1)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            server.close()
+            self.peer.print_message(f"{Fore.RED}[-] Handoff disabled: {e}{Style.RESET_ALL}")
+            return False
+        self._server = server
+        threading.Thread(target=self._serve, daemon=True).start()
+        return True
+
+    def close(self) -> None:
+        """Stops accepting takeover requests and removes the socket file"""
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def is_parked(self, socket) -> bool:
+        event = self._parked.get(socket)
+        return event is not None and event.is_set()
+
+    def park(self, socket) -> None:
+        """Called by a receive thread on handoff_ack; it stops reading right after"""
+        event = self._parked.get(socket)
+        if event is not None:
+            event.set()
+
+    def _serve(self):
+        while self.peer.running and self._server is not None:
+            try:
+                channel, _ = self._server.accept()
+            except OSError:
+                return
+            try:
+                if hasattr(socket, 'SO_PEERCRED'):
+                    _, uid, _ = struct.unpack('3i', channel.getsockopt(
+                        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+                    if uid != os.getuid():
+                        continue
+                channel.settimeout(self.peer.network_config['handoff_timeout'])
+                request = NetworkManager.recv_exact(channel, REQUEST.size)
+                if request != REQUEST.pack(HANDOFF_MAGIC, HANDOFF_VERSION):
+                    continue
+                if self.hand_over(channel):
+                    return
+            except OSError:
+                pass
+            finally:
+                channel.close()
+
+    def hand_over(self, channel) -> bool:
+        """Passes every connection to the process on channel; returns True once it took them"""
+        peer = self.peer
+        timeout = peer.network_config['handoff_timeout']
+        started = time.time()
+        self.active = True
+        records = peer.peers.snapshot()
+        self._parked = {record.socket: threading.Event() for record in records}
+        peer.print_message(f"\r{Fore.YELLOW}[*] Handing {len(records)} connections over to a new process"
+                           f"{Style.RESET_ALL}")
+        for record in records:
+            try:
+                peer.network.send_control(record.socket, {'type': 'handoff'}, record.aes_gcm)
+            except (OSError, SessionError):
+                pass
+
+        deadline = time.monotonic() + timeout
+        for event in self._parked.values():
+            event.wait(max(0.0, deadline - time.monotonic()))
+        ready = []
+        for record in records:
+            if self._parked[record.socket].is_set() and record.socket in peer.peers:
+                ready.append(record)
+            else:
+                peer.remove_peer(record.socket)
+        # Messages read before the park reach the history and return their credit,
+        # so the snapshot acknowledges exactly what was handled
+        if not peer.pipeline.drain(timeout):
+            peer.print_message(f"{Fore.YELLOW}[*] Message handlers still busy, handing over anyway{Style.RESET_ALL}")
+
+        snapshot, fds = self.capture(ready)
+        stopped = time.time()
+        self.close_storage()
+        try:
+            key = AESGCM.generate_key(bit_length=256)
+            size = write_snapshot(self.snapshot_path, snapshot, key)
+            channel.sendall(REPLY.pack(HANDOFF_MAGIC, HANDOFF_VERSION, key, started, stopped, 1 + len(fds)))
+            send_fds(channel, [peer.listen_socket.fileno()] + fds)
+            confirmed = channel.recv(1) == CONFIRM
+            if confirmed:
+                # Frees the path for the new process's own handoff socket
+                self.close()
+                channel.sendall(RELEASED)
+        except OSError as e:
+            peer.print_message(f"{Fore.RED}[-] Handoff failed: {e}{Style.RESET_ALL}")
+            confirmed = False
+
+        if not confirmed:
+            peer.print_message(f"{Fore.YELLOW}[*] Handoff not confirmed, keeping the connections{Style.RESET_ALL}")
+            self.discard_snapshot()
+            self.reopen_storage()
+            self.start_connections(self.restore_connections(snapshot, fds))
+            self.active = False
+            self._parked = {}
+            return False
+
+        for fd in fds:
+            os.close(fd)
+        peer.print_message(
+            f"{Fore.GREEN}[+] Handed {len(fds)} connections over in {(stopped - started) * 1000:.0f} ms "
+            f"(snapshot {size} bytes), exiting{Style.RESET_ALL}"
+        )
+        # The input thread holds the terminal; interrupting it runs the normal shutdown
+        os.kill(os.getpid(), signal.SIGINT)
+        return True
+
+    def capture(self, records) -> tuple:
+        """
+        Detaches the connections and returns the snapshot with their descriptors,
+        in the order of its connections table
+        """
+        peer = self.peer
+        snapshot = NodeSnapshot()
+        fds = []
+        for index, record in enumerate(records):
+            rooms = peer.network.group_keys.keys_for(record.socket) or {}
+            for room, keys in list(rooms.items()):
+                snapshot.sender_keys.extend(SenderKeyRow(index, key_id, key, room or '')
+                                            for key_id, (_, key) in list(keys.items()))
+            # Datagrams not yet acknowledged are sent again over TCP by the next process
+            pending = peer.datagram.close_path(record.socket) if peer.datagram else []
+            fd, row, frames = peer.network.detach_connection(record)
+            peer.peers.remove(record.socket)
+            peer.network.forget_socket(record.socket)
+            snapshot.connections.append(row)
+            frames += [NetworkManager.fallback_frame(kind, payload, number) for number, kind, payload in pending]
+            snapshot.frames.extend(FrameRow(index, kind, payload) for kind, payload in frames)
+            fds.append(fd)
+
+        # Taken after the connections stopped, so no rotation can slip in between
+        sessions, tokens, rotations = peer.session_manager.export_state()
+        snapshot.node.append(NodeRow(peer.peer_id, rotations))
+        snapshot.sessions.extend(SessionRow._make(row) for row in sessions)
+        snapshot.tokens.extend(TokenRow._make(row) for row in tokens)
+        snapshot.invites.extend(InviteRow(invite.key_id, invite.salt, invite.digest, invite.created_at,
+                                          invite.expires_at, invite.uses_left) for invite in peer.invites.list())
+        snapshot.rooms.extend(RoomRow(name, sorted(members)) for name, members in peer.rooms.list())
+        snapshot.delivered.extend(DeliveredRow(peer_id, seq)
+                                  for peer_id, seq in list(peer.network.delivered_stored.items()))
+        return snapshot, fds
+
+    def close_storage(self) -> None:
+        # The next process opens the same files and the same UDP port
+        peer = self.peer
+        for name in ('datagram', 'message_log', 'outbox'):
+            component = getattr(peer, name)
+            setattr(peer, name, None)
+            if component is not None:
+                component.close()
+
+    def reopen_storage(self) -> None:
+        peer = self.peer
+        peer.message_log = peer.open_message_log()
+        peer.outbox = peer.open_outbox()
+        peer.datagram = peer.open_datagram()
+
+    def discard_snapshot(self) -> None:
+        try:
+            os.unlink(self.snapshot_path)
+        except OSError:
+            pass
+
+    def restore_node(self, snapshot: NodeSnapshot) -> None:
+        """Applies the node-wide state of a snapshot taken by the previous process"""
+        peer = self.peer
+        rotations = snapshot.node[0].rotations if snapshot.node else 0
+        peer.session_manager.restore_state(snapshot.sessions, snapshot.tokens, rotations)
+        for row in snapshot.invites:
+            invite = Invite(row.key_id, row.salt, row.digest, row.expires_at,
+                            int(row.uses_left) if row.uses_left is not None else None)
+            invite.created_at = row.created_at
+            peer.invites.restore(invite)
+        for row in snapshot.rooms:
+            peer.rooms.restore(row.name, row.members)
+        for row in snapshot.delivered:
+            peer.network.delivered_stored[row.peer_id] = row.seq
+
+    def restore_connections(self, snapshot: NodeSnapshot, fds: List[int]) -> list:
+        """Registers the connections of a snapshot on their descriptors, without reading yet"""
+        peer = self.peer
+        frames: Dict[int, list] = {}
+        for row in snapshot.frames:
+            frames.setdefault(row.connection, []).append((row.kind, row.payload))
+
+        records = []
+        for index, (row, fd) in enumerate(zip(snapshot.connections, fds)):
+            peer_socket = socket.socket(fileno=fd)
+            record = peer.peers.add(peer_socket, row.peer_id, (row.host, row.port), row.session_id,
+                                    AESGCM(row.aes_key), row.aes_key)
+            peer.network.restore_connection(record, row, frames.get(index, []))
+            records.append(record)
+        for row in snapshot.sender_keys:
+            peer.network.group_keys.install(records[row.connection].socket, row.key_id, row.key, row.room or None)
+        return records
+
+    def start_connections(self, records) -> None:
+        """Starts reading, then sends what the previous process left queued or unacknowledged"""
+        peer = self.peer
+        for record in records:
+            thread = threading.Thread(target=peer.handle_peer_messages, args=(record.socket,))
+            thread.daemon = True
+            thread.start()
+        for record in records:
+            try:
+                peer.network.service(record.socket)
+                peer.network.offer_datagram(record.socket)
+            except (OSError, SessionError):
+                pass
+
+    def complete(self, takeover: Takeover) -> None:
+        """
+        Restores what the previous process handed over, confirms, and starts
+        reading once it has let go of the sockets
+        """
+        peer = self.peer
+        self.restore_node(takeover.snapshot)
+        records = self.restore_connections(takeover.snapshot, takeover.fds)
+        try:
+            takeover.channel.sendall(CONFIRM)
+            released = takeover.channel.recv(1) == RELEASED
+        except OSError:
+            released = False
+        takeover.channel.close()
+        if not released:
+            raise ConnectionError("The previous process did not release its connections")
+
+        self.start_connections(records)
+        self.discard_snapshot()
+        paused = (time.time() - takeover.started) * 1000
+        peer.print_message(
+            f"{Fore.GREEN}[+] Took over {len(records)} connections; reads were paused for {paused:.0f} ms "
+            f"(previous process quiesced in {(takeover.stopped - takeover.started) * 1000:.0f} ms){Style.RESET_ALL}"
+        )
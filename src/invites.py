@@ -0,0 +1,110 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from typing import Dict, List, Optional
+
+KEY_ID_BYTES = 4
+SECRET_BYTES = 16
+SALT_BYTES = 16
+
+
+class Invite:
+    """Salted digest of one invite secret with its expiry and remaining uses"""
+    __slots__ = ('key_id', 'salt', 'digest', 'created_at', 'expires_at', 'uses_left')
+
+    def __init__(self, key_id, salt, digest, expires_at=None, uses_left=None):
+        self.key_id = key_id
+        self.salt = salt
+        self.digest = digest
+        self.created_at = time.time()
+        self.expires_at = expires_at
+        self.uses_left = uses_left
+
+    def is_expired(self, now):
+        return self.expires_at is not None and now >= self.expires_at
+
+
+def _digest(salt: bytes, secret: bytes) -> bytes:
+    return hmac.new(salt, secret, hashlib.sha256).digest()
+
+
+class InviteTable:
+    """
+    Invite secrets handed out by this node.
+
+    A token has the form <key_id>.<secret>. Only a salted digest of the secret is
+    kept, the short key id selects the entry in O(1), and the digest comparison is
+    constant-time, so verification costs the same however many invites exist.
+    """
+
+    def __init__(self):
+        self.invites: Dict[str, Invite] = {}
+        self.lock = threading.Lock()
+        # Unknown key ids are checked against this entry so they take as long as known ones
+        self._decoy = Invite('', secrets.token_bytes(SALT_BYTES), secrets.token_bytes(32))
+
+    def create(self, ttl: Optional[float] = None, max_uses: Optional[int] = None) -> str:
+        """Creates an invite and returns its token; the secret itself is not stored"""
+        secret = secrets.token_urlsafe(SECRET_BYTES)
+        salt = secrets.token_bytes(SALT_BYTES)
+        expires_at = time.time() + ttl if ttl else None
+
+        with self.lock:
+            key_id = secrets.token_hex(KEY_ID_BYTES)
+            while key_id in self.invites:
+                key_id = secrets.token_hex(KEY_ID_BYTES)
+            self.invites[key_id] = Invite(key_id, salt, _digest(salt, secret.encode()), expires_at, max_uses)
+
+        return f"{key_id}.{secret}"
+
+    def verify(self, token: str) -> bool:
+        """Checks a token and consumes one use of its invite"""
+        key_id, _, secret = token.partition('.')
+        now = time.time()
+
+        with self.lock:
+            invite = self.invites.get(key_id)
+            candidate = invite or self._decoy
+            matches = hmac.compare_digest(_digest(candidate.salt, secret.encode()), candidate.digest)
+
+            if invite is None or not matches:
+                return False
+
+            if invite.is_expired(now):
+                del self.invites[key_id]
+                return False
+
+            if invite.uses_left is not None:
+                invite.uses_left -= 1
+                if invite.uses_left <= 0:
+                    del self.invites[key_id]
+
+            return True
+
+    def restore(self, invite: Invite) -> None:
+        """Adds an invite that an earlier process of this node handed out"""
+        with self.lock:
+            self.invites[invite.key_id] = invite
+
+    def revoke(self, key_id: str) -> bool:
+        with self.lock:
+            return self.invites.pop(key_id, None) is not None
+
+    def purge_expired(self) -> int:
+        """Removes expired invites, returning how many were dropped"""
+        now = time.time()
+        with self.lock:
+            expired = [key_id for key_id, invite in self.invites.items() if invite.is_expired(now)]
+            for key_id in expired:
+                del self.invites[key_id]
+            return len(expired)
+
+    def list(self) -> List[Invite]:
+        with self.lock:
+            return list(self.invites.values())
+
+    def __len__(self):
+        with self.lock:
+            return len(self.invites)
@@ -1,46 +1,688 @@
+import base64
+import json
+import socket as sockets
+import struct
+import threading
+from collections import deque
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from .crypto import CryptoManager
-from .ui import format_error_message
-from .session import SessionError
+from .group_keys import GroupKeyManager, KEY_ID
+from .sequencing import Stream
+from .snapshot import ConnectionRow
+from .transport.scheduler import ThreadScheduler
+from .utils.buffers import BufferPool
+from .ui import format_error_message, format_system_message
+from .session import KeyRatchet, SessionError
+from .session.keys import KEY_SIZE
+from .storage import StorageError
+
+# sealed size, message kind, sequence number, cumulative acknowledgement
+# (the whole header is authenticated as associated data)
+FRAME_HEADER = struct.Struct('>IBII')
+# AES-GCM nonce and tag added to every sealed payload
+NONCE_SIZE = 12
+TAG_SIZE = 16
+SEAL_OVERHEAD = NONCE_SIZE + TAG_SIZE
+# flags, outbox sequence, original timestamp
+STORED_HEADER = struct.Struct('>BQd')
+STORED_BATCH_END = 0x01
+# datagram packet number, message kind
+FALLBACK_HEADER = struct.Struct('>QB')
+
+MSG_CHAT = 0
+MSG_CONTROL = 1
+MSG_STORED = 2
+MSG_DIRECT = 3
+MSG_ROOM = 4
+MSG_GROUP = 5
+MSG_ACK = 6
+# A datagram resent over TCP, dropped by the receiver if the datagram arrived after all
+MSG_FALLBACK = 7
+# Kinds that may be sealed with a sender key
+GROUP_KINDS = (MSG_CHAT, MSG_ROOM)
+# Kinds that may travel as datagrams; control and stored frames stay on TCP
+DATAGRAM_KINDS = (MSG_CHAT, MSG_DIRECT, MSG_ROOM)
+
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+IOV_MAX = 1024
+# Lets the service thread write without waiting on a peer that stopped reading;
+# where the platform lacks it, those writes block as before
+MSG_DONTWAIT = getattr(sockets, 'MSG_DONTWAIT', 0)
+# A standalone acknowledgement goes out after this many frames, or once the
+# delay passes without outgoing traffic to carry it
+ACK_EVERY = 32
+ACK_DELAY = 0.04
 
 
 class NetworkManager:
-    def __init__(self, peer):
+    def __init__(self, peer, scheduler=None):
         self.peer = peer
+        # Runs delayed acknowledgements and flushes; the simulator passes one on virtual time
+        self.scheduler = scheduler or ThreadScheduler()
+        self.clock = self.scheduler.clock
+        # Frames are read and decrypted into borrowed buffers, returned once handled
+        self.buffers = BufferPool(peer.network_config['buffer_pool'], debug=bool(peer.network_config['buffer_debug']))
+        self.delivered_stored = {}  # {peer_id: last outbox seq displayed}, also kept in the peer's outbox ring
+        self.group_keys = GroupKeyManager(peer.session_manager.config['rotation_interval'], clock=self.clock)
+        self.lock = threading.Lock()
+        # Guards the key ratchets; held while a key is derived, never across a write
+        self.key_lock = threading.Lock()
+        # Guards the frames each connection has waiting in the pipeline, finished by its workers
+        self.delivery_lock = threading.Lock()
 
-    def send_encrypted_message(self, socket, message, aes_gcm):
-        """Sends encrypted message with size control and session validation"""
+    def _stream(self, record):
+        stream = record.stream
+        if stream is None:
+            with self.lock:
+                stream = record.stream
+                if stream is None:
+                    # Our own window is the credit assumed until the peer advertises its own
+                    config = self.peer.network_config
+                    stream = record.stream = Stream(config['flow_window'], config['flow_frames'], FRAME_HEADER.size)
+        return stream
+
+    def forget_socket(self, socket, record=None):
+        """Releases per-socket state once a peer is removed"""
+        stream = record.stream if record is not None else None
+        if stream is not None:
+            # Wakes producers waiting for queue space
+            with stream.lock:
+                stream.closed = True
+                stream.wake_producers()
+        self.scheduler.cancel(socket)
+        self.group_keys.forget_socket(socket)
+        if self.peer.datagram:
+            self.peer.datagram.close_path(socket)
+
+    def detach_connection(self, record):
+        """
+        Stops every write on a connection and detaches its socket, so this process
+        can no longer touch it. Returns the file descriptor, the sequencing and flow
+        control state, and the (kind, payload) frames still queued.
+        """
+        stream = self._stream(record)
+        with stream.lock:
+            stream.closed = True
+            stream.wake_producers()
+            if stream.unsent:
+                # Sealed under this process's state, so they cannot wait for the next one
+                try:
+                    self._write_locked(record.socket, stream, [], True)
+                except OSError:
+                    # The next process finds the connection broken
+                    stream.unsent = []
+            window = stream.window
+            window.ack(stream.peer_acked)
+            self._take_control(stream)
+            in_flight = [window.sizes[seq & window.mask] for seq in range(window.acked + 1, window.next_seq)]
+            host, port = record.address[:2]
+            ratchet = record.ratchet or KeyRatchet()
+            previous_ttl = max(ratchet.previous_until - self.clock(), 0.0)
+            row = ConnectionRow(record.peer_id, host, port, record.session_id, record.aes_key,
+                                window.next_seq, window.acked, in_flight, stream.credit_bytes,
+                                stream.credit_frames, stream.expected, stream.received, stream.peer_acked,
+                                stream.ack_sent, stream.unacked, stream.unacked_bytes, ratchet.generation,
+                                ratchet.next_key or b'', b''.join(ratchet.previous_keys) if previous_ttl else b'',
+                                previous_ttl)
+            frames = list(stream.queue)
+            # Under the lock, so no writer or later shutdown can reach the socket
+            fd = record.socket.detach()
+        self.scheduler.cancel(record.socket)
+        return fd, row, frames
+
+    def restore_connection(self, record, row, frames):
+        """Continues the sequencing and flow control of a connection detached by another process"""
+        stream = self._stream(record)
+        with stream.lock:
+            window = stream.window
+            window.acked = row.acked
+            window.next_seq = row.acked + 1
+            for size in row.in_flight:
+                window.push(size)
+            stream.credit_bytes = row.credit_bytes
+            stream.credit_frames = row.credit_frames
+            stream.expected = row.expected
+            stream.received = row.received
+            stream.peer_acked = row.peer_acked
+            stream.ack_sent = row.ack_sent
+            stream.unacked = row.unacked
+            stream.unacked_bytes = row.unacked_bytes
+            stream.queue.extend(frames)
+            stream.queued_bytes = sum(FRAME_HEADER.size + len(payload) + SEAL_OVERHEAD for _, payload in frames)
+            stream.aes_gcm = record.aes_gcm
+            if row.key_generation or row.next_key:
+                ratchet = record.ratchet = KeyRatchet(row.key_generation)
+                if row.next_key:
+                    ratchet.next_key, ratchet.next_gcm = row.next_key, AESGCM(row.next_key)
+                ratchet.previous_keys = tuple(row.previous_keys[i:i + KEY_SIZE]
+                                              for i in range(0, len(row.previous_keys), KEY_SIZE))
+                ratchet.previous_gcms = tuple(AESGCM(key) for key in ratchet.previous_keys)
+                ratchet.previous_until = self.clock() + row.previous_ttl
+
+    @staticmethod
+    def recv_exact(socket, size, chunk_size=65536):
+        """Reads exactly size bytes, returning None if the connection closes first"""
+        buffer = bytearray()
+        while len(buffer) < size:
+            chunk = socket.recv(min(size - len(buffer), chunk_size))
+            if not chunk:
+                return None
+            buffer += chunk
+        return bytes(buffer)
+
+    @staticmethod
+    def recv_into_exact(socket, buffer, chunk_size=65536):
+        """Fills a writable buffer from the socket, returning False if the connection closes first"""
+        size = len(buffer)
+        if not size:
+            return True
+        received = socket.recv_into(buffer, min(size, chunk_size))
+        if received == size:
+            return True
+        # Only a short first read pays for slicing
+        view = memoryview(buffer)
+        offset = received
+        while offset < size:
+            if not received:
+                return False
+            received = socket.recv_into(view[offset:], min(size - offset, chunk_size))
+            offset += received
+        return True
+
+    @staticmethod
+    def send_plain_frame(socket, data):
+        """Sends an unencrypted length-prefixed handshake frame"""
+        socket.sendall(len(data).to_bytes(4, 'big') + data)
+
+    @classmethod
+    def recv_plain_frame(cls, socket, max_size=65536):
+        """Receives an unencrypted length-prefixed handshake frame"""
+        size_data = cls.recv_exact(socket, 4)
+        if size_data is None:
+            return None
+        size = int.from_bytes(size_data, 'big')
+        if size > max_size:
+            raise SessionError("Handshake frame too large")
+        return cls.recv_exact(socket, size)
+
+    @staticmethod
+    def build_group_body(sender_key, kind, payload):
+        """Seals a payload once with a sender key; the body is the same for every recipient"""
+        key_id = KEY_ID.pack(sender_key.key_id)
+        return key_id + CryptoManager.encrypt_bytes(
+            sender_key.aes_gcm, bytes([kind]) + payload, bytes([MSG_GROUP]) + key_id
+        )
+
+    @staticmethod
+    def associated_data(header, kind, body):
+        """
+        What the pairwise seal of a frame authenticates besides its payload. A group
+        body is shared by every recipient, so its frame carries an empty pairwise seal
+        over the header that is bound to the body through its key id, nonce and tag.
+        """
+        if kind == MSG_GROUP:
+            return b''.join((header, body[:KEY_ID.size + NONCE_SIZE], body[-TAG_SIZE:]))
+        return header
+
+    def decrypt_pooled(self, aes_gcm, data, associated_data):
+        """Decrypts a sealed payload into a buffer borrowed from the pool"""
+        buffer = self.buffers.acquire(len(data) - SEAL_OVERHEAD)
         try:
-            # Verify if socket has a valid session
-            if socket not in self.peer.peers:
-                raise SessionError("No session found for socket")
+            CryptoManager.decrypt_into(aes_gcm, data, associated_data, buffer)
+        except BaseException:
+            self.buffers.release(buffer)
+            raise
+        return buffer
+
+    @staticmethod
+    def unseal_with(keys, unseal):
+        """Calls unseal with each key in turn, returning the result of the first that authenticates"""
+        for aes_gcm in keys[:-1]:
+            try:
+                return unseal(aes_gcm)
+            except InvalidTag:
+                pass
+        return unseal(keys[-1])
+
+    def open_frame(self, socket, header, kind, data, keys):
+        """
+        Authenticates a frame with its header and returns the plaintext in a pooled
+        buffer. keys are the pairwise keys it may be sealed with, in the order to
+        try them. Group frames are opened with the sender key too, kind byte first.
+        """
+        if len(data) < SEAL_OVERHEAD:
+            raise SessionError("Frame too short")
+        if kind != MSG_GROUP:
+            return self.unseal_with(keys, lambda aes_gcm: self.decrypt_pooled(aes_gcm, data, header))
+        with memoryview(data) as frame, frame[:-SEAL_OVERHEAD] as body:
+            associated_data = self.associated_data(header, kind, body)
+            self.unseal_with(keys, lambda aes_gcm: CryptoManager.decrypt_bytes(
+                aes_gcm, frame[-SEAL_OVERHEAD:], associated_data))
+            return self.open_group_frame(socket, body)
+
+    def open_group_frame(self, socket, data):
+        """Opens a frame sealed with the sender key of the peer on this socket"""
+        key_id = bytes(data[:KEY_ID.size])
+        aes_gcm = self.group_keys.lookup(socket, KEY_ID.unpack(key_id)[0])
+        if aes_gcm is None:
+            raise SessionError("Group frame sealed with an unknown sender key")
+
+        plaintext = self.decrypt_pooled(aes_gcm, data[KEY_ID.size:], bytes([MSG_GROUP]) + key_id)
+        if not plaintext or plaintext[0] not in GROUP_KINDS:
+            kind = plaintext[0] if plaintext else None
+            self.buffers.release(plaintext)
+            raise SessionError(f"Message kind {kind} cannot be sent to a group")
+        return plaintext
+
+    @staticmethod
+    def write_buffers(socket, buffers, blocking=True):
+        """
+        Writes buffers to a socket, using vectored writes where available. Without
+        blocking, stops where the socket would block and returns what is left.
+        """
+        if not hasattr(socket, 'sendmsg'):
+            socket.sendall(b''.join(buffers))
+            return []
+
+        flags = 0 if blocking else MSG_DONTWAIT
+        pending = [memoryview(buffer) for buffer in buffers]
+        index = 0
+        while index < len(pending):
+            try:
+                sent = socket.sendmsg(pending[index:index + IOV_MAX], (), flags)
+            except BlockingIOError:
+                return pending[index:]
+            # Skip the buffers that went out completely, trim a partial one
+            while sent and index < len(pending):
+                if sent >= len(pending[index]):
+                    sent -= len(pending[index])
+                    index += 1
+                else:
+                    pending[index] = pending[index][sent:]
+                    sent = 0
+        return []
+
+    def _write_locked(self, socket, stream, buffers, blocking):
+        # Bytes left by a write that would have blocked go first, so frames stay in
+        # order; returns False while some are still waiting for the socket
+        stream.unsent = self.write_buffers(socket, stream.unsent + buffers, blocking)
+        return not stream.unsent
+
+    def _send_locked(self, socket, stream, frames, aes_gcm, blocking=True):
+        # Frames are numbered, sealed and written under the stream lock, so they
+        # reach the wire in sequence order. Once sealed they are sent: bytes a
+        # write without blocking could not take wait in stream.unsent
+        window = stream.window
+        ack = stream.received
+        headers = []
+        for kind, payload in frames:
+            size = len(payload) + SEAL_OVERHEAD
+            # Acknowledgements are not counted in flight, so they never wait for credit
+            seq = window.push(0 if kind == MSG_ACK else FRAME_HEADER.size + size)
+            headers.append(FRAME_HEADER.pack(size, kind, seq, ack))
+
+        sealed = self.peer.crypto_pool.seal_many([
+            (aes_gcm, b'', self.associated_data(header, kind, payload)) if kind == MSG_GROUP
+            else (aes_gcm, payload, header)
+            for header, (kind, payload) in zip(headers, frames)
+        ])
+
+        buffers = []
+        for header, (kind, payload), body in zip(headers, frames, sealed):
+            buffers.append(header)
+            if kind == MSG_GROUP:
+                buffers.append(payload)
+            buffers.append(body)
+        written = self._write_locked(socket, stream, buffers, blocking)
+
+        if ack != stream.ack_sent:
+            stream.stats['acks_sent' if frames[-1][0] == MSG_ACK else 'acks_piggybacked'] += 1
+            stream.ack_sent = ack
+            with self.delivery_lock:
+                stream.unacked = stream.unacked_bytes = 0
+        return written
+
+    @staticmethod
+    def _take_control(stream):
+        # Moves control frames queued by the receive thread behind the frames already waiting
+        control = stream.control
+        while control:
+            kind, payload = control.popleft()
+            stream.queue.append((kind, payload))
+            stream.queued_bytes += FRAME_HEADER.size + len(payload) + SEAL_OVERHEAD
+
+    def _flush_locked(self, socket, stream, blocking=True):
+        # Writes queued frames while the peer has credit for them, returning False
+        # if, without blocking, the socket stopped taking them
+        if stream.unsent and not self._write_locked(socket, stream, [], blocking):
+            return False
+        window = stream.window
+        window.ack(stream.peer_acked)
+        self._take_control(stream)
+        while stream.queue:
+            in_flight, frames = window.in_flight, window.data_frames
+            batch = []
+            batch_bytes = 0
+            # Each frame takes up to three buffers in one vectored write
+            while stream.queue and len(batch) < IOV_MAX // 3:
+                kind, payload = stream.queue[0]
+                size = FRAME_HEADER.size + len(payload) + SEAL_OVERHEAD
+                # An idle connection always takes one frame, however large
+                if (in_flight or frames) and (in_flight + size > stream.credit_bytes
+                                              or frames + 1 > stream.credit_frames):
+                    break
+                stream.queue.popleft()
+                batch.append((kind, payload))
+                batch_bytes += size
+                in_flight += size
+                frames += 1
+
+            if not batch:
+                break
+            stream.queued_bytes -= batch_bytes
+            written = self._send_locked(socket, stream, batch, stream.aes_gcm, blocking)
+            stream.wake_producers()
+            self._take_control(stream)
+            if not written:
+                return False
+
+        if stream.queue and stream.stall_started is None:
+            stream.stall_started = self.clock()
+            stream.stats['stalls'] += 1
+        elif not stream.queue and stream.stall_started is not None:
+            stream.stats['stalled_time'] += self.clock() - stream.stall_started
+            stream.stall_started = None
+        return True
+
+    def _wait_for_space(self, stream, size):
+        # Blocks a producer while the queue is full, so memory stays bounded on both sides
+        config = self.peer.network_config
+        if not stream.queue or stream.queued_bytes + size <= config['flow_queue']:
+            return
+        if not self.scheduler.blocking:
+            raise SessionError("Outbound queue full")
+        stream.stats['producer_waits'] += 1
+        started = self.clock()
+        deadline = started + config['flow_stall_timeout']
+        try:
+            while stream.queue and stream.queued_bytes + size > config['flow_queue']:
+                remaining = deadline - self.clock()
+                if stream.closed:
+                    raise SessionError("Connection closed")
+                if remaining <= 0:
+                    raise SessionError(f"Peer has not consumed messages for {config['flow_stall_timeout']}s")
+                stream.wait_for_space(remaining)
+        finally:
+            stream.stats['producer_wait_time'] += self.clock() - started
 
-            # Get session from peers dictionary
-            peer_id, address, session_id = self.peer.peers[socket]
+    def send_frames(self, socket, frames, aes_gcm):
+        """
+        Sends (kind, payload) frames in order. Each header carries the next sequence
+        number and acknowledges every frame consumed so far on this connection.
+        Frames the peer has no credit for wait in the connection's queue; a full
+        queue blocks the caller, except for control frames. The writer holds the
+        connection until the socket takes the frames, so the receive thread never
+        calls this and hands its frames to queue_control() instead. Frames are
+        sealed with the connection's current key when written, which a rotation
+        may have moved past the aes_gcm the caller read.
+        """
+        record = self.peer.peers.get(socket)
+        if record is None:
+            raise SessionError("No session found for socket")
+        stream = self._stream(record)
+        size = sum(FRAME_HEADER.size + len(payload) + SEAL_OVERHEAD for _, payload in frames)
+        with stream.lock:
+            if any(kind != MSG_CONTROL for kind, _ in frames):
+                self._wait_for_space(stream, size)
+            if stream.closed:
+                raise SessionError("Connection closed")
+            # Set once; advance_key() moves it on, and a writer must not put back a key it read earlier
+            stream.aes_gcm = stream.aes_gcm or record.aes_gcm
+            stream.queue.extend(frames)
+            stream.queued_bytes += size
+            stream.stats['queue_peak'] = max(stream.stats['queue_peak'], stream.queued_bytes)
+            try:
+                self._flush_locked(socket, stream)
+            except OverflowError as e:
+                raise SessionError(f"{e}, reconnect to continue")
+        self._control_left(socket, stream)
+
+    def service(self, socket, blocking=True):
+        """
+        Writes the queued frames the peer has credit for, then any acknowledgement
+        still owed. Without blocking, returns False when a writer holds the connection
+        or the socket would not take everything. Never called from the receive thread,
+        which must not wait on a writer.
+        """
+        record = self.peer.peers.get(socket)
+        if record is None:
+            return True
+        stream = self._stream(record)
+        if not stream.lock.acquire(blocking):
+            return False
+        try:
+            if stream.aes_gcm is None or stream.closed:
+                return True
+            if not self._flush_locked(socket, stream, blocking):
+                return False
+            if (stream.received != stream.ack_sent
+                    and not self._send_locked(socket, stream, [(MSG_ACK, b'')], stream.aes_gcm, blocking)):
+                return False
+        finally:
+            stream.lock.release()
+        self._control_left(socket, stream)
+        return True
+
+    def _control_left(self, socket, stream):
+        # A control frame queued after the writer's last look goes out with the next service
+        if stream.control:
+            self._schedule(socket, 0)
+
+    def _schedule(self, socket, delay):
+        self.scheduler.call_at(socket, self.clock() + delay, self._service_due)
+
+    def _service_due(self, socket):
+        if socket not in self.peer.peers:
+            return
+        try:
+            # The scheduler serves every connection, so it does not wait behind a
+            # writer blocked on one of them, nor on a peer that stopped reading;
+            # what is queued or owed is tried again later
+            if not self.service(socket, blocking=False):
+                self._schedule(socket, ACK_DELAY)
+        except (OSError, SessionError):
+            # The receive thread notices the broken connection
+            pass
+
+    def _frame_received(self, socket, stream, seq, ack):
+        # TCP keeps frames in order, so a gap or repeat means frames were dropped or replayed
+        if seq != stream.expected:
+            raise SessionError(f"Frame {seq} out of sequence, expected {stream.expected}")
+        if not stream.peer_acked <= ack < stream.window.next_seq:
+            raise SessionError(f"Invalid acknowledgement {ack}")
+        stream.expected += 1
+
+        if ack != stream.peer_acked:
+            stream.peer_acked = ack
+            # Credit came back: the service thread releases queued frames, since
+            # writing from here could block on a peer that is itself writing
+            if stream.queue:
+                self._schedule(socket, 0)
 
-            # Check for session rotation
-            if self.peer.session_manager.check_rotation_needed(session_id):
-                # Perform session rotation
+    def _consumed(self, socket, stream, seq, size):
+        # Acknowledging a frame once it has been handled returns its credit to the sender
+        with self.delivery_lock:
+            if stream.delivering:
+                # Acknowledgements are cumulative, so this one waits for the frames
+                # before it that are still in the pipeline
+                stream.delivering.append([seq, size, True])
+                return
+            burst = self._acknowledge_locked(stream, seq, size)
+        if size:
+            self._ack_soon(socket, burst)
+
+    def _acknowledge_locked(self, stream, seq, size):
+        stream.received = seq
+        if not size:
+            return False
+        stream.unacked += 1
+        stream.unacked_bytes += size
+        return (stream.unacked >= ACK_EVERY
+                or stream.unacked_bytes >= self.peer.network_config['flow_window'] // 4)
+
+    def _ack_soon(self, socket, burst):
+        # The service thread writes the acknowledgement, right away after a burst,
+        # unless a frame going out first carries it
+        self._schedule(socket, 0 if burst else ACK_DELAY)
+
+    def _handed_on(self, socket, stream, seq, size):
+        # Holds back the acknowledgement of a frame given to the pipeline, and
+        # returns the callback that releases it with every finished frame after it
+        entry = [seq, size, False]
+        with self.delivery_lock:
+            if stream.delivering is None:
+                stream.delivering = deque()
+            stream.delivering.append(entry)
+
+        def done():
+            burst = sized = False
+            with self.delivery_lock:
+                entry[2] = True
+                pending = stream.delivering
+                while pending and pending[0][2]:
+                    seq, size, _ = pending.popleft()
+                    burst = self._acknowledge_locked(stream, seq, size) or burst
+                    sized = sized or bool(size)
+            if sized:
                 try:
-                    new_session_id, token = self.peer.session_manager.rotate_session(session_id)
-
-                    # Queue message during rotation
-                    self.peer.session_manager.queue_message(new_session_id, message)
-
-                    # Update peers dictionary with new session
-                    self.peer.peers[socket] = (peer_id, address, new_session_id)
-
-                    # Send rotation notification to peer
-                    rotation_notice = {
-                        'type': 'session_rotation',
-                        'token': token,
-                        'new_session': new_session_id
-                    }
-                    # Encrypt and send rotation notice
-                    encrypted_notice = CryptoManager.encrypt_message(aes_gcm, str(rotation_notice))
-                    size_bytes = len(encrypted_notice).to_bytes(4, 'big')
-                    socket.sendall(size_bytes + encrypted_notice)
-                    return True
+                    self._ack_soon(socket, burst)
+                except (OSError, SessionError):
+                    # The receive thread notices the broken connection
+                    pass
+        return done
+
+    def advertise_credit(self, socket):
+        """Tells a peer how much it may send before this node consumes it"""
+        record = self.peer.peers.get(socket)
+        if record is None:
+            return
+        config = self.peer.network_config
+        self.send_control(socket, {
+            'type': 'flow_credit',
+            'bytes': config['flow_window'],
+            'frames': config['flow_frames']
+        }, record.aes_gcm)
+
+    def stream_stats(self, record):
+        """Sequence, acknowledgement and flow control counters of a connection"""
+        stream = record.stream if record is not None else None
+        if stream is None:
+            return None
+        with stream.lock:
+            window = stream.window
+            window.ack(stream.peer_acked)
+            stats = dict(stream.stats, sent=window.next_seq - 1, acked=window.acked,
+                         in_flight=window.data_frames, in_flight_bytes=window.in_flight,
+                         received=stream.received, queued=len(stream.queue),
+                         queued_bytes=stream.queued_bytes, credit_bytes=stream.credit_bytes,
+                         credit_frames=stream.credit_frames)
+            if stream.stall_started is not None:
+                stats['stalled_time'] += self.clock() - stream.stall_started
+            return stats
+
+    def rotate_session(self, record):
+        """
+        Replaces the session of a connection and announces the next key
+        generation. Frames keep going out under the current key until the peer
+        confirms, so nothing waits for the rotation.
+        """
+        stream = self._stream(record)
+        with stream.lock:
+            # Another sender may have rotated it in the meantime
+            if not self.peer.session_manager.check_rotation_needed(record.session_id):
+                return
+            new_session_id, token = self.peer.session_manager.rotate_session(record.session_id)
+            self.peer.peers.update_session(record.socket, new_session_id)
+            notice = {
+                'type': 'session_rotation',
+                'token': token,
+                'new_session': new_session_id
+            }
+            if record.aes_key is not None:
+                with self.key_lock:
+                    if record.ratchet is None:
+                        record.ratchet = KeyRatchet()
+                    notice['generation'] = record.ratchet.propose(record.aes_key)
+        self.send_control(record.socket, notice, record.aes_gcm)
+
+    def advance_key(self, record, generation):
+        """
+        Moves a connection to the key generation its peer announced or confirmed.
+        The receive thread calls this, so the key is swapped without waiting for
+        a writer. A frame still being sealed with the old key is opened by the
+        peer all the same: it accepts both keys until it confirms, and the old
+        one for the overlap window after that.
+        """
+        if record.aes_key is None:
+            return
+        stream = self._stream(record)
+        with self.key_lock:
+            if record.ratchet is None:
+                record.ratchet = KeyRatchet()
+            keys = record.ratchet.advance(record.aes_key, record.aes_gcm, generation, self.clock(),
+                                          self.peer.session_manager.config['rekey_overlap'])
+            if keys is None:
+                return
+            # Frames sealed from here on, queued ones included, use the new key
+            record.aes_key, record.aes_gcm = keys
+            stream.aes_gcm = record.aes_gcm
+        if self.peer.datagram:
+            self.peer.datagram.set_key(record.socket, record.aes_gcm)
 
+    def receive_keys(self, record):
+        """Keys a frame from this peer may be sealed with, the current one first"""
+        ratchet = record.ratchet
+        if ratchet is None:
+            return (record.aes_gcm,)
+        return ratchet.receive_keys(record.aes_gcm, self.clock())
+
+    def datagram_keys(self, socket):
+        """Keys a datagram from the peer on this socket may be sealed with"""
+        record = self.peer.peers.get(socket)
+        return self.receive_keys(record) if record is not None else ()
+
+    def send_control(self, socket, payload, aes_gcm):
+        """Sends an encrypted protocol control message"""
+        self.send_frames(socket, [(MSG_CONTROL, json.dumps(payload).encode())], aes_gcm)
+
+    def queue_control(self, record, payload):
+        """
+        Queues a control message for the service thread to send. The receive
+        thread replies this way, so it keeps reading while a writer waits for
+        the peer to read in turn.
+        """
+        stream = self._stream(record)
+        stream.aes_gcm = stream.aes_gcm or record.aes_gcm
+        stream.control.append((MSG_CONTROL, json.dumps(payload).encode()))
+        self._schedule(record.socket, 0)
+
+    def send_encrypted_message(self, socket, message, aes_gcm, kind=MSG_CHAT):
+        """
+        Sends encrypted message with size control and session validation.
+        The message is text, or an already encoded payload for kinds with their own header.
+        """
+        payload = message.encode() if isinstance(message, str) else message
+        try:
+            # Verify if socket has a valid session
+            record = self.peer.peers.get(socket)
+            if record is None:
+                raise SessionError("No session found for socket")
+
+            # Check for session rotation; the message follows the notice right away
+            if self.peer.session_manager.check_rotation_needed(record.session_id):
+                try:
+                    self.rotate_session(record)
                 except SessionError as e:
                     self.peer.message_handler.print_message(
                         format_error_message(f"[-] Session rotation failed: {e}")
@@ -48,9 +690,9 @@ class NetworkManager:
                     return False
 
             # Normal message sending
-            encrypted_data = CryptoManager.encrypt_message(aes_gcm, message)
-            size_bytes = len(encrypted_data).to_bytes(4, 'big')
-            socket.sendall(size_bytes + encrypted_data)
+            if kind in DATAGRAM_KINDS and self.peer.datagram and self.peer.datagram.send(socket, kind, payload):
+                return True
+            self.send_frames(socket, [(kind, payload)], aes_gcm)
             return True
 
         except SessionError as e:
@@ -64,94 +706,498 @@ class NetworkManager:
             )
             return False
 
-    def receive_encrypted_message(self, socket, aes_gcm):
-        """Receives encrypted message with size control and session validation"""
+    def receive_frames(self, socket):
+        """
+        Reads and handles frames with size control and session validation until
+        the connection closes or fails. Messages go on to the pipeline, so this
+        never waits for them to be displayed.
+        """
         try:
-            # Verify if socket has a valid session
-            if socket not in self.peer.peers:
-                raise SessionError("No session found for socket")
-
-            # Get session information
-            peer_id, address, session_id = self.peer.peers[socket]
-
-            # Verify session validity
-            if not self.peer.session_manager.is_session_valid(session_id):
-                raise SessionError("Invalid session")
-
-            size_data = socket.recv(4)
-            if not size_data:
-                return None
+            while True:
+                # Verify if socket has a valid session
+                record = self.peer.peers.get(socket)
+                if record is None:
+                    raise SessionError("No session found for socket")
 
-            msg_size = int.from_bytes(size_data, 'big')
+                # Verify session validity
+                if not self.peer.session_manager.is_session_valid(record.session_id):
+                    raise SessionError("Invalid session")
 
-            encrypted_data = b''
-            remaining = msg_size
-            while remaining > 0:
-                chunk = socket.recv(min(remaining, 4096))
-                if not chunk:
+                header = self._stream(record).header
+                if not self.recv_into_exact(socket, header):
                     return None
-                encrypted_data += chunk
-                remaining -= len(chunk)
 
-            decrypted_message = CryptoManager.decrypt_message(aes_gcm, encrypted_data)
-
-            # Check if message is a session rotation notice
-            try:
-                message_data = eval(decrypted_message)
-                if isinstance(message_data, dict) and message_data.get('type') == 'session_rotation':
-                    # Handle session rotation
-                    new_session_id = message_data['new_session']
-                    token = message_data['token']
-
-                    # Validate transition
-                    if self.peer.session_manager.validate_transition(session_id, new_session_id, token):
-                        # Update session in peers dictionary
-                        self.peer.peers[socket] = (peer_id, address, new_session_id)
-
-                        # Process any queued messages
-                        queued_messages = self.peer.session_manager.process_queued_messages(new_session_id)
-                        for queued_msg in queued_messages:
-                            self.send_encrypted_message(socket, queued_msg, aes_gcm)
+                msg_size = FRAME_HEADER.unpack(header)[0]
+                if msg_size > MAX_FRAME_SIZE:
+                    raise SessionError(f"Frame of {msg_size} bytes exceeds limit")
 
+                encrypted_data = self.buffers.acquire(msg_size)
+                try:
+                    if not self.recv_into_exact(socket, encrypted_data, self.peer.network_config['recv_buffer']):
                         return None
-            except:
-                # If not a rotation notice, treat as normal message
-                pass
-
-            return decrypted_message
+                    self.process_frame(record, header, encrypted_data)
+                finally:
+                    self.buffers.release(encrypted_data)
+                if self.peer.handoff is not None and self.peer.handoff.is_parked(socket):
+                    # Everything after the peer's handoff_ack is read by the next process
+                    return None
 
         except SessionError as e:
             self.peer.message_handler.print_message(
                 format_error_message(f"[-] Session error: {e}")
             )
             return None
+        except Exception as e:
+            if self.peer.running and socket in self.peer.peers:
+                self.peer.message_handler.print_message(
+                    format_error_message(f"[-] Error receiving message: {e}")
+                )
+            return None
+
+    def process_frame(self, record, header, data):
+        """
+        Authenticates and handles one received frame. A message frame counts as
+        consumed once the pipeline is done with it, or right away without one.
+        """
+        socket = record.socket
+        stream = self._stream(record)
+        stream.aes_gcm = stream.aes_gcm or record.aes_gcm
+        msg_size, kind, seq, ack = FRAME_HEADER.unpack(header)
+
+        plaintext = payload = self.open_frame(socket, header, kind, data, self.receive_keys(record))
+        try:
+            self._frame_received(socket, stream, seq, ack)
+            # Matches what the sender counted in flight
+            size = 0 if kind == MSG_ACK else FRAME_HEADER.size + msg_size
+            if kind == MSG_GROUP:
+                kind, payload = plaintext[0], plaintext[1:]
+
+            # Handlers copy what they keep, so the buffer can go back to the pool
+            if kind == MSG_CONTROL:
+                self.handle_control(record, json.loads(str(payload, 'utf-8')))
+            elif kind == MSG_STORED:
+                if self.handle_stored(record, payload, seq, size):
+                    return
+            elif kind == MSG_FALLBACK:
+                if self.handle_fallback(record, payload, seq, size):
+                    return
+            elif kind != MSG_ACK:
+                if self.deliver(record, kind, payload, seq, size):
+                    return
+            self._consumed(socket, stream, seq, size)
+        finally:
+            if payload is not plaintext:
+                payload.release()
+            self.buffers.release(plaintext)
+
+    @staticmethod
+    def decode_message(kind, payload):
+        """Text and channel of a chat, direct or room message payload"""
+        if kind == MSG_DIRECT:
+            return str(payload, 'utf-8'), 'direct'
+        if kind == MSG_ROOM:
+            name_end = 1 + payload[0]
+            return str(payload[name_end:], 'utf-8'), str(payload[1:name_end], 'utf-8')
+        return str(payload, 'utf-8'), None
+
+    def deliver(self, record, kind, payload, seq=None, size=0, sent_at=None):
+        """
+        Hands a chat, direct or room message to the pipeline, holding back the
+        acknowledgement of frame seq until it is done. Without a pipeline the
+        message is displayed here. Returns True if the frame is consumed later.
+        """
+        pipeline = self.peer.pipeline
+        if pipeline is None:
+            text, channel = self.decode_message(kind, payload)
+            self.peer.display_message(record.peer_id, record.session_id, text, sent_at=sent_at, channel=channel)
+            return False
+
+        done = None
+        if seq is not None:
+            done = self._handed_on(record.socket, self._stream(record), seq, size)
+        if not pipeline.submit(record.peer_id, record.session_id, kind, bytes(payload), sent_at, done):
+            # Shutting down: nothing is displayed any more
+            if done is not None:
+                done()
+        return done is not None
+
+    def offer_datagram(self, socket):
+        """Tells a peer where to send datagrams for this connection"""
+        record = self.peer.peers.get(socket)
+        if not self.peer.datagram or record is None:
+            return
+        local_id = self.peer.datagram.open_path(socket, record.aes_gcm)
+        self.queue_control(record, {
+            'type': 'datagram_offer',
+            'id': local_id.hex(),
+            'port': self.peer.datagram.port
+        })
+
+    def datagram_received(self, socket, kind, payload):
+        """Handles a frame that arrived over the datagram transport"""
+        record = self.peer.peers.get(socket)
+        if record is None or kind not in DATAGRAM_KINDS:
+            return
+        try:
+            self.deliver(record, kind, payload)
         except Exception as e:
             self.peer.message_handler.print_message(
-                format_error_message(f"[-] Error receiving message: {e}")
+                format_error_message(f"\r[-] Error handling datagram from {record.peer_id}: {e}")
             )
-            return None
 
-    def broadcast_message(self, message, sender_socket=None):
-        """Sends message to all connected peers with session validation"""
-        peers_to_remove = []
+    @staticmethod
+    def fallback_frame(kind, payload, number=None):
+        """
+        The TCP frame for a datagram that was never acknowledged. With its packet
+        number, the receiver drops it if the datagram got through after all.
+        """
+        if number is None:
+            return kind, payload
+        return MSG_FALLBACK, FALLBACK_HEADER.pack(number, kind) + payload
+
+    def datagram_undeliverable(self, socket, kind, payload, number=None):
+        """Resends over TCP a frame whose datagrams were never acknowledged"""
+        record = self.peer.peers.get(socket)
+        if record is None:
+            return
+        try:
+            self.send_frames(socket, [self.fallback_frame(kind, payload, number)], record.aes_gcm)
+        except (OSError, SessionError):
+            pass
+
+    def handle_fallback(self, record, payload, seq=None, size=0):
+        """
+        Delivers a datagram its sender resent over TCP, unless the datagram
+        itself arrived. Returns True if frame seq is consumed later, as deliver() does.
+        """
+        number, kind = FALLBACK_HEADER.unpack_from(payload)
+        if kind not in DATAGRAM_KINDS:
+            raise SessionError(f"Message kind {kind} cannot be sent as a datagram")
+        datagram = self.peer.datagram
+        if datagram and not datagram.claim(record.socket, number):
+            return False
+        return self.deliver(record, kind, payload[FALLBACK_HEADER.size:], seq, size)
 
-        for peer_socket, (peer_id, address, session_id) in list(self.peer.peers.items()):
-            if peer_socket != sender_socket:
+    def handle_control(self, record, message_data):
+        """Handles a decrypted control message"""
+        message_type = message_data.get('type')
+
+        if message_type == 'session_rotation':
+            reply = {
+                'type': 'session_rotation_ack',
+                'token': message_data['token'],
+                'new_session': message_data['new_session']
+            }
+            if 'generation' in message_data:
+                # Everything sent from here on, the confirmation included, uses the new key
+                reply['generation'] = int(message_data['generation'])
+                self.advance_key(record, reply['generation'])
+            self.queue_control(record, reply)
+
+        elif message_type == 'session_rotation_ack':
+            new_session_id = message_data['new_session']
+            if 'generation' in message_data:
+                self.advance_key(record, int(message_data['generation']))
+            self.peer.session_manager.validate_transition(new_session_id, message_data['token'])
+
+        elif message_type == 'sender_key':
+            self.group_keys.install(record.socket, int(message_data['key_id']),
+                                    base64.b64decode(message_data['key']),
+                                    str(message_data['room']) if 'room' in message_data else None)
+
+        elif message_type == 'datagram_offer':
+            if self.peer.datagram:
+                if self.peer.datagram.bind_remote(record.socket, record.aes_gcm, bytes.fromhex(message_data['id']),
+                                                  record.address[0], int(message_data['port'])):
+                    self.offer_datagram(record.socket)
+
+        elif message_type == 'handoff':
+            # The peer hands its sockets to a new process; frames after this reply go to that one
+            self.queue_control(record, {'type': 'handoff_ack'})
+
+        elif message_type == 'handoff_ack':
+            if self.peer.handoff is not None:
+                self.peer.handoff.park(record.socket)
+
+        elif message_type == 'flow_credit':
+            stream = self._stream(record)
+            stream.credit_bytes = max(1, int(message_data['bytes']))
+            stream.credit_frames = max(1, int(message_data['frames']))
+            self._schedule(record.socket, 0)
+
+        elif message_type == 'outbox_ack':
+            if self.peer.outbox:
+                self.peer.outbox.ack(record.peer_id, int(message_data['seq']))
+
+    def handle_stored(self, record, payload, frame_seq=None, size=0):
+        """
+        Delivers a message from the sender's outbox and acknowledges batches.
+        Returns True if frame frame_seq is consumed later, as deliver() does.
+        """
+        flags, seq, timestamp = STORED_HEADER.unpack_from(payload)
+
+        # Redelivery after a lost acknowledgement must not show the message twice,
+        # even when the acknowledgement was lost to a restart
+        outbox = self.peer.outbox
+        delivered = self.delivered_stored.get(record.peer_id)
+        if delivered is None:
+            delivered = outbox.inbound_seq(record.peer_id) if outbox else 0
+        later = False
+        if seq > delivered:
+            self.delivered_stored[record.peer_id] = seq
+            if outbox:
                 try:
-                    # Verify session validity
-                    if not self.peer.session_manager.is_session_valid(session_id):
-                        peers_to_remove.append(peer_socket)
-                        continue
+                    outbox.mark_inbound(record.peer_id, seq)
+                except OSError as e:
+                    self.peer.message_handler.print_message(
+                        format_error_message(f"\r[-] Error recording stored message from {record.peer_id}: {e}")
+                    )
+            later = self.deliver(record, MSG_CHAT, payload[STORED_HEADER.size:], frame_seq, size, sent_at=timestamp)
+
+        if flags & STORED_BATCH_END:
+            self.queue_control(record, {'type': 'outbox_ack', 'seq': seq})
+        return later
+
+    def drain_outbox(self, socket):
+        """Delivers messages stored for a peer while it was offline"""
+        outbox = self.peer.outbox
+        record = self.peer.peers.get(socket)
+        if not outbox or record is None:
+            return 0
+
+        peer_id = record.peer_id
+        ring = outbox.get(peer_id)
+        if ring is None:
+            return 0
 
-                    # Get encryption context for this peer
-                    aes_gcm = self.peer.crypto_contexts[peer_socket]
-                    self.send_encrypted_message(peer_socket, message, aes_gcm)
+        aes_gcm = record.aes_gcm
+        batch_size = self.peer.storage_config['outbox_batch']
+        ring.expire(outbox.ttl)
 
-                except Exception as e:
+        delivered = 0
+        position = None
+        try:
+            while self.peer.running and socket in self.peer.peers:
+                records, position = ring.read(position, batch_size, outbox.ttl)
+                if not records:
+                    break
+
+                frames = []
+                for index, (seq, timestamp, message) in enumerate(records):
+                    flags = STORED_BATCH_END if index == len(records) - 1 else 0
+                    frames.append((MSG_STORED, STORED_HEADER.pack(flags, seq, timestamp) + message.encode()))
+
+                self.send_frames(socket, frames, aes_gcm)
+                delivered += len(records)
+
+        except (OSError, SessionError, StorageError) as e:
+            self.peer.message_handler.print_message(
+                format_error_message(f"\r[-] Error delivering stored messages to {peer_id}: {e}")
+            )
+
+        if delivered:
+            self.peer.message_handler.print_message(
+                format_system_message(f"\r[*] Delivered {delivered} stored message(s) to {peer_id}")
+            )
+        return delivered
+
+    def _route(self, peer_id, kind, payload, message):
+        """
+        Delivers one frame to a peer found through the peer-ID index, or keeps the
+        message in its outbox. Returns 'sent', 'stored' or None if unreachable.
+        """
+        record = self.peer.peers.get_by_peer_id(peer_id)
+        if record is not None and self.peer.session_manager.is_session_valid(record.session_id):
+            if self.send_encrypted_message(record.socket, payload, record.aes_gcm, kind):
+                return 'sent'
+            self.peer.remove_peer(record.socket)
+
+        outbox = self.peer.outbox
+        if outbox and outbox.get(peer_id) is not None:
+            try:
+                outbox.enqueue(peer_id, message)
+                return 'stored'
+            except (OSError, StorageError) as e:
+                self.peer.message_handler.print_message(
+                    format_error_message(f"\r[-] Error storing message for {peer_id}: {e}")
+                )
+        return None
+
+    def send_group(self, records, kind, payload, room=None):
+        """
+        Seals a payload once with this node's sender key, or the room's when room
+        is given, and writes the same frame to every record, handing the key over
+        first to peers that lack it. For a room the records must be exactly its
+        online members. Returns the records the frame could not be delivered to.
+        """
+        if room is None:
+            sender_key = self.group_keys.current()
+        else:
+            sender_key = self.group_keys.current(room, {record.socket for record in records})
+        body = None
+        failed = []
+
+        for record in records:
+            if self.peer.session_manager.check_rotation_needed(record.session_id):
+                try:
+                    self.rotate_session(record)
+                except (OSError, SessionError) as e:
+                    self.peer.message_handler.print_message(
+                        format_error_message(f"\r[-] Session rotation with {record.peer_id} failed: {e}")
+                    )
+                    failed.append(record)
+                    continue
+
+            if body is None:
+                body = self.build_group_body(sender_key, kind, payload)
+
+            frames = [(MSG_GROUP, body)]
+            if self.group_keys.needs_key(sender_key, record.socket):
+                distribution = {
+                    'type': 'sender_key',
+                    'key_id': sender_key.key_id,
+                    'key': base64.b64encode(sender_key.key).decode()
+                }
+                if room is not None:
+                    distribution['room'] = room
+                frames.insert(0, (MSG_CONTROL, json.dumps(distribution).encode()))
+
+            try:
+                self.send_frames(record.socket, frames, record.aes_gcm)
+                self.group_keys.mark_sent(sender_key, record.socket)
+            except (OSError, SessionError) as e:
+                self.peer.message_handler.print_message(
+                    format_error_message(f"\r[-] Error sending message to {record.peer_id}: {e}")
+                )
+                failed.append(record)
+
+        return failed
+
+    def send_pairwise(self, records, kind, payload):
+        """
+        Seals and writes a payload under each record's own key, spreading the
+        records over the crypto pool when the batch is large. Returns the records
+        the frame could not be delivered to.
+        """
+        ready = []
+        failed = []
+        datagram = self.peer.datagram if kind in DATAGRAM_KINDS else None
+        for record in records:
+            if self.peer.session_manager.check_rotation_needed(record.session_id):
+                try:
+                    self.rotate_session(record)
+                except (OSError, SessionError) as e:
+                    self.peer.message_handler.print_message(
+                        format_error_message(f"\r[-] Session rotation with {record.peer_id} failed: {e}")
+                    )
+                    failed.append(record)
+                    continue
+            if not (datagram and datagram.send(record.socket, kind, payload)):
+                ready.append(record)
+
+        def send(record):
+            try:
+                self.send_frames(record.socket, [(kind, payload)], record.aes_gcm)
+                return None
+            except (OSError, SessionError) as e:
+                self.peer.message_handler.print_message(
+                    format_error_message(f"\r[-] Error sending message to {record.peer_id}: {e}")
+                )
+                return record
+
+        # Each record is numbered, sealed and written under its own stream lock
+        results = self.peer.crypto_pool.map(send, ready, len(payload) * len(ready))
+        failed.extend(record for record in results if record is not None)
+        return failed
+
+    def send_to_peer(self, peer_id, message):
+        """Sends a message to a single peer, encrypting it only for that peer"""
+        return self._route(peer_id, MSG_DIRECT, message.encode(), message)
+
+    def send_to_room(self, room, message):
+        """
+        Sends a message to the members of a room, returning delivery counts and,
+        under 'reached', the members it was sent or stored for
+        """
+        members = self.peer.rooms.members(room)
+        room_bytes = room.encode()
+        payload = bytes([len(room_bytes)]) + room_bytes + message.encode()
+
+        results = {'sent': 0, 'stored': 0, 'unreachable': 0, 'reached': []}
+        if self.peer.network_config['group_broadcast']:
+            online = []
+            for peer_id in members:
+                record = self.peer.peers.get_by_peer_id(peer_id)
+                if record is not None and self.peer.session_manager.is_session_valid(record.session_id):
+                    online.append(record)
+            failed = self.send_group(online, MSG_ROOM, payload, room)
+            for record in failed:
+                self.peer.remove_peer(record.socket)
+
+            sent = {record.peer_id for record in online} - {record.peer_id for record in failed}
+            results['sent'] = len(sent)
+            results['reached'].extend(sorted(sent))
+            # Members that are offline, or were dropped just now, go through the outbox
+            members = [peer_id for peer_id in members if peer_id not in sent]
+
+        for peer_id in members:
+            result = self._route(peer_id, MSG_ROOM, payload, message)
+            results[result or 'unreachable'] += 1
+            if result:
+                results['reached'].append(peer_id)
+        return results
+
+    def store_for_offline_peers(self, message):
+        """Keeps a message for every known peer that is not currently connected, returning their ids"""
+        outbox = self.peer.outbox
+        if not outbox:
+            return []
+
+        stored = []
+        for peer_id in outbox.known_peers():
+            if not self.peer.peers.has_peer_id(peer_id) and peer_id != self.peer.peer_id:
+                try:
+                    outbox.enqueue(peer_id, message)
+                    stored.append(peer_id)
+                except (OSError, StorageError) as e:
                     self.peer.message_handler.print_message(
-                        format_error_message(f"\r[-] Error sending message to {peer_id}: {e}")
+                        format_error_message(f"\r[-] Error storing message for {peer_id}: {e}")
                     )
-                    peers_to_remove.append(peer_socket)
+        return stored
+
+    def broadcast_message(self, message, sender_socket=None):
+        """
+        Sends message to all connected peers with session validation, returning
+        the ids of the peers it was sent or stored for
+        """
+        peers_to_remove = []
+        records = []
+        sent = []
+
+        for record in self.peer.peers.snapshot():
+            if record.socket != sender_socket:
+                # Verify session validity
+                if self.peer.session_manager.is_session_valid(record.session_id):
+                    records.append(record)
+                else:
+                    peers_to_remove.append(record.socket)
+
+        if records:
+            try:
+                if self.peer.network_config['group_broadcast']:
+                    failed = self.send_group(records, MSG_CHAT, message.encode())
+                else:
+                    failed = self.send_pairwise(records, MSG_CHAT, message.encode())
+                dropped = {record.socket for record in failed}
+                peers_to_remove.extend(dropped)
+                sent = [record.peer_id for record in records if record.socket not in dropped]
+            except Exception as e:
+                self.peer.message_handler.print_message(
+                    format_error_message(f"\r[-] Error broadcasting message: {e}")
+                )
 
         for peer_socket in peers_to_remove:
-            self.peer.remove_peer(peer_socket)
\ No newline at end of file
+            self.peer.remove_peer(peer_socket)
+
+        # Peers that were just dropped are offline now, so they are covered here too
+        return sent + self.store_for_offline_peers(message)
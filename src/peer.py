@@ -1,220 +1,465 @@
 import os
+import signal
 import socket
 import threading
 import secrets
-import sys
+import time
 from datetime import datetime
 from colorama import init, Fore, Style
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
-from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from .session import N0ctuaSessionManager, SessionError
+from .storage import MessageLog, Outbox, StorageError, INBOUND
+from .utils.config import get_settings
+from .utils.helpers import (discover_host_addresses, format_connection_string, normalize_address,
+                            parse_connection_string)
+from .admission import AdmissionController, HandshakeDeadline
+from .invites import InviteTable
+from .directory import PeerDirectory
+from .rooms import RoomRegistry
+from .sockopts import apply_buffers, apply_connection, create_listener, resolve_profile
+from .dialer import dial
+from .bootstrap import connect_many
+from .handoff import Handoff
+from .transport import DatagramTransport, LossyShim
 from .commands import CommandHandler
+from .crypto import CryptoManager
+from .crypto_pool import CryptoPool
+from .network import NetworkManager
+from .pipeline import Pipeline, load_handlers
 from .ui import MessageHandler
 
 init(autoreset=True)
 
+MAX_HANDSHAKE_FIELD = 256
+
 
 class SecurePeer:
-    def __init__(self, listen_port=None, peer_id=None):
-        self.peer_id = peer_id or f"Peer_{secrets.token_hex(2)}"
-        self.listen_port = listen_port or self.find_available_port()
-        self.host = socket.gethostbyname(socket.gethostname())
-        self.secret = secrets.token_urlsafe(16)
-        self.peers = {}  # {socket: (peer_id, address)}
+    def __init__(self, listen_port=None, peer_id=None, settings=None, listen_socket=None, trace=None,
+                 takeover=None):
+        self.settings = settings or get_settings()
+        self.network_config = self.settings.network
+        self.storage_config = self.settings.storage
+        self.trace = trace
+        try:
+            # Applies to threads started from now on, including one per connection
+            threading.stack_size(self.network_config['thread_stack_size'] * 1024)
+        except (ValueError, RuntimeError):
+            pass
+        # Listen before anything slow, so early connections queue instead of being refused
+        self.listen_socket = listen_socket or create_listener(self.network_config, listen_port or 0)
+        self.listen_port = self.listen_socket.getsockname()[1]
+        self.hosts = discover_host_addresses(self.network_config['bind_address'])
+        # A process taking over keeps the ID its peers know
+        self.takeover = takeover
+        self.peer_id = (takeover and takeover.snapshot.peer_id) or peer_id or f"Peer_{secrets.token_hex(2)}"
+        self.invites = InviteTable()
+        # Default invite printed at startup: no expiry, unlimited uses
+        self.secret = self.invites.create()
+        self.peers = PeerDirectory()
+        self.rooms = RoomRegistry()
         self.print_lock = threading.Lock()
         self.running = True
-        self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.session_manager = N0ctuaSessionManager()
+        self.session_manager = N0ctuaSessionManager(self.settings.session)
         self.message_handler = MessageHandler()
         self.command_handler = CommandHandler(self)
+        self.network = NetworkManager(self)
+        self.admission = AdmissionController(
+            workers=self.network_config['handshake_workers'],
+            queue_size=self.network_config['handshake_queue'],
+            rate=self.network_config['rate_limit'],
+            burst=self.network_config['rate_burst'],
+            handshake_timeout=self.network_config['handshake_timeout'],
+            max_sources=self.network_config['max_tracked_sources']
+        )
+        self.crypto_pool = CryptoPool(
+            workers=self.network_config['crypto_workers'],
+            inline_threshold=self.network_config['crypto_inline_threshold']
+        )
+        self.message_log = self.open_message_log()
+        self.outbox = self.open_outbox()
+        self.datagram = self.open_datagram()
+        self.pipeline = self.open_pipeline()
+        handoff_socket = self.network_config['handoff_socket']
+        self.handoff = Handoff(self, handoff_socket) if handoff_socket else None
+
+        # Generate RSA key pair; handshakes wait for it if they arrive first
+        self.crypto = CryptoManager(background=True)
+        if self.trace:
+            self.trace.mark('node ready')
+
+    def reload_config(self):
+        """Re-reads the configuration and applies the keys that can change at runtime"""
+        try:
+            changed, pending = self.settings.reload()
+        except ValueError as e:
+            self.print_message(f"\r{Fore.RED}[-] Configuration not reloaded: {e}{Style.RESET_ALL}")
+            return
+
+        config = self.network_config
+        self.admission.configure(
+            rate=config['rate_limit'],
+            burst=config['rate_burst'],
+            handshake_timeout=config['handshake_timeout'],
+            max_sources=config['max_tracked_sources']
+        )
+        self.crypto_pool.inline_threshold = config['crypto_inline_threshold']
+        self.network.group_keys.rotation_interval = self.settings.session['rotation_interval']
+        if 'network.listen_backlog' in changed:
+            try:
+                # listen() on a listening socket only resizes its backlog
+                self.listen_socket.listen(config['listen_backlog'])
+            except OSError:
+                pass
+
+        self.print_message(
+            f"\r{Fore.YELLOW}[*] Configuration reloaded: {', '.join(changed) or 'no changes'}{Style.RESET_ALL}"
+        )
+        if pending:
+            self.print_message(
+                f"{Fore.YELLOW}[*] Restart required to apply: {', '.join(pending)}{Style.RESET_ALL}"
+            )
+        self.print_message(f"{self.peer_id}> ", end='')
+
+    def open_pipeline(self):
+        """Starts the stages that carry received messages to the display, the history and plugin handlers"""
+        handlers, errors = load_handlers(self, self.settings.pipeline)
+        for error in errors:
+            print(f"Warning: Message handler not loaded: {error}")
+        return Pipeline(
+            NetworkManager.decode_message, handlers, self.settings.pipeline,
+            on_error=lambda error: self.print_message(f"\r{Fore.RED}[-] {error}{Style.RESET_ALL}")
+        )
+
+    def open_message_log(self):
+        """Opens the persistent message history, or returns None if disabled"""
+        config = self.storage_config
+        if not config['history_enabled']:
+            return None
+
+        try:
+            return MessageLog(
+                config['history_dir'],
+                segment_size=config['segment_size'],
+                commit_interval=config['commit_interval'],
+                max_commit_batch=config['max_commit_batch']
+            )
+        except (OSError, ValueError, StorageError) as e:
+            print(f"Warning: Message history disabled: {e}")
+            return None
+
+    def open_outbox(self):
+        """Opens the store-and-forward queues for offline peers, or returns None if disabled"""
+        config = self.storage_config
+        if not config['outbox_enabled']:
+            return None
+
+        try:
+            return Outbox(
+                config['outbox_dir'],
+                capacity=config['outbox_capacity'],
+                ttl=config['outbox_ttl']
+            )
+        except (OSError, ValueError, StorageError) as e:
+            print(f"Warning: Offline delivery disabled: {e}")
+            return None
+
+    def open_datagram(self):
+        """Opens the UDP transport on the listening port number, or returns None if disabled"""
+        config = self.network_config
+        if not config['datagram']:
+            return None
 
-        # Generate RSA key pair
-        self.private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048
+        try:
+            udp_socket = socket.socket(self.listen_socket.family, socket.SOCK_DGRAM)
+            if udp_socket.family == socket.AF_INET6:
+                udp_socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+            udp_socket.bind(self.listen_socket.getsockname()[:2])
+        except OSError as e:
+            print(f"Warning: Datagram transport disabled: {e}")
+            return None
+
+        if config['datagram_loss']:
+            udp_socket = LossyShim(udp_socket, config['datagram_loss'])
+        return DatagramTransport(
+            udp_socket,
+            on_message=self.network.datagram_received,
+            on_undeliverable=self.network.datagram_undeliverable,
+            min_rto=config['datagram_min_rto'],
+            max_retries=config['datagram_retries'],
+            receive_keys=self.network.datagram_keys
         )
-        self.public_key = self.private_key.public_key()
 
-    def find_available_port(self):
-        temp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        temp_socket.bind(('', 0))
-        _, port = temp_socket.getsockname()
-        temp_socket.close()
-        return port
+    def record_message(self, peer_id, session_id, message, direction=INBOUND):
+        """Appends a message to the persistent history"""
+        if not self.message_log:
+            return
+        try:
+            self.message_log.append(peer_id, session_id, message, direction)
+        except StorageError as e:
+            self.print_message(f"{Fore.RED}[-] Error recording message: {e}{Style.RESET_ALL}")
 
     def print_message(self, message, end='\n'):
         with self.print_lock:
             print(message, end=end, flush=True)
 
-    def format_message(self, peer_id, message, include_timestamp=True):
+    def format_message(self, peer_id, message, include_timestamp=True, at=None):
         """Formats the message with timestamp and peer ID"""
         if include_timestamp:
-            timestamp = datetime.now().strftime("%H:%M:%S")
+            # time.strftime costs a third of datetime's, and runs for every message shown
+            timestamp = time.strftime("%H:%M:%S", time.localtime(at))
             return f"[{timestamp}] {peer_id}: {message}"
         return f"{peer_id}: {message}"
 
 
-    def parse_connection_string(self, conn_str):
+    def connection_string(self, secret):
+        """Connection string listing every address this node can be reached on"""
+        return format_connection_string(self.hosts, self.listen_port, secret)
+
+    def connect_to_peer(self, connection_string):
         try:
-            if conn_str.count(':') != 2:
-                raise ValueError("Invalid format. Use: ip:port:secret")
-            host, port, secret = conn_str.split(':')
-            return host.strip(), int(port.strip()), secret.strip()
-        except Exception as e:
+            parse_connection_string(connection_string)
+        except ValueError as e:
             self.print_message(f"{Fore.RED}[-] Error parsing connection string: {e}{Style.RESET_ALL}")
-            return None, None, None
+            return True
 
-    def connect_to_peer(self, connection_string):
         try:
-            host, port, secret = self.parse_connection_string(connection_string)
-            if not host or not port or not secret:
-                return True
+            remote_peer_id, _ = self.open_connection(connection_string)
+            self.print_message(f"{Fore.GREEN}[+] Connected ==> {remote_peer_id}{Style.RESET_ALL}")
+        except PermissionError as e:
+            self.print_message(f"{Fore.RED}[-] {e}{Style.RESET_ALL}")
+        except Exception as e:
+            self.print_message(f"{Fore.RED}[-] Error connecting to peer: {e}{Style.RESET_ALL}")
+        return True
 
-            peer_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            peer_socket.connect((host, port))
+    def open_connection(self, connection_string, claim=None):
+        """
+        Dials a peer and runs the handshake, returning (peer ID, connected).
+
+        claim, if given, is called with the remote peer ID before the key
+        exchange; when it returns False the connection is closed and connected
+        is False. Raises ValueError for a malformed connection string and
+        PermissionError when the secret is rejected.
+        """
+        candidates, secret = parse_connection_string(connection_string)
+        deadline = HandshakeDeadline(self.network_config['connect_timeout'])
+        backoff = 0.1
+        while True:
+            options = resolve_profile(self.network_config)
+            # Races the candidate addresses and keeps the first to answer
+            peer_socket = dial(candidates, deadline, prepare=lambda sock: apply_buffers(sock, options))
+            apply_connection(peer_socket, options)
 
-            # Send the secret
-            peer_socket.send(secret.encode())
+            try:
+                # Send the secret
+                self.network.send_plain_frame(peer_socket, secret.encode())
+
+                # Receive confirmation
+                deadline.apply(peer_socket)
+                response = self.network.recv_plain_frame(peer_socket, MAX_HANDSHAKE_FIELD)
+            except ConnectionResetError:
+                response = None
+            if response is not None:
+                break
 
-            # Receive confirmation
-            response = peer_socket.recv(1024).decode()
-            if response != "OK":
-                self.print_message(f"{Fore.RED}[-] Connection rejected - Invalid secret{Style.RESET_ALL}")
-                peer_socket.close()
-                return True
+            # Closed without an answer: the remote node is shedding load, retry
+            peer_socket.close()
+            if deadline.remaining() <= backoff:
+                raise socket.timeout("Remote peer is not accepting connections")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 2.0)
+
+        try:
+            if response != b"OK":
+                raise PermissionError("Connection rejected - Invalid secret")
 
             # Send our ID
-            peer_socket.send(self.peer_id.encode())
+            self.network.send_plain_frame(peer_socket, self.peer_id.encode())
             # Receive the remote peer ID
-            remote_peer_id = peer_socket.recv(1024).decode()
-
-            # Store peer information
-            self.peers[peer_socket] = (remote_peer_id, (host, port))
-            self.print_message(f"{Fore.GREEN}[+] Connected ==> {remote_peer_id}{Style.RESET_ALL}")
-
-            # Start thread to receive messages
-            thread = threading.Thread(target=self.handle_peer_messages, args=(peer_socket,))
-            thread.daemon = True
-            thread.start()
-
-            return True
-
-        except Exception as e:
-            self.print_message(f"{Fore.RED}[-] Error connecting to peer: {e}{Style.RESET_ALL}")
-            return True
-
-    def handle_peer_connection(self, peer_socket, address):
-        session_id = None
+            deadline.apply(peer_socket)
+            remote_peer_id = self.network.recv_plain_frame(peer_socket, MAX_HANDSHAKE_FIELD)
+            if remote_peer_id is None:
+                raise SessionError("Connection closed during handshake")
+            remote_peer_id = remote_peer_id.decode()
+            if claim is not None and not claim(remote_peer_id):
+                # Stop before the RSA work; the remote node sees the handshake end early
+                peer_socket.close()
+                return remote_peer_id, False
+
+            # Send our public key and receive the AES key sealed for it
+            self.network.send_plain_frame(peer_socket, self.crypto.get_public_key_pem())
+            deadline.apply(peer_socket)
+            encrypted_aes_key = self.network.recv_plain_frame(peer_socket)
+            if encrypted_aes_key is None:
+                raise SessionError("Connection closed during key exchange")
+            aes_key = self.crypto.decrypt_aes_key(encrypted_aes_key)
+            aes_gcm = AESGCM(aes_key)
+            peer_socket.settimeout(None)
+        except BaseException:
+            peer_socket.close()
+            raise
+
+        # Store peer information with session
+        session_id = self.session_manager.create_session(remote_peer_id)
+        self.peers.add(peer_socket, remote_peer_id, normalize_address(peer_socket.getpeername()),
+                       session_id, aes_gcm, aes_key)
+
+        # Start thread to receive messages
+        thread = threading.Thread(target=self.handle_peer_messages, args=(peer_socket,))
+        thread.daemon = True
+        thread.start()
+
+        self.peer_established(peer_socket, remote_peer_id)
+        return remote_peer_id, True
+
+    def connect_many(self, connection_strings, parallelism=None):
+        """Connects to several peers at once; see bootstrap.connect_many()"""
+        return connect_many(self, connection_strings, parallelism or self.network_config['connect_parallelism'])
+
+    def handle_peer_connection(self, peer_socket, address, deadline):
+        """Authenticates an incoming connection on a handshake worker"""
         try:
-            # Create session first
-            session_id = self.session_manager.create_session(str(address))
+            # Buffer sizes were inherited from the listening socket
+            apply_connection(peer_socket, resolve_profile(self.network_config))
 
             # Check the secret
-            received_secret = peer_socket.recv(1024).decode()
-            if received_secret != self.secret:
-                self.session_manager.invalidate_session(session_id)
-                peer_socket.send("ERROR".encode())
+            deadline.apply(peer_socket)
+            received_secret = self.network.recv_plain_frame(peer_socket, MAX_HANDSHAKE_FIELD)
+            if received_secret is None:
+                raise SessionError("Connection closed during handshake")
+            if not self.invites.verify(received_secret.decode(errors='replace')):
+                self.admission.penalize(address)
+                self.network.send_plain_frame(peer_socket, b"ERROR")
                 peer_socket.close()
                 return
 
-            peer_socket.send("OK".encode())
+            self.network.send_plain_frame(peer_socket, b"OK")
 
             # Get the ID of the remote peer
-            remote_peer_id = peer_socket.recv(1024).decode()
+            deadline.apply(peer_socket)
+            remote_peer_id = self.network.recv_plain_frame(peer_socket, MAX_HANDSHAKE_FIELD)
+            if remote_peer_id is None:
+                raise SessionError("Connection closed during handshake")
+            remote_peer_id = remote_peer_id.decode()
             # Send ID
-            peer_socket.send(self.peer_id.encode())
+            self.network.send_plain_frame(peer_socket, self.peer_id.encode())
 
-            # Update session with peer ID
-            self.session_manager.update_session_peer_id(session_id, remote_peer_id)
+            # Seal a fresh AES key with the remote public key
+            deadline.apply(peer_socket)
+            public_key_pem = self.network.recv_plain_frame(peer_socket)
+            if public_key_pem is None:
+                raise SessionError("Connection closed during key exchange")
+            aes_key, aes_gcm = CryptoManager.create_aes_gcm()
+            self.network.send_plain_frame(peer_socket, self.crypto.encrypt_aes_key(aes_key, public_key_pem))
+            peer_socket.settimeout(None)
+
+            # Only authenticated peers get a session
+            session_id = self.session_manager.create_session(remote_peer_id)
 
             # Store peer information with session
-            self.peers[peer_socket] = (remote_peer_id, address, session_id)
+            self.peers.add(peer_socket, remote_peer_id, address, session_id, aes_gcm, aes_key)
             self.print_message(f"\r{Fore.GREEN}[+] Peer {remote_peer_id} connected from {address}{Style.RESET_ALL}")
             self.print_message(f"{self.peer_id}> ", end='')
 
-            # Starts message receiving loop
-            self.handle_peer_messages(peer_socket)
-
+        except socket.timeout:
+            # Stalled or flooding clients are dropped quietly
+            self.admission.timed_out()
+            self.remove_peer(peer_socket)
+            return
         except SessionError as e:
             self.print_message(f"{Fore.RED}[-] Session error: {e}{Style.RESET_ALL}")
+            self.remove_peer(peer_socket)
+            return
         except Exception as e:
             self.print_message(f"\r{Fore.RED}[-] Error connecting to {address}: {e}{Style.RESET_ALL}")
-        finally:
-            if session_id:
-                self.session_manager.invalidate_session(session_id)
-            if peer_socket in self.peers:
-                remote_peer_id = self.peers[peer_socket][0]
-                del self.peers[peer_socket]
-                try:
-                    peer_socket.close()
-                except:
-                    pass
-                self.print_message(f"\r{Fore.RED}[-] {remote_peer_id} disconnected{Style.RESET_ALL}")
-                self.print_message(f"{self.peer_id}> ", end='')
-
-    def handle_peer_messages(self, peer_socket):
-        remote_peer_id = self.peers.get(peer_socket, (None, None))[0]
-        while self.running and peer_socket in self.peers:
-            try:
-                message = peer_socket.recv(4096).decode()
-                if not message:
-                    break
+            self.remove_peer(peer_socket)
+            return
+
+        # Hand the connection to its own receive thread and free this worker
+        thread = threading.Thread(target=self.handle_peer_messages, args=(peer_socket,))
+        thread.daemon = True
+        thread.start()
+
+        self.peer_established(peer_socket, remote_peer_id)
+
+    def peer_established(self, peer_socket, remote_peer_id):
+        """Marks a peer as known and delivers anything stored while it was offline"""
+        self.network.advertise_credit(peer_socket)
+        self.network.offer_datagram(peer_socket)
+        if not self.outbox:
+            return
+        try:
+            ring = self.outbox.remember(remote_peer_id)
+        except (OSError, StorageError) as e:
+            self.print_message(f"{Fore.RED}[-] Error opening outbox for {remote_peer_id}: {e}{Style.RESET_ALL}")
+            return
 
-                formatted_message = self.format_message(remote_peer_id, message)
-                self.print_message(f"\r{Fore.BLUE}{formatted_message}{Style.RESET_ALL}")
-                self.print_message(f"{self.peer_id}> ", end='')
+        if len(ring):
+            thread = threading.Thread(target=self.network.drain_outbox, args=(peer_socket,))
+            thread.daemon = True
+            thread.start()
 
-            except Exception as e:
-                self.print_message(
-                    f"\r{Fore.RED}[-] Error receiving message from {remote_peer_id}: {e}{Style.RESET_ALL}")
-                break
+    def format_incoming(self, remote_peer_id, message, received_at=None, sent_at=None, channel=None):
+        """Formats a message received from a peer as a line of the terminal"""
+        sender = remote_peer_id if channel is None else f"{remote_peer_id} [{channel}]"
+        formatted_message = self.format_message(sender, message, at=received_at)
+        if sent_at is not None:
+            sent_time = datetime.fromtimestamp(sent_at).strftime("%Y-%m-%d %H:%M:%S")
+            formatted_message = f"{formatted_message} (sent {sent_time} while offline)"
+        return f"\r{Fore.BLUE}{formatted_message}{Style.RESET_ALL}"
+
+    def display_message(self, remote_peer_id, session_id, message, sent_at=None, channel=None):
+        """Prints and records a message received from a peer, for nodes without a pipeline"""
+        self.print_message(self.format_incoming(remote_peer_id, message, sent_at=sent_at, channel=channel))
+        self.print_message(f"{self.peer_id}> ", end='')
+        self.record_message(remote_peer_id, session_id, message)
 
-        if peer_socket in self.peers:
-            remote_peer_id = self.peers[peer_socket][0]
-            del self.peers[peer_socket]
-            try:
-                peer_socket.close()
-            except:
-                pass
-            self.print_message(f"\r{Fore.YELLOW}[-] Peer {remote_peer_id} disconnected{Style.RESET_ALL}")
-            self.print_message(f"{self.peer_id}> ", end='')
+    def handle_peer_messages(self, peer_socket):
+        if self.running and peer_socket in self.peers:
+            self.network.receive_frames(peer_socket)
 
-    def broadcast_message(self, message):
-        formatted_message = self.format_message(self.peer_id, message, include_timestamp=False)
-        disconnected_peers = []
+        if self.handoff is not None and self.handoff.is_parked(peer_socket):
+            # The connection now belongs to the process taking over
+            return
+        self.remove_peer(peer_socket)
 
-        for peer_socket in self.peers:
-            try:
-                peer_socket.send(formatted_message.encode())
-            except:
-                disconnected_peers.append(peer_socket)
-
-        for peer_socket in disconnected_peers:
-            if peer_socket in self.peers:
-                remote_peer_id = self.peers[peer_socket][0]
-                del self.peers[peer_socket]
-                try:
-                    peer_socket.close()
-                except:
-                    pass
-                self.print_message(f"\r{Fore.YELLOW}[-] Peer {remote_peer_id} disconnected{Style.RESET_ALL}")
+    def remove_peer(self, peer_socket):
+        """Closes a peer connection and forgets its session and encryption context"""
+        record = self.peers.remove(peer_socket)
+        try:
+            # Shutdown wakes up a receive thread, or a writer, still blocked on this socket
+            peer_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        stream = self.network.stream_stats(record)
+        self.network.forget_socket(peer_socket, record)
+        try:
+            peer_socket.close()
+        except:
+            pass
+
+        if record is None:
+            return
+
+        self.session_manager.invalidate_session(record.session_id)
+        if self.running:
+            lost = ""
+            if stream and (stream['in_flight_bytes'] or stream['queued_bytes']):
+                lost = (f" ({stream['in_flight_bytes']} bytes sent were not acknowledged, "
+                        f"{stream['queued_bytes']} still queued)")
+            self.print_message(f"\r{Fore.YELLOW}[-] Peer {record.peer_id} disconnected{lost}{Style.RESET_ALL}")
+            self.print_message(f"{self.peer_id}> ", end='')
 
     def start_listening(self):
         """Starts the listening socket for connections from other peers"""
         try:
-            self.listen_socket.bind((self.host, self.listen_port))
-            self.listen_socket.listen(5)
-
             self.print_message(f"""
     {Fore.CYAN}{'=' * 20} Connection Information {'=' * 20}{Style.RESET_ALL}
     {Fore.GREEN}ID: {self.peer_id}
-    Address: {self.host}:{self.listen_port}
+    Address: {', '.join(self.hosts)} port {self.listen_port}
     Secret: {self.secret}{Style.RESET_ALL}
 
     {Fore.YELLOW}Connection string (copy this line):{Style.RESET_ALL}
-    {Fore.GREEN}{self.host}:{self.listen_port}:{self.secret}{Style.RESET_ALL}
+    {Fore.GREEN}{self.connection_string(self.secret)}{Style.RESET_ALL}
 
     {Fore.CYAN}Type 'help' to see available commands{Style.RESET_ALL}
     {'=' * 65}
@@ -223,9 +468,15 @@ class SecurePeer:
             while self.running:
                 try:
                     peer_socket, address = self.listen_socket.accept()
-                    thread = threading.Thread(target=self.handle_peer_connection, args=(peer_socket, address))
-                    thread.daemon = True
-                    thread.start()
+                    if self.handoff is not None and self.handoff.active:
+                        # Closed unanswered, so the dialer retries and reaches the next process
+                        peer_socket.close()
+                        continue
+                    address = normalize_address(address)
+                    if self.trace and not self.trace.reported:
+                        self.trace.mark('first accept')
+                        self.print_message(self.trace.report())
+                    self.admission.submit(self.handle_peer_connection, peer_socket, address)
                 except socket.error:
                     break
         except Exception as e:
@@ -250,11 +501,23 @@ class SecurePeer:
         return True
 
     def start(self):
+        if self.takeover:
+            # Raises if the previous process kept its connections, so this one exits
+            self.handoff.complete(self.takeover)
+            self.takeover = None
+        if self.handoff:
+            self.handoff.listen()
+
         try:
             listen_thread = threading.Thread(target=self.start_listening)
             listen_thread.daemon = True
             listen_thread.start()
 
+            if hasattr(signal, 'SIGHUP'):
+                # Reload off the signal handler, which interrupts the input thread
+                signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+                    target=self.reload_config, daemon=True).start())
+
             while self.running:
                 try:
                     user_input = input(f"{self.peer_id}> ").strip()
@@ -266,40 +529,25 @@ class SecurePeer:
                     self.print_message(f"{Fore.RED}[-] Error: {e}{Style.RESET_ALL}")
 
             self.running = False
-            for peer_socket in list(self.peers.keys()):
+            if self.handoff:
+                self.handoff.close()
+            for record in self.peers.snapshot():
                 try:
-                    peer_socket.close()
+                    record.socket.close()
                 except:
                     pass
             self.listen_socket.close()
+            self.admission.shutdown()
+            self.crypto_pool.shutdown()
+            # Before the history closes, so the messages already read are recorded
+            self.pipeline.close()
+            if self.datagram:
+                self.datagram.close()
+            if self.message_log:
+                self.message_log.close()
+            if self.outbox:
+                self.outbox.close()
             self.print_message(f"\n{Fore.YELLOW}[*] Chat closed{Style.RESET_ALL}")
 
         except Exception as e:
             self.print_message(f"{Fore.RED}[-] Error during execution: {e}{Style.RESET_ALL}")
-
-
-def main():
-    try:
-        peer_id = None
-        listen_port = None
-
-        if len(sys.argv) > 1:
-            for arg in sys.argv[1:]:
-                if arg.startswith('--id='):
-                    peer_id = arg.split('=')[1]
-                elif arg.startswith('--port='):
-                    try:
-                        listen_port = int(arg.split('=')[1])
-                    except ValueError:
-                        print(f"{Fore.RED}[-] Invalid port{Style.RESET_ALL}")
-                        return
-
-        peer = SecurePeer(listen_port=listen_port, peer_id=peer_id)
-        peer.start()
-
-    except Exception as e:
-        print(f"{Fore.RED}[-] Error starting peer: {e}{Style.RESET_ALL}")
-
-
-if __name__ == "__main__":
-    main()
@@ -0,0 +1,451 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Installed distributions register handler factories under this entry point group
+ENTRY_POINT_GROUP = 'n0ctua.handlers'
+# Latencies kept per stage for the percentiles shown by the pipeline command
+LATENCY_SAMPLES = 4096
+# Put in every inbox of a stage, after everything else, to stop its workers
+STOP = object()
+
+
+@dataclass(frozen=True)
+class Message:
+    """A message received from a peer, as handlers see it"""
+    peer_id: str
+    session_id: Optional[str]
+    text: str
+    received_at: float               # time.time() when its frame was read
+    channel: Optional[str] = None    # 'direct', a room name, or None for a broadcast
+    sent_at: Optional[float] = None  # set when the sender stored it while this node was offline
+
+
+class Handler:
+    """
+    Base for message handlers. Each one runs as its own pipeline stage on
+    workers threads, and handle() gets up to batch_size messages at a time.
+    The messages of one peer always go to the same worker, in the order they
+    were sent.
+
+    A plugin registers, under the n0ctua.handlers entry point group, a
+    callable that takes the node and returns a Handler; a subclass whose
+    constructor takes the node qualifies.
+    """
+    name = 'handler'
+    workers = 1
+    batch_size = 64
+
+    def accepts(self, message: Message) -> bool:
+        """Lets the dispatch stage skip messages this handler has no use for"""
+        return True
+
+    def handle(self, messages: List[Message]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Called once the pipeline has stopped"""
+
+
+class DisplayHandler(Handler):
+    """Prints messages to the terminal, with one write and one prompt per batch"""
+    name = 'display'
+
+    def __init__(self, peer):
+        self.peer = peer
+
+    def handle(self, messages: List[Message]) -> None:
+        peer = self.peer
+        peer.print_message('\n'.join(
+            peer.format_incoming(message.peer_id, message.text, message.received_at, message.sent_at,
+                                 message.channel)
+            for message in messages
+        ))
+        peer.print_message(f"{peer.peer_id}> ", end='')
+
+
+class HistoryHandler(Handler):
+    """Appends messages to the persistent history"""
+    name = 'history'
+
+    def __init__(self, peer):
+        self.peer = peer
+
+    def accepts(self, message: Message) -> bool:
+        return self.peer.message_log is not None
+
+    def handle(self, messages: List[Message]) -> None:
+        for message in messages:
+            self.peer.record_message(message.peer_id, message.session_id, message.text)
+
+
+def _resolve(reference: str) -> Callable:
+    module_name, _, attribute = reference.partition(':')
+    target = __import__(module_name.strip(), fromlist=['_'])
+    for name in attribute.strip().split('.'):
+        target = getattr(target, name)
+    return target
+
+
+def load_handlers(peer, config: Dict) -> Tuple[List[Handler], List[str]]:
+    """
+    The built-in handlers, then those registered under the entry point group
+    when pipeline.plugins is set, then those named as module:attribute in
+    pipeline.handlers. Returns the handlers and one error per factory that
+    failed to load.
+    """
+    factories = [('display', DisplayHandler), ('history', HistoryHandler)]
+    errors = []
+
+    if config['plugins']:
+        try:
+            from importlib.metadata import entry_points
+            found = entry_points()
+            group = found.select(group=ENTRY_POINT_GROUP) if hasattr(found, 'select') \
+                else found.get(ENTRY_POINT_GROUP, [])
+            for entry_point in group:
+                try:
+                    factories.append((entry_point.name, entry_point.load()))
+                except Exception as e:
+                    errors.append(f"{entry_point.name}: {e}")
+        except ImportError:
+            # Entry points need Python 3.8; pipeline.handlers still works without them
+            pass
+
+    for reference in filter(None, (part.strip() for part in config['handlers'].split(','))):
+        try:
+            factories.append((reference, _resolve(reference)))
+        except Exception as e:
+            errors.append(f"{reference}: {e}")
+
+    handlers = []
+    for name, factory in factories:
+        try:
+            handler = factory(peer)
+            if not callable(getattr(handler, 'handle', None)):
+                raise TypeError("factory did not return a handler")
+            handlers.append(handler)
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+    return handlers, errors
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Delivery:
+    """One message on its way through the pipeline"""
+    __slots__ = ('peer_id', 'session_id', 'kind', 'payload', 'sent_at', 'received_at', 'submitted',
+                 'message', 'pending', 'done')
+
+    def __init__(self, peer_id, session_id, kind, payload, sent_at, done):
+        self.peer_id = peer_id
+        self.session_id = session_id
+        self.kind = kind
+        self.payload = payload
+        self.sent_at = sent_at
+        self.received_at = time.time()
+        self.submitted = time.perf_counter()
+        self.message = None
+        self.pending = 1  # handlers still to finish with it
+        self.done = done
+
+
+class Inbox:
+    """
+    FIFO of one stage worker, taken from in batches under a single lock. With
+    a size, put_many() waits for space, so a slow worker holds back whoever
+    feeds it, unless told not to wait; entries queued past the size are then
+    counted as overflow.
+    """
+    __slots__ = ('items', 'size', 'lock', 'ready', 'space', 'peak', 'overflow')
+
+    def __init__(self, size: int = 0):
+        self.items = deque()
+        self.size = size
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.space = threading.Condition(self.lock)
+        self.peak = 0
+        self.overflow = 0
+
+    def put_many(self, entries: List, wait: bool = True) -> None:
+        with self.lock:
+            items = self.items
+            for entry in entries:
+                if self.size and len(items) >= self.size:
+                    if wait:
+                        while len(items) >= self.size:
+                            self.space.wait()
+                    else:
+                        self.overflow += 1
+                items.append(entry)
+                if len(items) == 1:
+                    self.ready.notify()
+            self.peak = max(self.peak, len(items))
+
+    def take(self, limit: int) -> List:
+        with self.lock:
+            while not self.items:
+                self.ready.wait()
+            items = self.items
+            batch = [items.popleft() for _ in range(min(limit, len(items)))]
+            if self.size:
+                self.space.notify_all()
+            return batch
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class Stage:
+    """
+    One step of the pipeline: an inbox per worker thread, each drained in
+    batches of up to batch_size. Items with the same key always go to the
+    same worker, so the messages of one peer keep their order while those of
+    different peers are handled concurrently.
+    """
+
+    def __init__(self, name: str, process: Callable[[List], None], workers: int, queue_size: int,
+                 batch_size: int, on_error: Callable[[str], None]):
+        self.name = name
+        self.process = process
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.queue_size = queue_size
+        self.inboxes = [Inbox(queue_size) for _ in range(max(1, workers))]
+        self.lock = threading.Lock()
+        self.stats = {'items': 0, 'batches': 0, 'errors': 0, 'wait_time': 0.0, 'busy_time': 0.0}
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.threads = []
+        for inbox in self.inboxes:
+            thread = threading.Thread(target=self._run, args=(inbox,), name=f"pipeline-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, key, item) -> None:
+        self.inboxes[hash(key) % len(self.inboxes)].put_many([(time.perf_counter(), item)])
+
+    def put_many(self, items: List[Tuple[str, object]], wait: bool = True) -> None:
+        """Queues (key, item) pairs, with one lock taken per worker rather than per item"""
+        now = time.perf_counter()
+        if len(self.inboxes) == 1:
+            self.inboxes[0].put_many([(now, item) for _, item in items], wait)
+            return
+        shares: Dict[int, List] = {}
+        for key, item in items:
+            shares.setdefault(hash(key) % len(self.inboxes), []).append((now, item))
+        for index, entries in shares.items():
+            self.inboxes[index].put_many(entries, wait)
+
+    def _run(self, inbox: Inbox) -> None:
+        while True:
+            batch = inbox.take(self.batch_size)
+            stopping = batch[-1] is STOP
+            if stopping:
+                batch.pop()
+
+            started = time.perf_counter()
+            failed = False
+            if batch:
+                try:
+                    self.process([item for _, item in batch])
+                except Exception as e:
+                    failed = True
+                    self.on_error(f"Pipeline stage {self.name} failed: {e}")
+            finished = time.perf_counter()
+
+            with self.lock:
+                self.stats['items'] += len(batch)
+                self.stats['batches'] += 1 if batch else 0
+                self.stats['errors'] += failed
+                self.stats['wait_time'] += sum(started - queued for queued, _ in batch)
+                self.stats['busy_time'] += finished - started
+                self.latencies.extend(finished - queued for queued, _ in batch)
+            if stopping:
+                return
+
+    def stop(self, timeout: float) -> None:
+        for inbox in self.inboxes:
+            inbox.put_many([STOP])
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def snapshot(self) -> Dict:
+        """Counters and latency percentiles of the stage"""
+        with self.lock:
+            stats = dict(self.stats)
+            latencies = list(self.latencies)
+        stats.update(
+            name=self.name,
+            workers=len(self.inboxes),
+            queued=sum(len(inbox) for inbox in self.inboxes),
+            peak=max(inbox.peak for inbox in self.inboxes),
+            overflow=sum(inbox.overflow for inbox in self.inboxes),
+            capacity=self.queue_size * len(self.inboxes) if self.queue_size else None,
+            p50=_percentile(latencies, 0.5),
+            p99=_percentile(latencies, 0.99)
+        )
+        return stats
+
+
+class Pipeline:
+    """
+    Carries received messages from the receive threads to the handlers in
+    stages: decode turns payloads into Messages, dispatch hands each one to
+    the handlers that accept it, and every handler is a stage of its own.
+
+    A message is done once every handler it went to is, and only then does
+    its done callback return the flow control credit of its frame. A peer
+    that outruns the handlers so runs out of credit, instead of piling up
+    messages here. That credit is what bounds the decode queue, so the
+    receive threads hand messages over without ever waiting on a handler.
+    Dispatch does not wait on handlers either: its queue holds
+    pipeline.queue_size messages per worker, and a handler queue past that
+    size keeps growing and counts the overflow. A slow handler so holds back
+    the credit of the peers whose messages it takes, and no one else's.
+    """
+
+    def __init__(self, decode: Callable[[int, bytes], Tuple[str, Optional[str]]], handlers: List[Handler],
+                 config: Dict, on_error: Callable[[str], None]):
+        self.decode = decode
+        self.handlers = handlers
+        self.on_error = on_error
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.closed = False
+        self.in_flight = 0
+        self.stats = {'submitted': 0, 'completed': 0, 'undecodable': 0}
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+        # Built back to front, since each stage feeds the next
+        self.handler_stages = [
+            Stage(f"handler:{handler.name}", partial(self._handle, handler), handler.workers,
+                  config['queue_size'], handler.batch_size, on_error)
+            for handler in handlers
+        ]
+        self.dispatch_stage = Stage('dispatch', self._dispatch, config['dispatch_workers'], config['queue_size'],
+                                    config['batch_size'], on_error)
+        self.decode_stage = Stage('decode', self._decode, config['decode_workers'], 0,
+                                  config['batch_size'], on_error)
+
+    def submit(self, peer_id: str, session_id: Optional[str], kind: int, payload: bytes,
+               sent_at: Optional[float] = None, done: Optional[Callable[[], None]] = None) -> bool:
+        """Hands a received message payload on without waiting; returns False once the pipeline is closed"""
+        delivery = Delivery(peer_id, session_id, kind, payload, sent_at, done)
+        with self.lock:
+            if self.closed:
+                return False
+            self.in_flight += 1
+            self.stats['submitted'] += 1
+        self.decode_stage.put(peer_id, delivery)
+        return True
+
+    def _decode(self, batch: List[Delivery]) -> None:
+        decoded = []
+        for delivery in batch:
+            try:
+                text, channel = self.decode(delivery.kind, delivery.payload)
+            except (ValueError, IndexError) as e:
+                with self.lock:
+                    self.stats['undecodable'] += 1
+                self.on_error(f"Undecodable message from {delivery.peer_id}: {e}")
+                self._finish([delivery])
+                continue
+            delivery.message = Message(delivery.peer_id, delivery.session_id, text, delivery.received_at,
+                                       channel, delivery.sent_at)
+            delivery.payload = None
+            decoded.append((delivery.peer_id, delivery))
+        if decoded:
+            self.dispatch_stage.put_many(decoded)
+
+    def _dispatch(self, batch: List[Delivery]) -> None:
+        shares = [[] for _ in self.handlers]
+        unwanted = []
+        for delivery in batch:
+            pending = 0
+            for handler, share in zip(self.handlers, shares):
+                try:
+                    if handler.accepts(delivery.message):
+                        share.append((delivery.peer_id, delivery))
+                        pending += 1
+                except Exception as e:
+                    self.on_error(f"Handler {handler.name} failed: {e}")
+            # Counted before the first put, since that handler may finish at once
+            delivery.pending = pending
+            if not pending:
+                unwanted.append(delivery)
+        if unwanted:
+            self._complete(unwanted)
+        # Never waits, so a handler that falls behind does not stall the others
+        for stage, share in zip(self.handler_stages, shares):
+            if share:
+                stage.put_many(share, wait=False)
+
+    def _handle(self, handler: Handler, batch: List[Delivery]) -> None:
+        try:
+            handler.handle([delivery.message for delivery in batch])
+        finally:
+            # A failed batch still returns its credit, or the peer would stall for good
+            self._finish(batch)
+
+    def _finish(self, batch: List[Delivery]) -> None:
+        finished = []
+        with self.lock:
+            for delivery in batch:
+                delivery.pending -= 1
+                if not delivery.pending:
+                    finished.append(delivery)
+        if finished:
+            self._complete(finished)
+
+    def _complete(self, batch: List[Delivery]) -> None:
+        for delivery in batch:
+            if delivery.done is not None:
+                try:
+                    delivery.done()
+                except Exception as e:
+                    self.on_error(f"Error acknowledging message from {delivery.peer_id}: {e}")
+        now = time.perf_counter()
+        with self.lock:
+            self.in_flight -= len(batch)
+            self.stats['completed'] += len(batch)
+            self.latencies.extend(now - delivery.submitted for delivery in batch)
+            if not self.in_flight:
+                self.idle.notify_all()
+
+    def drain(self, timeout: float) -> bool:
+        """Waits until every message submitted so far is done; returns False on timeout"""
+        with self.lock:
+            return self.idle.wait_for(lambda: not self.in_flight, timeout)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Stops taking messages, lets the handlers finish the ones taken, and stops the workers"""
+        with self.lock:
+            self.closed = True
+        if not self.drain(timeout):
+            # Workers are daemon threads; a handler stuck past the timeout is left behind
+            return
+        for stage in [self.decode_stage, self.dispatch_stage] + self.handler_stages:
+            stage.stop(timeout)
+        for handler in self.handlers:
+            try:
+                handler.close()
+            except Exception as e:
+                self.on_error(f"Error closing handler {handler.name}: {e}")
+
+    def snapshot(self) -> Tuple[Dict, List[Dict]]:
+        """End-to-end counters and latency percentiles, then those of each stage in order"""
+        with self.lock:
+            stats = dict(self.stats, in_flight=self.in_flight)
+            latencies = list(self.latencies)
+        stats.update(p50=_percentile(latencies, 0.5), p99=_percentile(latencies, 0.99))
+        stages = [self.decode_stage, self.dispatch_stage] + self.handler_stages
+        return stats, [stage.snapshot() for stage in stages]
@@ -0,0 +1,59 @@
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+MAX_ROOM_NAME = 64
+
+
+class RoomRegistry:
+    """Named groups of peer IDs that messages can be addressed to"""
+
+    def __init__(self):
+        self.rooms: Dict[str, FrozenSet[str]] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _check_name(name: str) -> None:
+        if not name or len(name.encode()) > MAX_ROOM_NAME:
+            raise ValueError(f"Room names must be 1 to {MAX_ROOM_NAME} bytes")
+
+    def create(self, name: str, peer_ids: Iterable[str] = ()) -> FrozenSet[str]:
+        self._check_name(name)
+        with self.lock:
+            if name in self.rooms:
+                raise ValueError(f"Room {name} already exists")
+            members = self.rooms[name] = frozenset(peer_ids)
+            return members
+
+    def add(self, name: str, peer_ids: Iterable[str]) -> FrozenSet[str]:
+        with self.lock:
+            if name not in self.rooms:
+                raise KeyError(name)
+            members = self.rooms[name] = self.rooms[name] | frozenset(peer_ids)
+            return members
+
+    def remove(self, name: str, peer_ids: Iterable[str]) -> FrozenSet[str]:
+        with self.lock:
+            if name not in self.rooms:
+                raise KeyError(name)
+            members = self.rooms[name] = self.rooms[name] - frozenset(peer_ids)
+            return members
+
+    def restore(self, name: str, peer_ids: Iterable[str]) -> None:
+        """Sets a room's members as an earlier process of this node left them"""
+        with self.lock:
+            self.rooms[name] = frozenset(peer_ids)
+
+    def delete(self, name: str) -> bool:
+        with self.lock:
+            return self.rooms.pop(name, None) is not None
+
+    def members(self, name: str) -> FrozenSet[str]:
+        """Returns the member set; it is immutable, so callers may keep it"""
+        members = self.rooms.get(name)
+        if members is None:
+            raise KeyError(name)
+        return members
+
+    def list(self) -> List[Tuple[str, FrozenSet[str]]]:
+        with self.lock:
+            return sorted(self.rooms.items())
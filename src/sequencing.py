@@ -0,0 +1,127 @@
+import threading
+from array import array
+from collections import deque
+
+# Sequence and acknowledgement numbers are u32 on the wire; zero means nothing yet
+SEQ_MAX = 0xFFFFFFFF
+
+
+class SendWindow:
+    """
+    Sizes of the frames sent on a connection and not yet acknowledged, kept in
+    a ring indexed by sequence number. Frames are numbered consecutively, so a
+    cumulative acknowledgement releases a contiguous run and the bytes in
+    flight are known exactly without a record per message.
+    """
+    __slots__ = ('sizes', 'mask', 'next_seq', 'acked', 'in_flight', 'data_frames')
+
+    def __init__(self, capacity: int = 16):
+        capacity = 1 << max(1, capacity - 1).bit_length()
+        self.sizes = array('I', bytes(4 * capacity))
+        self.mask = capacity - 1
+        self.next_seq = 1
+        self.acked = 0
+        self.in_flight = 0
+        self.data_frames = 0   # frames in flight with a nonzero size
+
+    @property
+    def frames(self) -> int:
+        return self.next_seq - 1 - self.acked
+
+    def push(self, size: int) -> int:
+        """Records a frame of size bytes and returns its sequence number"""
+        if self.next_seq > SEQ_MAX:
+            raise OverflowError("Sequence numbers exhausted")
+        if self.frames == len(self.sizes):
+            self._grow()
+        seq = self.next_seq
+        self.sizes[seq & self.mask] = size
+        self.next_seq += 1
+        if size:
+            self.in_flight += size
+            self.data_frames += 1
+        return seq
+
+    def _grow(self) -> None:
+        old, old_mask = self.sizes, self.mask
+        self.sizes = array('I', bytes(8 * len(old)))
+        self.mask = len(self.sizes) - 1
+        for seq in range(self.acked + 1, self.next_seq):
+            self.sizes[seq & self.mask] = old[seq & old_mask]
+
+    def ack(self, seq: int) -> int:
+        """Releases every frame up to seq and returns the bytes released"""
+        if seq <= self.acked:
+            return 0
+        if seq >= self.next_seq:
+            raise ValueError(f"Acknowledgement {seq} for a frame never sent")
+        sizes, mask = self.sizes, self.mask
+        released = frames = 0
+        for s in range(self.acked + 1, seq + 1):
+            size = sizes[s & mask]
+            if size:
+                released += size
+                frames += 1
+        self.acked = seq
+        self.in_flight -= released
+        self.data_frames -= frames
+        return released
+
+
+class Stream:
+    """
+    Ordering and flow control state of one connection.
+
+    Writers hold the lock while they number, seal and write frames, so frames
+    reach the wire in sequence order, and keep holding it while the socket is
+    full. The receive thread never takes it: its control replies go through
+    the control deque, and standalone acknowledgements and the frames released
+    by returning credit are written by the service thread. What the receive
+    thread changes for writers, peer_acked, the credit and aes_gcm, it replaces
+    as single values. expected and header are its own; received, delivering
+    and the unacked counters are guarded by the network's delivery lock, since
+    pipeline workers finish frames too.
+
+    The peer acknowledges a frame once every handler is done with it, so the
+    frames in flight are those it has not consumed yet. They may not exceed
+    the credit the peer advertised; frames beyond it wait in the queue.
+    Acknowledgements carry no data and never wait for credit.
+    """
+    __slots__ = ('lock', 'space', 'window', 'queue', 'queued_bytes', 'control', 'credit_bytes', 'credit_frames',
+                 'aes_gcm', 'closed', 'stall_started', 'expected', 'received', 'delivering',
+                 'peer_acked', 'ack_sent', 'unacked', 'unacked_bytes', 'unsent', 'stats', 'header')
+
+    def __init__(self, credit_bytes: int, credit_frames: int, header_size: int):
+        self.lock = threading.Lock()
+        self.space = None      # Condition on the lock, created once a producer has to wait
+        self.window = SendWindow()
+        self.queue = deque()   # (kind, payload) waiting for credit
+        self.queued_bytes = 0
+        self.control = deque()  # control frames from the receive thread, moved to the queue by the next writer
+        self.credit_bytes = credit_bytes
+        self.credit_frames = credit_frames
+        self.aes_gcm = None
+        self.closed = False
+        self.stall_started = None
+        self.expected = 1      # next sequence number the peer must send
+        self.received = 0      # last frame consumed, acknowledged on the next frame out
+        self.delivering = None  # [seq, size, done] of frames in the pipeline, acknowledged in order once done
+        self.peer_acked = 0    # last of our frames the peer consumed, applied to the window on send
+        self.ack_sent = 0      # last acknowledgement written
+        self.unacked = 0       # frames other than acknowledgements consumed since then
+        self.unacked_bytes = 0
+        self.unsent = []       # sealed bytes a write that would have blocked left, written before anything else
+        self.stats = {'acks_sent': 0, 'acks_piggybacked': 0, 'stalls': 0, 'stalled_time': 0.0,
+                      'queue_peak': 0, 'producer_waits': 0, 'producer_wait_time': 0.0}
+        self.header = bytearray(header_size)  # every received frame header is read into it
+
+    def wait_for_space(self, timeout: float) -> None:
+        """Waits, with the lock held, until the queue drains or the connection closes"""
+        if self.space is None:
+            self.space = threading.Condition(self.lock)
+        self.space.wait(timeout)
+
+    def wake_producers(self) -> None:
+        """Wakes producers waiting for queue space; the lock must be held"""
+        if self.space is not None:
+            self.space.notify_all()
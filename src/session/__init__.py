@@ -1,12 +1,16 @@
 from .manager import N0ctuaSessionManager
-from .models import SessionStatus, TransitionToken
+from .models import SessionRecord, SessionStatus, TransitionToken
 from .exceptions import SessionError, SessionRotationError, SessionValidationError
+from .keys import KeyRatchet, derive_key
 
 __all__ = [
     'N0ctuaSessionManager',
+    'SessionRecord',
     'SessionStatus',
     'TransitionToken',
     'SessionError',
     'SessionRotationError',
-    'SessionValidationError'
+    'SessionValidationError',
+    'KeyRatchet',
+    'derive_key'
 ]
\ No newline at end of file
@@ -0,0 +1,95 @@
+from typing import Optional, Tuple
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from .exceptions import SessionRotationError
+
+KEY_SIZE = 32
+ROTATION_INFO = b'n0ctua session rotation'
+# A peer announcing a generation further ahead than this is not following the protocol
+MAX_GENERATION_STEP = 16
+
+
+def derive_key(key: bytes, generation: int) -> bytes:
+    """Derives the key of a generation from the key of the one before it"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=KEY_SIZE,
+        salt=None,
+        info=ROTATION_INFO + generation.to_bytes(4, 'big')
+    ).derive(key)
+
+
+class KeyRatchet:
+    """
+    Rotation state of the pairwise key of one connection.
+
+    Each rotation moves the key one generation forward with HKDF, so both ends
+    derive the same key without another RSA exchange, and a key cannot be
+    worked back from the one that replaced it. The node that rotates announces
+    the generation with the old key and opens frames sealed with either key
+    until the peer confirms; from then on both seal with the new key. The keys
+    left behind keep opening frames for an overlap window, for those still in
+    flight. When both ends rotate at once, a node can learn of a generation
+    before the confirmation of the one in between, so every key skipped over
+    stays accepted too.
+
+    The current key itself stays on the peer record, where every sender reads it.
+    """
+    __slots__ = ('generation', 'next_key', 'next_gcm', 'previous_keys', 'previous_gcms', 'previous_until')
+
+    def __init__(self, generation: int = 0):
+        self.generation = generation
+        self.next_key: Optional[bytes] = None
+        self.next_gcm: Optional[AESGCM] = None
+        self.previous_keys: Tuple[bytes, ...] = ()
+        self.previous_gcms: Tuple[AESGCM, ...] = ()
+        self.previous_until = 0.0
+
+    def propose(self, key: bytes) -> int:
+        """Derives the next generation from the current key, accepting it from now on, and returns its number"""
+        if self.next_gcm is None:
+            self.next_key = derive_key(key, self.generation + 1)
+            self.next_gcm = AESGCM(self.next_key)
+        return self.generation + 1
+
+    def advance(self, key: bytes, aes_gcm: AESGCM, generation: int, now: float,
+                overlap: float) -> Optional[Tuple[bytes, AESGCM]]:
+        """
+        Moves to generation, keeping the current key and any skipped over for
+        receiving during overlap seconds. Returns the new (key, aes_gcm), or
+        None if the connection already reached that generation.
+        """
+        if generation <= self.generation:
+            return None
+        if generation - self.generation > MAX_GENERATION_STEP:
+            raise SessionRotationError(f"Key generation {generation} is too far ahead of {self.generation}")
+
+        keys, gcms = [], []
+        while self.generation < generation:
+            keys.insert(0, key)
+            gcms.insert(0, aes_gcm)
+            if self.next_gcm is not None:
+                key, aes_gcm = self.next_key, self.next_gcm
+            else:
+                key = derive_key(key, self.generation + 1)
+                aes_gcm = AESGCM(key)
+            self.generation += 1
+            self.next_key = self.next_gcm = None
+        if now < self.previous_until:
+            keys += self.previous_keys
+            gcms += self.previous_gcms
+        # Newest first, since frames sealed with the key just replaced are the likeliest
+        self.previous_keys = tuple(keys[:MAX_GENERATION_STEP])
+        self.previous_gcms = tuple(gcms[:MAX_GENERATION_STEP])
+        self.previous_until = now + overlap
+        return key, aes_gcm
+
+    def receive_keys(self, aes_gcm: AESGCM, now: float) -> Tuple[AESGCM, ...]:
+        """Keys a received frame may be sealed with, the current one first"""
+        keys = (aes_gcm,)
+        if self.next_gcm is not None:
+            keys += (self.next_gcm,)
+        if now < self.previous_until:
+            keys += self.previous_gcms
+        return keys
@@ -1,72 +1,61 @@
 import secrets
 import threading
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Tuple, List
-from .models import SessionStatus, TransitionToken
+from typing import Callable, Dict, Optional, Tuple, List
+from .models import SessionRecord, SessionStatus, TransitionToken
 from .exceptions import SessionError, SessionRotationError, SessionValidationError
-from ..utils.session_config import SessionConfig
+from ..utils.config import get_settings
 
 
 class N0ctuaSessionManager:
-    def __init__(self):
-        self.sessions: Dict[str, dict] = {}
+    def __init__(self, config: Optional[dict] = None, clock: Callable[[], datetime] = datetime.now):
+        self.sessions: Dict[str, SessionRecord] = {}
         self.transition_tokens: Dict[str, TransitionToken] = {}
-        self.message_queues: Dict[str, List[dict]] = {}
         self.rotation_schedule: Dict[str, datetime] = {}
+        self.rotations = 0
         self.lock = threading.Lock()
 
-        # Load config in session_config.py
-        self.config = SessionConfig.get_config()
-        try:
-            SessionConfig.validate_config(self.config)
-        except ValueError as e:
-            print(f"Warning: Configuration validation failed: {e}")
-            print("Using default configuration values")
-            self.config = SessionConfig.DEFAULT_CONFIG
+        # Shared with the node settings, so a reload applies to live sessions
+        self.config = config if config is not None else get_settings().session
+        # Replaceable so a simulation can run rotations on virtual time
+        self.clock = clock
 
     def create_session(self, peer_id: str) -> str:
         """Creates a new session for a peer"""
         session_id = secrets.token_urlsafe(32)
 
         with self.lock:
-            self.sessions[session_id] = {
-                'peer_id': peer_id,
-                'created_at': datetime.now(),
-                'status': SessionStatus.ACTIVE,
-                'operations_count': 0
-            }
+            self.sessions[session_id] = SessionRecord(peer_id, self.clock())
 
         return session_id
 
     def is_session_valid(self, session_id: str) -> bool:
-        """Checks if a session is valid"""
+        """Checks if a session is valid, which a rotating one stays until the peer confirms its successor"""
         with self.lock:
-            if session_id not in self.sessions:
-                return False
-
-            session = self.sessions[session_id]
-            return session['status'] == SessionStatus.ACTIVE
+            session = self.sessions.get(session_id)
+            return session is not None and session.status in (SessionStatus.ACTIVE, SessionStatus.ROTATING)
 
     def invalidate_session(self, session_id: str) -> None:
-        """Invalidates a session"""
+        """Invalidates a session, forgetting it since nothing refers to it afterwards"""
         with self.lock:
-            if session_id in self.sessions:
-                self.sessions[session_id]['status'] = SessionStatus.INVALIDATED
+            session = self.sessions.pop(session_id, None)
+            if session is not None:
+                session.status = SessionStatus.INVALIDATED
 
     def update_session_peer_id(self, session_id: str, peer_id: str) -> None:
         """Updates the peer ID associated with a session"""
         with self.lock:
             if session_id in self.sessions:
-                self.sessions[session_id]['peer_id'] = peer_id
+                self.sessions[session_id].peer_id = peer_id
 
     def check_rotation_needed(self, session_id: str) -> bool:
         """Checks if session rotation is needed"""
         with self.lock:
-            if session_id not in self.sessions:
+            session = self.sessions.get(session_id)
+            if session is None:
                 return False
 
-            session = self.sessions[session_id]
-            session_age = (datetime.now() - session['created_at']).total_seconds()
+            session_age = (self.clock() - session.created_at).total_seconds()
             return session_age >= self.config['rotation_interval']
 
     def rotate_session(self, current_session_id: str) -> Tuple[str, str]:
@@ -76,18 +65,17 @@ class N0ctuaSessionManager:
                 raise SessionError("Session not found")
 
             current_session = self.sessions[current_session_id]
-            if current_session['status'] != SessionStatus.ACTIVE:
+            if current_session.status != SessionStatus.ACTIVE:
                 raise SessionError("Session is not active")
+            self._purge_expired_tokens()
 
             # Create new session
             new_session_id = secrets.token_urlsafe(32)
-            new_session = current_session.copy()
-            new_session['created_at'] = datetime.now()
-            new_session['operations_count'] = 0
+            new_session = SessionRecord(current_session.peer_id, self.clock())
 
             # Create transition token
             transition_token = secrets.token_urlsafe(32)
-            token_expiration = datetime.now() + timedelta(
+            token_expiration = self.clock() + timedelta(
                 seconds=self.config['token_lifetime']
             )
 
@@ -98,45 +86,73 @@ class N0ctuaSessionManager:
                 expires_at=token_expiration
             )
 
-            # Update states
-            current_session['status'] = SessionStatus.INVALIDATED
+            # A receive thread may still hold the old ID, so it stays valid until the
+            # peer confirms or the token expires
+            current_session.status = SessionStatus.ROTATING
             self.sessions[new_session_id] = new_session
+            self.rotations += 1
 
             return new_session_id, transition_token
 
-    def get_session_info(self, session_id: str) -> Optional[dict]:
-        """Gets information about a session"""
+    def validate_transition(self, new_session_id: str, token: str) -> bool:
+        """Validates and consumes a transition token confirmed by the peer"""
         with self.lock:
-            return self.sessions.get(session_id)
+            transition = self.transition_tokens.get(token)
+            if transition is None or transition.used:
+                return False
 
-    def queue_message(self, session_id: str, message: dict) -> bool:
-        """Queues a message during session rotation"""
-        with self.lock:
-            if session_id not in self.message_queues:
-                self.message_queues[session_id] = []
+            if transition.new_session != new_session_id:
+                return False
 
-            queue = self.message_queues[session_id]
-            if len(queue) >= self.config['max_queue_size']:
+            del self.transition_tokens[token]
+            self._retire(transition.old_session)
+            if self.clock() > transition.expires_at:
                 return False
 
-            queue.append({
-                'content': message,
-                'timestamp': datetime.now()
-            })
+            transition.used = True
             return True
 
-    def process_queued_messages(self, session_id: str) -> List[dict]:
-        """Processes queued messages for a session"""
+    def _retire(self, session_id: str) -> None:
+        session = self.sessions.get(session_id)
+        if session is not None and session.status == SessionStatus.ROTATING:
+            session.status = SessionStatus.INVALIDATED
+            del self.sessions[session_id]
+
+    def _purge_expired_tokens(self) -> None:
+        # Rotations the peer never confirmed would otherwise keep their token forever
+        now = self.clock()
+        for token, transition in list(self.transition_tokens.items()):
+            if now > transition.expires_at:
+                del self.transition_tokens[token]
+                self._retire(transition.old_session)
+
+    def export_state(self) -> Tuple[List[tuple], List[tuple], int]:
+        """
+        Returns sessions and unconfirmed rotations as plain tuples with POSIX
+        timestamps, for a process taking over this one
+        """
+        with self.lock:
+            self._purge_expired_tokens()
+            sessions = [(session_id, session.peer_id, session.created_at.timestamp(), session.operations_count)
+                        for session_id, session in self.sessions.items()]
+            tokens = [(t.token, t.old_session, t.new_session, t.expires_at.timestamp())
+                      for t in self.transition_tokens.values() if not t.used]
+            return sessions, tokens, self.rotations
+
+    def restore_state(self, sessions: List[tuple], tokens: List[tuple], rotations: int) -> None:
+        """Adds the state returned by export_state() in another process"""
         with self.lock:
-            if session_id not in self.message_queues:
-                return []
-
-            current_time = datetime.now()
-            valid_messages = [
-                msg['content'] for msg in self.message_queues[session_id]
-                if (current_time - msg['timestamp']).total_seconds() <=
-                   self.config['max_queue_age']
-            ]
-
-            del self.message_queues[session_id]
-            return valid_messages
\ No newline at end of file
+            for session_id, peer_id, created_at, operations_count in sessions:
+                self.sessions[session_id] = SessionRecord(peer_id, datetime.fromtimestamp(created_at),
+                                                          operations_count=operations_count)
+            for token, old_session, new_session, expires_at in tokens:
+                self.transition_tokens[token] = TransitionToken(token, old_session, new_session,
+                                                                datetime.fromtimestamp(expires_at))
+                if old_session in self.sessions:
+                    self.sessions[old_session].status = SessionStatus.ROTATING
+            self.rotations += rotations
+
+    def get_session_info(self, session_id: str) -> Optional[SessionRecord]:
+        """Gets information about a session"""
+        with self.lock:
+            return self.sessions.get(session_id)
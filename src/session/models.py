@@ -13,4 +13,18 @@ class TransitionToken:
     old_session: str
     new_session: str
     expires_at: datetime
-    used: bool = False
\ No newline at end of file
+    used: bool = False
+
+class SessionRecord:
+    """State of one session, kept in __slots__ since a relay holds one per connection"""
+    __slots__ = ('peer_id', 'created_at', 'status', 'operations_count')
+
+    def __init__(self, peer_id: str, created_at: datetime, status: SessionStatus = SessionStatus.ACTIVE,
+                 operations_count: int = 0):
+        self.peer_id = peer_id
+        self.created_at = created_at
+        self.status = status
+        self.operations_count = operations_count
+
+    def __repr__(self):
+        return f"SessionRecord(peer_id={self.peer_id!r}, status={self.status.value})"
@@ -0,0 +1,247 @@
+import os
+import secrets
+import struct
+import time
+from typing import List, NamedTuple, Optional
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+# magic, format version, time written (authenticated as associated data)
+SNAPSHOT_HEADER = struct.Struct('>4sHd')
+SNAPSHOT_MAGIC = b'N0SS'
+SNAPSHOT_VERSION = 4
+NONCE_SIZE = 12
+
+_U32 = struct.Struct('>I')
+_NUMBERS = {code: struct.Struct('>' + code) for code in 'BIQd'}
+# presence flag and value of an optional number
+_OPTIONAL = struct.Struct('>?d')
+
+
+class NodeRow(NamedTuple):
+    peer_id: str
+    rotations: int
+
+
+class SessionRow(NamedTuple):
+    session_id: str
+    peer_id: str
+    created_at: float
+    operations_count: int
+
+
+class TokenRow(NamedTuple):
+    token: str
+    old_session: str
+    new_session: str
+    expires_at: float
+
+
+class InviteRow(NamedTuple):
+    key_id: str
+    salt: bytes
+    digest: bytes
+    created_at: float
+    expires_at: Optional[float]
+    uses_left: Optional[float]
+
+
+class RoomRow(NamedTuple):
+    name: str
+    members: List[str]
+
+
+class DeliveredRow(NamedTuple):
+    """Last outbox sequence displayed from a peer, so redeliveries stay hidden"""
+    peer_id: str
+    seq: int
+
+
+class ConnectionRow(NamedTuple):
+    """Everything a connection needs to carry on in another process, apart from its socket"""
+    peer_id: str
+    host: str
+    port: int
+    session_id: str
+    aes_key: bytes
+    next_seq: int
+    acked: int
+    in_flight: List[int]  # sizes of the frames after acked, in sequence order
+    credit_bytes: int
+    credit_frames: int
+    expected: int
+    received: int
+    peer_acked: int
+    ack_sent: int
+    unacked: int
+    unacked_bytes: int
+    key_generation: int
+    next_key: bytes  # proposed by a rotation the peer has not confirmed, or empty
+    previous_keys: bytes  # concatenated keys still accepted from the peer for previous_ttl seconds
+    previous_ttl: float
+
+
+class FrameRow(NamedTuple):
+    """A frame still queued for a connection, by its position in the connections table"""
+    connection: int
+    kind: int
+    payload: bytes
+
+
+class SenderKeyRow(NamedTuple):
+    """A group key received on a connection"""
+    connection: int
+    key_id: int
+    key: bytes
+    room: str  # empty for the key of plain broadcasts
+
+
+# Tables in file order. Each is stored as a row count followed by its rows, with one
+# code per field: B, I, Q and d are big-endian numbers, s a string, b bytes, o an
+# optional number, l a list of strings and a a list of u32
+TABLES = (
+    ('node', NodeRow, 'sQ'),
+    ('sessions', SessionRow, 'ssdQ'),
+    ('tokens', TokenRow, 'sssd'),
+    ('invites', InviteRow, 'sbbdoo'),
+    ('rooms', RoomRow, 'sl'),
+    ('delivered', DeliveredRow, 'sQ'),
+    ('connections', ConnectionRow, 'ssIsbIIaQIIIIIIQIbbd'),
+    ('frames', FrameRow, 'IBb'),
+    ('sender_keys', SenderKeyRow, 'IIbs'),
+)
+
+
+class NodeSnapshot:
+    """
+    State of a node that a replacement process needs to serve the same peers:
+    sessions, pending rotations, invites, rooms, and the sequencing, flow
+    control and keys of every connection whose socket is handed over.
+    """
+
+    def __init__(self, **tables):
+        for name, _, _ in TABLES:
+            setattr(self, name, tables.get(name, []))
+
+    @property
+    def peer_id(self) -> Optional[str]:
+        return self.node[0].peer_id if self.node else None
+
+
+def _pack_field(parts: list, code: str, value) -> None:
+    if code == 's':
+        code, value = 'b', value.encode()
+    if code == 'b':
+        parts.append(_U32.pack(len(value)))
+        parts.append(value)
+    elif code == 'o':
+        parts.append(_OPTIONAL.pack(value is not None, value or 0.0))
+    elif code == 'l':
+        parts.append(_U32.pack(len(value)))
+        for item in value:
+            _pack_field(parts, 's', item)
+    elif code == 'a':
+        parts.append(_U32.pack(len(value)))
+        parts.append(struct.pack(f'>{len(value)}I', *value))
+    else:
+        parts.append(_NUMBERS[code].pack(value))
+
+
+def encode(snapshot: NodeSnapshot) -> bytes:
+    parts = []
+    for name, _, fields in TABLES:
+        rows = getattr(snapshot, name)
+        parts.append(_U32.pack(len(rows)))
+        for row in rows:
+            for code, value in zip(fields, row):
+                _pack_field(parts, code, value)
+    return b''.join(parts)
+
+
+class _Reader:
+    __slots__ = ('data', 'offset')
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def take(self, size: int) -> bytes:
+        if self.offset + size > len(self.data):
+            raise ValueError("Snapshot truncated")
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def field(self, code: str):
+        if code in 'sb':
+            value = self.take(self.unpack(_U32)[0])
+            return value.decode() if code == 's' else value
+        if code == 'o':
+            present, value = self.unpack(_OPTIONAL)
+            return value if present else None
+        if code == 'l':
+            return [self.field('s') for _ in range(self.unpack(_U32)[0])]
+        if code == 'a':
+            count = self.unpack(_U32)[0]
+            return list(struct.unpack(f'>{count}I', self.take(4 * count)))
+        return self.unpack(_NUMBERS[code])[0]
+
+
+def decode(data: bytes) -> NodeSnapshot:
+    reader = _Reader(data)
+    tables = {}
+    try:
+        for name, row_type, fields in TABLES:
+            count = reader.unpack(_U32)[0]
+            tables[name] = [row_type._make(reader.field(code) for code in fields) for _ in range(count)]
+    except (struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid snapshot: {e}")
+    if reader.offset != len(data):
+        raise ValueError("Invalid snapshot: trailing data")
+    return NodeSnapshot(**tables)
+
+
+def write_snapshot(path: str, snapshot: NodeSnapshot, key: bytes) -> int:
+    """
+    Seals a snapshot with a key that is never stored, and writes it atomically
+    with owner-only permissions. Returns the size of the file.
+    """
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, time.time())
+    nonce = secrets.token_bytes(NONCE_SIZE)
+    data = header + nonce + AESGCM(key).encrypt(nonce, encode(snapshot), header)
+
+    temporary = f"{path}.tmp"
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(temporary, path)
+    return len(data)
+
+
+def read_snapshot(path: str, key: bytes) -> NodeSnapshot:
+    """Reads and authenticates a snapshot written by write_snapshot()"""
+    with open(path, 'rb') as snapshot_file:
+        data = snapshot_file.read()
+    header = data[:SNAPSHOT_HEADER.size]
+    if len(header) != SNAPSHOT_HEADER.size:
+        raise ValueError(f"Invalid snapshot {path}")
+    magic, version, _ = SNAPSHOT_HEADER.unpack(header)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"Invalid snapshot {path}")
+
+    body = data[SNAPSHOT_HEADER.size:]
+    try:
+        plaintext = AESGCM(key).decrypt(body[:NONCE_SIZE], body[NONCE_SIZE:], header)
+    except InvalidTag:
+        raise ValueError(f"Snapshot {path} does not match its key")
+    return decode(plaintext)
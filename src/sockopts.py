@@ -0,0 +1,134 @@
+import socket
+import struct
+from typing import Dict, Optional
+
+# Leading fields of Linux struct tcp_info: eight u8 fields, then u32 counters
+TCP_INFO = struct.Struct('=8B24I')
+TCP_STATES = {
+    1: 'ESTABLISHED', 2: 'SYN_SENT', 3: 'SYN_RECV', 4: 'FIN_WAIT1', 5: 'FIN_WAIT2',
+    6: 'TIME_WAIT', 7: 'CLOSE', 8: 'CLOSE_WAIT', 9: 'LAST_ACK', 10: 'LISTEN', 11: 'CLOSING'
+}
+
+# Buffer sizes of None leave the kernel's autotuning in charge
+PROFILES = {
+    'interactive': {
+        'nodelay': 1,       # Send small chat frames immediately instead of coalescing them
+        'sndbuf': None,
+        'rcvbuf': None,
+        'keepalive': 60     # Seconds idle before probing a silent peer
+    },
+    'bulk': {
+        'nodelay': 0,       # Let Nagle merge small writes into full segments
+        'sndbuf': 4 * 1024 * 1024,
+        'rcvbuf': 4 * 1024 * 1024,
+        'keepalive': 300
+    }
+}
+
+
+def resolve_profile(config) -> Dict[str, Optional[int]]:
+    """Returns the configured profile with explicit buffer sizes applied on top"""
+    options = dict(PROFILES[config['socket_profile']])
+    if config['socket_sndbuf']:
+        options['sndbuf'] = config['socket_sndbuf']
+    if config['socket_rcvbuf']:
+        options['rcvbuf'] = config['socket_rcvbuf']
+    return options
+
+
+def _set(sock, level, option, value) -> None:
+    try:
+        sock.setsockopt(level, option, value)
+    except OSError:
+        # Platforms without an option keep their default
+        pass
+
+
+def apply_buffers(sock, options) -> None:
+    """
+    Sizes the kernel buffers. Call before connect() or listen(): the TCP window
+    scale is agreed during the handshake, and accepted sockets inherit these
+    values from the listening socket.
+    """
+    if options['sndbuf']:
+        _set(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, options['sndbuf'])
+    if options['rcvbuf']:
+        _set(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, options['rcvbuf'])
+
+
+def apply_connection(sock, options) -> None:
+    """Sets the per-connection options on a connected or accepted socket"""
+    _set(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, options['nodelay'])
+    if options['keepalive']:
+        _set(sock, socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            _set(sock, socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, options['keepalive'])
+        if hasattr(socket, 'TCP_KEEPINTVL'):
+            _set(sock, socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, options['keepalive'] // 6))
+
+
+def create_listener(config, port: int = 0) -> socket.socket:
+    """
+    Binds and starts listening right away; port 0 lets the kernel pick a free port.
+    The default bind address accepts IPv6 and IPv4 on one socket where the
+    platform supports dual-stack sockets.
+    """
+    address = config['bind_address']
+    dual_stack = address == '' and socket.has_dualstack_ipv6()
+    if dual_stack or ':' in address:
+        listener = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if listener.family == socket.AF_INET6:
+            # Only the wildcard address also takes IPv4 connections
+            v6_only = 0 if address in ('', '::') else 1
+            listener.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, v6_only)
+        apply_buffers(listener, resolve_profile(config))
+        listener.bind(('::' if dual_stack else address, port))
+        # Connections that arrive before the node is ready wait in the backlog
+        listener.listen(config['listen_backlog'])
+    except OSError:
+        listener.close()
+        raise
+    return listener
+
+
+def socket_info(sock) -> Dict[str, object]:
+    """Snapshot of a connection's options, plus kernel TCP statistics where available"""
+    info = {
+        'nodelay': sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY),
+        'sndbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+        'rcvbuf': sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    }
+
+    if hasattr(socket, 'TCP_INFO'):
+        try:
+            raw = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO.size)
+        except OSError:
+            return info
+        if len(raw) >= TCP_INFO.size:
+            fields = TCP_INFO.unpack_from(raw)
+            counters = fields[8:]
+            info.update({
+                'state': TCP_STATES.get(fields[0], str(fields[0])),
+                'retransmits': fields[2],
+                'rtt_us': counters[15],
+                'rttvar_us': counters[16],
+                'snd_cwnd': counters[18],
+                'snd_mss': counters[2],
+                'unacked': counters[4],
+                'total_retrans': counters[23]
+            })
+    return info
+
+
+def format_socket_info(info) -> str:
+    text = (f"nodelay={info['nodelay']}, sndbuf={info['sndbuf'] // 1024}K, "
+            f"rcvbuf={info['rcvbuf'] // 1024}K")
+    if 'rtt_us' in info:
+        text += (f", rtt={info['rtt_us'] / 1000:.2f}ms (+/-{info['rttvar_us'] / 1000:.2f}), "
+                 f"cwnd={info['snd_cwnd']}, unacked={info['unacked']}, "
+                 f"retrans={info['total_retrans']}")
+    return text
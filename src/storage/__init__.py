@@ -0,0 +1,15 @@
+from .message_log import MessageLog
+from .outbox import Outbox, OutboxRing
+from .models import LogRecord, INBOUND, OUTBOUND
+from .exceptions import StorageError, LogCorruptionError
+
+__all__ = [
+    'MessageLog',
+    'Outbox',
+    'OutboxRing',
+    'LogRecord',
+    'INBOUND',
+    'OUTBOUND',
+    'StorageError',
+    'LogCorruptionError'
+]
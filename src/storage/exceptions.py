@@ -0,0 +1,7 @@
+class StorageError(Exception):
+    """Base exception for persistent storage errors"""
+    pass
+
+class LogCorruptionError(StorageError):
+    """Exception raised when a stored record cannot be read or authenticated"""
+    pass
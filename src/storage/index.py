@@ -0,0 +1,187 @@
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# seq, timestamp, peer hash, segment number, offset in segment
+INDEX_ENTRY = struct.Struct('>QdIII')
+
+# magic, version, entry count, peer count, last seq, last timestamp. Native byte
+# order, since the arrays after it are mapped as they are; on a host of the
+# other order the version reads wrong and the file is rebuilt.
+SEALED_HEADER = struct.Struct('=4sHxxIIQd')
+SEALED_MAGIC = b'N0PX'
+SEALED_VERSION = 1
+
+_sync = getattr(os, 'fdatasync', os.fsync)
+
+
+def peer_hash(peer_id: str) -> int:
+    """Returns the 32-bit key used to bucket a peer in the index"""
+    return zlib.crc32(peer_id.encode())
+
+
+def _align(position: int) -> int:
+    return (position + 7) & ~7
+
+
+class _PeerIndex:
+    """Parallel arrays of (timestamp, offset) sorted by time"""
+    __slots__ = ('timestamps', 'offsets')
+
+    def __init__(self):
+        self.timestamps = array('d')
+        self.offsets = array('I')
+
+
+class SealedIndex:
+    """
+    Per-peer index of a segment that is no longer written, memory-mapped from
+    its .pix file. The file holds the sorted peer hashes, where each peer's
+    entries start, and then every timestamp and every offset, grouped by peer.
+    """
+
+    def __init__(self, path: str, segment: int):
+        self.segment = segment
+        with open(path, 'rb') as index_file:
+            size = os.fstat(index_file.fileno()).st_size
+            if size < SEALED_HEADER.size:
+                raise ValueError(f"Truncated index file {path}")
+            self._map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, entries, peers, self.last_seq, self.last_timestamp = SEALED_HEADER.unpack_from(self._map)
+        times_at = _align(SEALED_HEADER.size + 8 * peers)
+        if magic != SEALED_MAGIC or version != SEALED_VERSION or size != times_at + 12 * entries:
+            self._map.close()
+            raise ValueError(f"Invalid index file {path}")
+
+        view = memoryview(self._map)
+        self._views = [
+            view[SEALED_HEADER.size:SEALED_HEADER.size + 4 * peers].cast('I'),
+            view[SEALED_HEADER.size + 4 * peers:SEALED_HEADER.size + 8 * peers].cast('I'),
+            view[times_at:times_at + 8 * entries].cast('d'),
+            view[times_at + 8 * entries:].cast('I'),
+            view
+        ]
+        self.keys, self.starts, self.timestamps, self.offsets = self._views[:4]
+        self.entries = entries
+
+    @staticmethod
+    def write(path: str, peers: Dict[int, _PeerIndex], last_seq: int, last_timestamp: float) -> None:
+        """Writes the per-peer arrays of a segment, replacing path atomically"""
+        keys, starts = array('I'), array('I')
+        timestamps, offsets = array('d'), array('I')
+        for key in sorted(peers):
+            keys.append(key)
+            starts.append(len(timestamps))
+            timestamps.extend(peers[key].timestamps)
+            offsets.extend(peers[key].offsets)
+
+        header = SEALED_HEADER.pack(SEALED_MAGIC, SEALED_VERSION, len(timestamps), len(keys),
+                                    last_seq, last_timestamp)
+        padding = bytes(_align(SEALED_HEADER.size + 8 * len(keys)) - SEALED_HEADER.size - 8 * len(keys))
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as index_file:
+            for part in (header, keys, starts, padding, timestamps, offsets):
+                index_file.write(part)
+            index_file.flush()
+            _sync(index_file.fileno())
+        os.replace(temporary, path)
+
+    def range(self, key: int) -> Tuple[int, int]:
+        """Returns the slice of the arrays holding one peer's entries"""
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return 0, 0
+        return self.starts[i], self.starts[i + 1] if i + 1 < len(self.keys) else self.entries
+
+    def close(self) -> None:
+        for view in self._views:
+            view.release()
+        self._map.close()
+
+
+class HistoryIndex:
+    """
+    Time/peer index over the message log segments. Sealed segments are
+    memory-mapped from their .pix files, so opening the index costs one
+    mapping per segment; only the active segment is held in memory.
+    """
+
+    def __init__(self):
+        self.sealed: List[SealedIndex] = []
+        self.segment = 0
+        self._peers: Dict[int, _PeerIndex] = {}
+        self.entries = 0
+
+    def add(self, timestamp: float, key: int, segment: int, offset: int) -> None:
+        """Adds an entry of the active segment; timestamps must be appended in non-decreasing order"""
+        peer_index = self._peers.get(key)
+        if peer_index is None:
+            peer_index = self._peers[key] = _PeerIndex()
+        peer_index.timestamps.append(timestamp)
+        peer_index.offsets.append(offset)
+        self.segment = segment
+        self.entries += 1
+
+    def load(self, entries: Iterable[Tuple[int, float, int, int, int]]) -> int:
+        """Adds unpacked index entries of the active segment, returning the highest seq"""
+        last_seq = 0
+        for seq, timestamp, key, segment, offset in entries:
+            self.add(timestamp, key, segment, offset)
+            last_seq = seq
+        return last_seq
+
+    def attach(self, sealed: SealedIndex) -> None:
+        """Adds a sealed segment, which must be newer than those already attached"""
+        self.sealed.append(sealed)
+        self.entries += sealed.entries
+
+    def seal(self, path: str, last_seq: int, last_timestamp: float) -> None:
+        """Writes the active segment's arrays to path; call attach with the result"""
+        SealedIndex.write(path, self._peers, last_seq, last_timestamp)
+
+    def reset(self, segment: int) -> None:
+        """Starts an empty active segment once the previous one is attached"""
+        self.entries -= sum(len(peer_index.timestamps) for peer_index in self._peers.values())
+        self._peers = {}
+        self.segment = segment
+
+    def lookup(self, key: int, since: Optional[float] = None,
+               limit: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Returns (segment, offset) locations for a peer, oldest first"""
+        chunks = []
+        remaining = limit
+        # Segments never overlap in time, so walk them newest first and stop
+        # once the limit is met or an earlier segment can only be older than since
+        for segment, timestamps, offsets, lo, hi in self._ranges(key):
+            start = bisect_left(timestamps, since, lo, hi) if since is not None else lo
+            if remaining is not None and hi - start > remaining:
+                start = hi - remaining
+            chunks.append([(segment, offset) for offset in offsets[start:hi]])
+            if remaining is not None:
+                remaining -= hi - start
+                if not remaining:
+                    break
+            if start > lo:
+                break
+
+        return [location for chunk in reversed(chunks) for location in chunk]
+
+    def _ranges(self, key: int):
+        """Yields (segment, timestamps, offsets, lo, hi) holding a peer's entries, newest segment first"""
+        peer_index = self._peers.get(key)
+        if peer_index is not None:
+            yield self.segment, peer_index.timestamps, peer_index.offsets, 0, len(peer_index.timestamps)
+        for sealed in reversed(self.sealed):
+            lo, hi = sealed.range(key)
+            if lo < hi:
+                yield sealed.segment, sealed.timestamps, sealed.offsets, lo, hi
+
+    def close(self) -> None:
+        for sealed in self.sealed:
+            sealed.close()
+        self.sealed.clear()
@@ -0,0 +1,58 @@
+import os
+import secrets
+
+KEY_SIZE = 32
+
+
+def _read_key(path: str):
+    try:
+        with open(path, 'rb') as key_file:
+            return key_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def load_or_create_key(path: str) -> bytes:
+    """
+    Loads the local storage key, creating it with owner-only permissions if missing.
+    A new key is written and synced under a temporary name and then linked into
+    place, so the key file is either absent or complete, and a process creating it
+    at the same time never replaces one already in use.
+    """
+    key = _read_key(path)
+    if key == b'':
+        # Left by a crash of an earlier version, which created the file before writing
+        # to it; nothing can have been sealed with a key that was never stored
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        key = None
+    if key is not None:
+        if len(key) != KEY_SIZE:
+            raise ValueError(f"Invalid storage key in {path}")
+        return key
+
+    key = secrets.token_bytes(KEY_SIZE)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        os.write(fd, key)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    try:
+        os.link(temporary, path)
+    except FileExistsError:
+        # Another process stored its key first
+        return load_or_create_key(path)
+    except OSError:
+        # Filesystems without hard links
+        os.replace(temporary, path)
+    finally:
+        try:
+            os.unlink(temporary)
+        except FileNotFoundError:
+            pass
+    return key
@@ -0,0 +1,409 @@
+import mmap
+import os
+import secrets
+import struct
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .exceptions import StorageError, LogCorruptionError
+from .index import HistoryIndex, SealedIndex, INDEX_ENTRY, peer_hash
+from .keys import load_or_create_key
+from .models import LogRecord, INBOUND
+
+# sealed length, sequence number (authenticated as associated data)
+RECORD_HEADER = struct.Struct('>IQ')
+# timestamp, direction, peer id length, session id length
+RECORD_PAYLOAD = struct.Struct('>dBHH')
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
+IOV_MAX = 1024
+
+_sync = getattr(os, 'fdatasync', os.fsync)
+
+
+def _write_all(fd: int, buffers: List[bytes]) -> None:
+    """Writes every buffer to fd with as few vectored writes as possible"""
+    for start in range(0, len(buffers), IOV_MAX):
+        chunk = buffers[start:start + IOV_MAX]
+        written = os.writev(fd, chunk)
+        expected = sum(len(buffer) for buffer in chunk)
+        if written < expected:
+            # Short write: finish the remainder sequentially
+            remaining = b''.join(chunk)[written:]
+            while remaining:
+                remaining = remaining[os.write(fd, remaining):]
+
+
+class MessageLog:
+    """
+    Append-only, AEAD-sealed message log split into fixed-size segments.
+
+    Appends are group-committed by a writer thread: every record queued during
+    the commit window is written with one vectored write and made durable with
+    a single fsync. Each segment has a sidecar index file, and a segment that is
+    no longer written also gets a per-peer index that is memory-mapped on
+    start, so history lookups seek directly to the records they need and only
+    the active segment's index is replayed. Sealed segments are memory-mapped
+    for reads too. An index that is missing is rebuilt from its segment.
+    """
+
+    def __init__(self, directory: str, segment_size: int = 64 * 1024 * 1024,
+                 commit_interval: float = 0.005, max_commit_batch: int = 1024,
+                 key: Optional[bytes] = None):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.commit_interval = commit_interval
+        self.max_commit_batch = max_commit_batch
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._aead = AESGCM(key or load_or_create_key(os.path.join(directory, 'history.key')))
+
+        self.index = HistoryIndex()
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._pending = []
+        self._next_seq = 1
+        self._durable_seq = 0
+        self._last_timestamp = 0.0
+        self._segment_last = (0, 0.0)  # seq and timestamp of the active segment's last record
+        self._error: Optional[Exception] = None
+        self._closing = False
+
+        self.lock = threading.Lock()
+        self._commit_cond = threading.Condition(self.lock)
+        self._durable_cond = threading.Condition(self.lock)
+        self._segment_lock = threading.Lock()
+
+        self._recover()
+
+        self._writer = threading.Thread(target=self._writer_loop, name='message-log-writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _segment_path(self, segment: int, suffix: str) -> str:
+        return os.path.join(self.directory, f"{segment:08d}.{suffix}")
+
+    def _recover(self) -> None:
+        """Maps the sealed segment indexes, replays the active one and recovers its tail"""
+        segments = sorted(
+            int(name[:-4]) for name in os.listdir(self.directory)
+            if name.endswith('.log') and name[:-4].isdigit()
+        )
+        if not segments:
+            segments = [0]
+
+        for segment in segments[:-1]:
+            sealed = self._open_sealed(segment)
+            self.index.attach(sealed)
+            self._next_seq = max(self._next_seq, sealed.last_seq + 1)
+            self._last_timestamp = max(self._last_timestamp, sealed.last_timestamp)
+
+        self._active_segment = segments[-1]
+        self._log_fd = os.open(self._segment_path(self._active_segment, 'log'),
+                               os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        self._idx_fd = os.open(self._segment_path(self._active_segment, 'idx'),
+                               os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+
+        log_size = os.fstat(self._log_fd).st_size
+        index_data = b''
+        idx_size = os.fstat(self._idx_fd).st_size
+        if idx_size:
+            index_data = os.pread(self._idx_fd, idx_size, 0)
+
+        # Drop index entries that point past the log
+        count = len(index_data) // INDEX_ENTRY.size
+        valid_end = 0
+        while count:
+            _, _, _, _, offset = INDEX_ENTRY.unpack_from(index_data, (count - 1) * INDEX_ENTRY.size)
+            header = os.pread(self._log_fd, RECORD_HEADER.size, offset)
+            if len(header) == RECORD_HEADER.size:
+                sealed_size, _ = RECORD_HEADER.unpack(header)
+                valid_end = offset + RECORD_HEADER.size + sealed_size
+                if valid_end <= log_size:
+                    break
+            count -= 1
+            valid_end = 0
+
+        index_data = index_data[:count * INDEX_ENTRY.size]
+        if len(index_data) != idx_size:
+            os.ftruncate(self._idx_fd, len(index_data))
+        entries = list(INDEX_ENTRY.iter_unpack(index_data))
+
+        # Records without an entry, all of them if the index was lost, are indexed
+        # from the log itself; only a tail that does not authenticate is cut
+        if valid_end < log_size:
+            found, valid_end = self._scan(self._log_fd, self._active_segment, valid_end, log_size)
+            if found:
+                _write_all(self._idx_fd, [INDEX_ENTRY.pack(*entry) for entry in found])
+                _sync(self._idx_fd)
+                entries.extend(found)
+        if valid_end != log_size:
+            os.ftruncate(self._log_fd, valid_end)
+
+        self.index.reset(self._active_segment)
+        last_seq = self.index.load(entries)
+        if entries:
+            self._segment_last = (last_seq, entries[-1][1])
+            self._last_timestamp = max(self._last_timestamp, entries[-1][1])
+        self._next_seq = max(self._next_seq, last_seq + 1)
+        self._durable_seq = self._next_seq - 1
+        self._active_size = valid_end
+
+    def _open_sealed(self, segment: int) -> SealedIndex:
+        """Maps a sealed segment's per-peer index, writing it first if it is missing"""
+        path = self._segment_path(segment, 'pix')
+        try:
+            return SealedIndex(path, segment)
+        except (OSError, ValueError):
+            pass
+
+        entries = None
+        try:
+            with open(self._segment_path(segment, 'idx'), 'rb') as index_file:
+                index_data = index_file.read()
+            if index_data and len(index_data) % INDEX_ENTRY.size == 0:
+                entries = list(INDEX_ENTRY.iter_unpack(index_data))
+        except FileNotFoundError:
+            pass
+        if entries is None:
+            log_fd = os.open(self._segment_path(segment, 'log'), os.O_RDONLY)
+            try:
+                entries, _ = self._scan(log_fd, segment, 0, os.fstat(log_fd).st_size)
+            finally:
+                os.close(log_fd)
+
+        rebuilt = HistoryIndex()
+        last_seq = rebuilt.load(entries)
+        rebuilt.seal(path, last_seq, entries[-1][1] if entries else 0.0)
+        return SealedIndex(path, segment)
+
+    def _scan(self, fd: int, segment: int, start: int, end: int):
+        """
+        Reads the records of a segment from start, returning their index entries
+        and the offset after the last one that authenticates
+        """
+        entries = []
+        offset = start
+        while offset + RECORD_HEADER.size <= end:
+            header = os.pread(fd, RECORD_HEADER.size, offset)
+            sealed_size, seq = RECORD_HEADER.unpack(header)
+            record_end = offset + RECORD_HEADER.size + sealed_size
+            if sealed_size < NONCE_SIZE + RECORD_PAYLOAD.size + TAG_SIZE or record_end > end:
+                break
+            sealed = os.pread(fd, sealed_size, offset + RECORD_HEADER.size)
+            try:
+                plaintext = self._aead.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], header)
+            except InvalidTag:
+                break
+            timestamp, _, peer_len, _ = RECORD_PAYLOAD.unpack_from(plaintext)
+            peer_bytes = plaintext[RECORD_PAYLOAD.size:RECORD_PAYLOAD.size + peer_len]
+            entries.append((seq, timestamp, peer_hash(peer_bytes.decode()), segment, offset))
+            offset = record_end
+        return entries, offset
+
+    def append(self, peer_id: str, session_id: Optional[str], message: str,
+               direction: int = INBOUND, wait: bool = False) -> int:
+        """Seals a message and queues it for the next group commit, returning its sequence"""
+        peer_bytes = peer_id.encode()
+        session_bytes = (session_id or '').encode()
+        body = message.encode()
+
+        with self.lock:
+            if self._closing:
+                raise StorageError("Message log is closed")
+            if self._error:
+                raise StorageError(f"Message log writer failed: {self._error}")
+
+            seq = self._next_seq
+            self._next_seq += 1
+
+            # Keep timestamps monotonic so the index stays sorted
+            timestamp = max(time.time(), self._last_timestamp)
+            self._last_timestamp = timestamp
+
+            plaintext = b''.join((
+                RECORD_PAYLOAD.pack(timestamp, direction, len(peer_bytes), len(session_bytes)),
+                peer_bytes, session_bytes, body
+            ))
+            header = RECORD_HEADER.pack(NONCE_SIZE + len(plaintext) + TAG_SIZE, seq)
+            nonce = secrets.token_bytes(NONCE_SIZE)
+            record = header + nonce + self._aead.encrypt(nonce, plaintext, header)
+
+            self._pending.append((seq, timestamp, peer_hash(peer_id), record))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_commit_batch:
+                self._commit_cond.notify()
+
+            if wait:
+                while self._durable_seq < seq and not self._error:
+                    self._durable_cond.wait()
+
+        return seq
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every appended record is durable"""
+        with self.lock:
+            target = self._next_seq - 1
+            return self._durable_cond.wait_for(
+                lambda: self._durable_seq >= target or self._error is not None, timeout
+            ) and self._error is None
+
+    def _writer_loop(self) -> None:
+        while True:
+            with self.lock:
+                while not self._pending and not self._closing:
+                    self._commit_cond.wait()
+                if not self._pending:
+                    return
+                if (self.commit_interval and not self._closing
+                        and len(self._pending) < self.max_commit_batch):
+                    # Group commit window: let concurrent appends join this fsync
+                    self._commit_cond.wait(self.commit_interval)
+                batch = self._pending[:self.max_commit_batch]
+                del self._pending[:self.max_commit_batch]
+
+            try:
+                self._commit(batch)
+            except OSError as e:
+                with self.lock:
+                    self._error = e
+                    self._durable_cond.notify_all()
+                return
+
+    def _commit(self, batch) -> None:
+        records, entries = [], []
+        for seq, timestamp, key, record in batch:
+            if self._active_size and self._active_size + len(record) > self.segment_size:
+                self._write_batch(records, entries)
+                records, entries = [], []
+                self._roll_segment()
+            entries.append((seq, timestamp, key, self._active_segment, self._active_size))
+            records.append(record)
+            self._active_size += len(record)
+        self._write_batch(records, entries)
+
+    def _write_batch(self, records, entries) -> None:
+        if not records:
+            return
+
+        _write_all(self._log_fd, records)
+        _write_all(self._idx_fd, [INDEX_ENTRY.pack(*entry) for entry in entries])
+        _sync(self._log_fd)
+        _sync(self._idx_fd)
+
+        with self.lock:
+            for _, timestamp, key, segment, offset in entries:
+                self.index.add(timestamp, key, segment, offset)
+            self._durable_seq = entries[-1][0]
+            self._segment_last = entries[-1][:2]
+            self._durable_cond.notify_all()
+
+    def _roll_segment(self) -> None:
+        """Seals the active segment, mapping its per-peer index, and starts a new one"""
+        # Only this thread adds to the active index, so it is written without the lock
+        path = self._segment_path(self._active_segment, 'pix')
+        self.index.seal(path, *self._segment_last)
+        sealed = SealedIndex(path, self._active_segment)
+
+        with self._segment_lock:
+            os.close(self._log_fd)
+            os.close(self._idx_fd)
+            self._active_segment += 1
+            self._active_size = 0
+            self._log_fd = os.open(self._segment_path(self._active_segment, 'log'),
+                                   os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+            self._idx_fd = os.open(self._segment_path(self._active_segment, 'idx'),
+                                   os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+
+        with self.lock:
+            self.index.attach(sealed)
+            self.index.reset(self._active_segment)
+
+    def _segment_map(self, segment: int) -> mmap.mmap:
+        """Returns a read-only mapping of a sealed segment"""
+        mapping = self._maps.get(segment)
+        if mapping is None:
+            with open(self._segment_path(segment, 'log'), 'rb') as segment_file:
+                mapping = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapping
+        return mapping
+
+    def _read_raw(self, segment: int, offset: int) -> bytes:
+        with self._segment_lock:
+            if segment == self._active_segment:
+                header = os.pread(self._log_fd, RECORD_HEADER.size, offset)
+                sealed_size, _ = RECORD_HEADER.unpack(header)
+                return header + os.pread(self._log_fd, sealed_size, offset + RECORD_HEADER.size)
+
+            mapping = self._segment_map(segment)
+            sealed_size, _ = RECORD_HEADER.unpack_from(mapping, offset)
+            return mapping[offset:offset + RECORD_HEADER.size + sealed_size]
+
+    def _read_record(self, segment: int, offset: int) -> LogRecord:
+        raw = self._read_raw(segment, offset)
+        header = raw[:RECORD_HEADER.size]
+        _, seq = RECORD_HEADER.unpack(header)
+        nonce = raw[RECORD_HEADER.size:RECORD_HEADER.size + NONCE_SIZE]
+
+        try:
+            plaintext = self._aead.decrypt(nonce, raw[RECORD_HEADER.size + NONCE_SIZE:], header)
+        except InvalidTag:
+            raise LogCorruptionError(f"Record at segment {segment} offset {offset} failed authentication")
+
+        timestamp, direction, peer_len, session_len = RECORD_PAYLOAD.unpack_from(plaintext)
+        position = RECORD_PAYLOAD.size
+        peer_id = plaintext[position:position + peer_len].decode()
+        position += peer_len
+        session_id = plaintext[position:position + session_len].decode()
+        position += session_len
+
+        return LogRecord(
+            seq=seq,
+            timestamp=datetime.fromtimestamp(timestamp),
+            direction=direction,
+            peer_id=peer_id,
+            session_id=session_id,
+            message=plaintext[position:].decode()
+        )
+
+    def history(self, peer_id: str, since: Optional[datetime] = None,
+                limit: Optional[int] = 50) -> List[LogRecord]:
+        """Returns durable records exchanged with a peer, oldest first"""
+        wanted = limit
+        while True:
+            with self.lock:
+                locations = self.index.lookup(
+                    peer_hash(peer_id),
+                    since.timestamp() if since else None,
+                    wanted
+                )
+
+            records = []
+            for segment, offset in locations:
+                record = self._read_record(segment, offset)
+                # The index is keyed by hash, so discard collisions
+                if record.peer_id == peer_id:
+                    records.append(record)
+            # Collisions took up part of the limit: look further back while the index has more
+            if limit is None or len(records) >= limit or len(locations) < wanted:
+                return records[-limit:] if limit else records
+            wanted *= 2
+
+    def close(self) -> None:
+        """Commits pending records and releases every file handle"""
+        with self.lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._commit_cond.notify()
+        self._writer.join()
+
+        with self._segment_lock:
+            for mapping in self._maps.values():
+                mapping.close()
+            self._maps.clear()
+            self.index.close()
+            os.close(self._log_fd)
+            os.close(self._idx_fd)
@@ -0,0 +1,14 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+INBOUND = 0
+OUTBOUND = 1
+
+@dataclass(frozen=True)
+class LogRecord:
+    seq: int
+    timestamp: datetime
+    direction: int
+    peer_id: str
+    session_id: str
+    message: str
@@ -0,0 +1,277 @@
+import hashlib
+import os
+import secrets
+import struct
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .exceptions import StorageError, LogCorruptionError
+from .keys import load_or_create_key
+
+# magic, version, capacity, head, tail, next seq, last seq delivered here from the
+# peer's own outbox, peer id length; the peer id follows in full
+RING_HEADER = struct.Struct('>4sHIQQQQH')
+RING_MAGIC = b'N0OB'
+RING_VERSION = 2
+# As long as a handshake lets a peer id be
+MAX_PEER_ID = 256
+DATA_OFFSET = 512
+
+# sealed length, sequence number, enqueue timestamp
+RECORD_HEADER = struct.Struct('>IQd')
+
+NONCE_SIZE = 12
+
+_sync = getattr(os, 'fdatasync', os.fsync)
+
+
+class OutboxRing:
+    """
+    Disk-backed ring buffer of sealed messages waiting for one peer.
+
+    Positions are absolute byte offsets that only grow; the physical location is
+    the position modulo the capacity, so records may wrap around the end of the
+    data region. When the ring is full the oldest records are dropped.
+
+    The header also keeps the last record of the peer's outbox for this node
+    that was delivered here, so its redeliveries stay hidden across restarts.
+    """
+
+    def __init__(self, path: str, aead: AESGCM, peer_id: Optional[str] = None,
+                 capacity: int = 8 * 1024 * 1024):
+        self.path = path
+        self._aead = aead
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+        # The id is authenticated with every record, so it is kept whole or not at all
+        peer_bytes = peer_id.encode() if peer_id is not None else b''
+        if len(peer_bytes) > MAX_PEER_ID:
+            raise StorageError(f"Peer ID of {len(peer_bytes)} bytes is too long for an outbox")
+
+        exists = os.path.exists(path)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        header = os.pread(self._fd, RING_HEADER.size, 0) if exists else b''
+        created = len(header) != RING_HEADER.size
+        if not created:
+            magic, version, capacity, head, tail, next_seq, inbound_seq, peer_len = RING_HEADER.unpack(header)
+            peer_bytes = os.pread(self._fd, peer_len, RING_HEADER.size)
+            if magic != RING_MAGIC or version != RING_VERSION or peer_len > MAX_PEER_ID or len(peer_bytes) != peer_len:
+                os.close(self._fd)
+                raise LogCorruptionError(f"Invalid outbox file {path}")
+            try:
+                self.peer_id = peer_bytes.decode()
+            except UnicodeDecodeError:
+                os.close(self._fd)
+                raise LogCorruptionError(f"Invalid peer id in outbox file {path}")
+        else:
+            if peer_id is None:
+                os.close(self._fd)
+                raise StorageError(f"Outbox file {path} has no header")
+            head = tail = inbound_seq = 0
+            next_seq = 1
+            self.peer_id = peer_id
+            os.ftruncate(self._fd, DATA_OFFSET + capacity)
+
+        self.capacity = capacity
+        self.head = head
+        self.tail = tail
+        self.next_seq = next_seq
+        self.inbound_seq = inbound_seq
+        self._peer_bytes = peer_bytes
+        if created:
+            self._write_header()
+            os.pwrite(self._fd, peer_bytes, RING_HEADER.size)
+            _sync(self._fd)
+
+    def _write_header(self) -> None:
+        os.pwrite(self._fd, RING_HEADER.pack(
+            RING_MAGIC, RING_VERSION, self.capacity, self.head, self.tail,
+            self.next_seq, self.inbound_seq, len(self._peer_bytes)
+        ), 0)
+
+    def _write_at(self, position: int, data: bytes) -> None:
+        physical = position % self.capacity
+        first = min(len(data), self.capacity - physical)
+        os.pwrite(self._fd, data[:first], DATA_OFFSET + physical)
+        if first < len(data):
+            os.pwrite(self._fd, data[first:], DATA_OFFSET)
+
+    def _read_at(self, position: int, size: int) -> bytes:
+        physical = position % self.capacity
+        first = min(size, self.capacity - physical)
+        data = os.pread(self._fd, first, DATA_OFFSET + physical)
+        if first < size:
+            data += os.pread(self._fd, size - first, DATA_OFFSET)
+        return data
+
+    def _record_at(self, position: int) -> Tuple[int, int, float]:
+        """Returns (record size, seq, timestamp) for the record at a position"""
+        sealed_size, seq, timestamp = RECORD_HEADER.unpack(self._read_at(position, RECORD_HEADER.size))
+        return RECORD_HEADER.size + sealed_size, seq, timestamp
+
+    def _drop_head(self) -> None:
+        size, _, _ = self._record_at(self.head)
+        self.head += size
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.next_seq - self._head_seq() if self.head != self.tail else 0
+
+    def _head_seq(self) -> int:
+        return self._record_at(self.head)[1]
+
+    def put(self, message: str) -> int:
+        """Seals and stores a message, returning its sequence number"""
+        with self.lock:
+            seq = self.next_seq
+            nonce = secrets.token_bytes(NONCE_SIZE)
+            associated_data = self._peer_bytes + seq.to_bytes(8, 'big')
+            sealed = nonce + self._aead.encrypt(nonce, message.encode(), associated_data)
+            record = RECORD_HEADER.pack(len(sealed), seq, time.time()) + sealed
+
+            if len(record) > self.capacity:
+                raise StorageError("Message is larger than the outbox capacity")
+            while self.tail - self.head + len(record) > self.capacity:
+                self._drop_head()
+                self.dropped += 1
+
+            self._write_at(self.tail, record)
+            self.tail += len(record)
+            self.next_seq = seq + 1
+            self._write_header()
+            _sync(self._fd)
+            return seq
+
+    def read(self, position: Optional[int], max_records: int,
+             ttl: Optional[float] = None) -> Tuple[List[Tuple[int, float, str]], int]:
+        """Returns up to max_records unexpired (seq, timestamp, message) from a position"""
+        with self.lock:
+            if position is None or position < self.head:
+                position = self.head
+
+            cutoff = time.time() - ttl if ttl else None
+            records = []
+            while position < self.tail and len(records) < max_records:
+                size, seq, timestamp = self._record_at(position)
+                if cutoff is None or timestamp >= cutoff:
+                    raw = self._read_at(position + RECORD_HEADER.size, size - RECORD_HEADER.size)
+                    associated_data = self._peer_bytes + seq.to_bytes(8, 'big')
+                    try:
+                        message = self._aead.decrypt(raw[:NONCE_SIZE], raw[NONCE_SIZE:], associated_data)
+                    except Exception:
+                        raise LogCorruptionError(f"Outbox record {seq} for {self.peer_id} failed authentication")
+                    records.append((seq, timestamp, message.decode()))
+                position += size
+
+            return records, position
+
+    def ack(self, seq: int) -> int:
+        """Trims every record up to and including seq, returning how many were removed"""
+        with self.lock:
+            removed = 0
+            while self.head < self.tail:
+                size, record_seq, _ = self._record_at(self.head)
+                if record_seq > seq:
+                    break
+                self.head += size
+                removed += 1
+            if removed:
+                self._write_header()
+            return removed
+
+    def expire(self, ttl: float) -> int:
+        """Trims records older than ttl seconds from the head"""
+        with self.lock:
+            cutoff = time.time() - ttl
+            removed = 0
+            while self.head < self.tail:
+                size, _, timestamp = self._record_at(self.head)
+                if timestamp >= cutoff:
+                    break
+                self.head += size
+                removed += 1
+            if removed:
+                self._write_header()
+            return removed
+
+    def mark_inbound(self, seq: int) -> None:
+        """Records seq as the last record of the peer's outbox delivered here"""
+        with self.lock:
+            if seq > self.inbound_seq:
+                self.inbound_seq = seq
+                self._write_header()
+
+    def close(self) -> None:
+        with self.lock:
+            _sync(self._fd)
+            os.close(self._fd)
+
+
+class Outbox:
+    """Store-and-forward queues for every peer this node has talked to"""
+
+    def __init__(self, directory: str, capacity: int = 8 * 1024 * 1024,
+                 ttl: float = 86400, key: Optional[bytes] = None):
+        self.directory = directory
+        self.capacity = capacity
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._aead = AESGCM(key or load_or_create_key(os.path.join(directory, 'outbox.key')))
+
+        self.rings: Dict[str, OutboxRing] = {}
+        for name in os.listdir(directory):
+            if name.endswith('.ring'):
+                ring = OutboxRing(os.path.join(directory, name), self._aead)
+                self.rings[ring.peer_id] = ring
+
+    def _path(self, peer_id: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(peer_id.encode()).hexdigest()[:32] + '.ring')
+
+    def remember(self, peer_id: str) -> OutboxRing:
+        """Registers a peer as known so messages are kept for it while offline"""
+        with self.lock:
+            ring = self.rings.get(peer_id)
+            if ring is None:
+                ring = OutboxRing(self._path(peer_id), self._aead, peer_id, self.capacity)
+                self.rings[peer_id] = ring
+            return ring
+
+    def known_peers(self) -> List[str]:
+        with self.lock:
+            return list(self.rings)
+
+    def get(self, peer_id: str) -> Optional[OutboxRing]:
+        with self.lock:
+            return self.rings.get(peer_id)
+
+    def enqueue(self, peer_id: str, message: str) -> Optional[int]:
+        """Stores a message for a known peer, returning its outbox sequence"""
+        ring = self.get(peer_id)
+        if ring is None:
+            return None
+        return ring.put(message)
+
+    def ack(self, peer_id: str, seq: int) -> int:
+        ring = self.get(peer_id)
+        return ring.ack(seq) if ring else 0
+
+    def inbound_seq(self, peer_id: str) -> int:
+        """Last record of the peer's outbox for this node that was delivered here"""
+        ring = self.get(peer_id)
+        return ring.inbound_seq if ring is not None else 0
+
+    def mark_inbound(self, peer_id: str, seq: int) -> None:
+        ring = self.get(peer_id)
+        if ring is not None:
+            ring.mark_inbound(seq)
+
+    def close(self) -> None:
+        with self.lock:
+            for ring in self.rings.values():
+                ring.close()
+            self.rings.clear()
@@ -0,0 +1,12 @@
+from .datagram import DatagramTransport, LossyShim, ReplayWindow, MAX_DATAGRAM_PAYLOAD
+from .scheduler import ThreadScheduler
+
+# The simulator builds on the node itself, so it is imported from src.transport.simulator directly
+
+__all__ = [
+    'DatagramTransport',
+    'LossyShim',
+    'ReplayWindow',
+    'ThreadScheduler',
+    'MAX_DATAGRAM_PAYLOAD'
+]
@@ -0,0 +1,426 @@
+import errno
+import random
+import secrets
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from ..crypto import CryptoManager
+
+# destination connection id, packet type, packet number (authenticated as associated data)
+PACKET_HEADER = struct.Struct('>8sBQ')
+# every packet number up to this one received, bitmap of the 64 after the first one
+# missing, largest packet number received, bitmap of the 64 before it
+ACK_BODY = struct.Struct('>QQQQ')
+
+PACKET_DATA = 0
+PACKET_ACK = 1
+
+# Keeps datagrams under common path MTUs once headers and the AEAD tag are added
+MAX_DATAGRAM_PAYLOAD = 1200
+# Packets accepted beyond the first one missing; those further ahead are dropped
+# until it arrives, is retransmitted or falls back to TCP
+REPLAY_WINDOW = 4096
+# Lets the receive thread notice shutdown
+RECEIVE_TIMEOUT = 0.5
+
+
+class ReplayWindow:
+    """
+    Packet numbers already accepted on a path: every one up to through, and
+    those above it one by one. Nothing is forgotten, so a packet counts once
+    whether it arrives as a datagram, as a retransmission or over TCP after
+    its sender gave up on the datagram.
+    """
+    __slots__ = ('size', 'through', 'above', 'highest')
+
+    def __init__(self, size: int = REPLAY_WINDOW):
+        self.size = size
+        self.through = 0
+        self.above = set()
+        self.highest = 0
+
+    def accept(self, number: int, force: bool = False) -> bool:
+        """
+        Records a packet number, returning False for duplicates and, unless
+        forced, for numbers too far beyond the first one missing to keep track of
+        """
+        if number <= self.through or number in self.above:
+            return False
+        if number > self.through + self.size and not force:
+            return False
+        if number == self.through + 1:
+            through, above = number, self.above
+            while through + 1 in above:
+                through += 1
+                above.remove(through)
+            self.through = through
+        else:
+            self.above.add(number)
+        self.highest = max(self.highest, number)
+        return True
+
+    def seen(self, number: int) -> bool:
+        return number <= self.through or number in self.above
+
+    def ack_body(self) -> bytes:
+        """A cumulative acknowledgement, with the packets received after the first gap and before the largest"""
+        after = before = 0
+        for i in range(64):
+            if self.through + 2 + i in self.above:
+                after |= 1 << i
+            if self.seen(self.highest - 1 - i):
+                before |= 1 << i
+        return ACK_BODY.pack(self.through, after, self.highest, before)
+
+
+class Sent:
+    """A data packet waiting for its acknowledgement"""
+    __slots__ = ('number', 'packet', 'kind', 'payload', 'first_sent', 'last_sent', 'tries')
+
+    def __init__(self, number, packet, kind, payload, now):
+        self.number = number
+        self.packet = packet
+        self.kind = kind
+        self.payload = payload
+        self.first_sent = now
+        self.last_sent = now
+        self.tries = 1
+
+
+class DatagramPath:
+    """Datagram state for one peer, tied to its TCP connection and session key"""
+
+    def __init__(self, key, aes_gcm, local_id: bytes, rto: float):
+        self.key = key  # the peer's TCP socket
+        self.aes_gcm = aes_gcm
+        self.local_id = local_id
+        self.remote_id: Optional[bytes] = None
+        self.remote_addr = None
+        self.next_number = 1
+        self.unacked: Dict[int, Sent] = {}
+        self.replay = ReplayWindow()
+        self.ack_pending = False
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.rto = rto
+        self.stats = {'sent': 0, 'retransmitted': 0, 'received': 0, 'duplicates': 0, 'fallbacks': 0}
+
+    def sample_rtt(self, rtt: float, min_rto: float) -> None:
+        # RFC 6298 estimator
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = max(min_rto, self.srtt + 4 * self.rttvar)
+
+
+class LossyShim:
+    """Drops a fraction of outgoing datagrams, to exercise recovery without netem"""
+
+    def __init__(self, sock, loss: float, seed: Optional[int] = None):
+        self.sock = sock
+        self.loss = loss
+        self.random = random.Random(seed)
+
+    def sendto(self, data, address):
+        if self.random.random() < self.loss:
+            return len(data)
+        return self.sock.sendto(data, address)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class DatagramTransport:
+    """
+    Delivers chat frames as individually sealed UDP datagrams, so one lost packet
+    delays only its own message instead of everything queued behind it on TCP.
+
+    Each packet carries a connection id chosen by the receiver, so it is matched
+    to its peer even if the source address changes, and a packet number that is
+    authenticated with the payload and checked against a replay window. The
+    receiver acknowledges every packet up to the first one missing, plus
+    64-packet bitmaps after that gap and before the largest number received,
+    and the sender retransmits on an RFC 6298 timer. A message still
+    unacknowledged after max_retries is handed to on_undeliverable with its
+    packet number, to send over TCP; the receiver passes that number to
+    claim(), which tells whether the datagram got through after all. When a
+    session key rotates, receive_keys returns every key a packet on the path
+    may still be sealed with.
+    """
+
+    def __init__(self, sock, on_message: Callable, on_undeliverable: Callable,
+                 min_rto: float = 0.05, initial_rto: float = 0.2, max_retries: int = 6,
+                 receive_keys: Optional[Callable] = None):
+        self.sock = sock
+        self.on_message = on_message
+        self.on_undeliverable = on_undeliverable
+        self.receive_keys = receive_keys
+        self.min_rto = min_rto
+        self.initial_rto = initial_rto
+        self.max_retries = max_retries
+        self.paths: Dict[object, DatagramPath] = {}
+        self.by_id: Dict[bytes, DatagramPath] = {}
+        self.orphans: List[Tuple[object, Sent]] = []  # left by restarted paths, for the retransmit thread
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.running = True
+
+        for target in (self._receive_loop, self._retransmit_loop):
+            threading.Thread(target=target, daemon=True).start()
+
+    @property
+    def port(self) -> int:
+        return self.sock.getsockname()[1]
+
+    def _path(self, key, aes_gcm) -> DatagramPath:
+        path = self.paths.get(key)
+        if path is None:
+            local_id = secrets.token_bytes(8)
+            path = self.paths[key] = DatagramPath(key, aes_gcm, local_id, self.initial_rto)
+            self.by_id[local_id] = path
+        return path
+
+    def open_path(self, key, aes_gcm) -> bytes:
+        """Creates the path for a peer and returns the connection id it must send to"""
+        with self.lock:
+            return self._path(key, aes_gcm).local_id
+
+    def bind_remote(self, key, aes_gcm, remote_id: bytes, host: str, port: int) -> bool:
+        """
+        Completes a path with the id and address the peer announced. A new id on a
+        path already bound means the peer's end restarted, as after a handoff to a
+        new process: the path starts over, its unacknowledged datagrams fall back
+        to TCP, and True tells the caller to announce the new local id.
+        """
+        if self.sock.family == socket.AF_INET6 and '.' in host:
+            host = f"::ffff:{host}"
+        with self.lock:
+            path = self.paths.get(key)
+            restarted = path is not None and path.remote_id not in (None, remote_id)
+            if restarted:
+                self._drop_path(path)
+                # The peer's new end has no record of the old numbers, so these go without them
+                for sent in path.unacked.values():
+                    sent.number = None
+                self.orphans.extend((key, sent) for sent in path.unacked.values())
+                self.wakeup.notify()
+            path = self._path(key, aes_gcm)
+            path.remote_id = remote_id
+            path.remote_addr = (host, port)
+        return restarted
+
+    def set_key(self, key, aes_gcm) -> None:
+        """Seals what the path sends from now on with a rotated session key"""
+        with self.lock:
+            path = self.paths.get(key)
+            if path is not None:
+                path.aes_gcm = aes_gcm
+
+    def has_path(self, key) -> bool:
+        path = self.paths.get(key)
+        return path is not None and path.remote_id is not None
+
+    def _drop_path(self, path) -> None:
+        del self.paths[path.key]
+        self.by_id.pop(path.local_id, None)
+
+    def close_path(self, key) -> List[Tuple[int, int, bytes]]:
+        """Forgets a path, returning the (number, kind, payload) of datagrams still unacknowledged"""
+        with self.lock:
+            path = self.paths.get(key)
+            if path is None:
+                return []
+            self._drop_path(path)
+            return [(sent.number, sent.kind, sent.payload) for sent in path.unacked.values()]
+
+    def claim(self, key, number: int) -> bool:
+        """
+        Records a datagram that arrived over TCP instead, returning False if it
+        already arrived as a datagram and must not be delivered again
+        """
+        with self.lock:
+            path = self.paths.get(key)
+            if path is None:
+                return True
+            fresh = path.replay.accept(number, force=True)
+            if not fresh:
+                path.stats['duplicates'] += 1
+            return fresh
+
+    def path_stats(self, key) -> Optional[dict]:
+        path = self.paths.get(key)
+        if path is None or path.remote_id is None:
+            return None
+        return dict(path.stats, rtt=path.srtt, rto=path.rto, in_flight=len(path.unacked))
+
+    def _seal(self, path, packet_type, number, body) -> bytes:
+        header = PACKET_HEADER.pack(path.remote_id, packet_type, number)
+        return header + CryptoManager.encrypt_bytes(path.aes_gcm, body, header)
+
+    def send(self, key, kind: int, payload: bytes) -> bool:
+        """Sends one frame as a datagram; False means the caller should use TCP"""
+        if len(payload) > MAX_DATAGRAM_PAYLOAD:
+            return False
+        with self.lock:
+            path = self.paths.get(key)
+            if path is None or path.remote_id is None:
+                return False
+            number = path.next_number
+            path.next_number += 1
+            packet = self._seal(path, PACKET_DATA, number, bytes([kind]) + payload)
+            path.unacked[number] = Sent(number, packet, kind, payload, time.monotonic())
+            path.stats['sent'] += 1
+            address = path.remote_addr
+            self.wakeup.notify()
+
+        try:
+            self.sock.sendto(packet, address)
+        except OSError:
+            # The retransmit timer tries again, then falls back to TCP
+            pass
+        return True
+
+    def _receive_loop(self):
+        while self.running:
+            try:
+                readable, _, _ = select.select([self.sock], [], [], RECEIVE_TIMEOUT)
+                if not readable:
+                    continue
+                packets = [self.sock.recvfrom(65536)]
+                # Drain whatever else is queued, then acknowledge once per peer
+                while hasattr(socket, 'MSG_DONTWAIT') and len(packets) < 64:
+                    try:
+                        packets.append(self.sock.recvfrom(65536, socket.MSG_DONTWAIT))
+                    except (BlockingIOError, InterruptedError):
+                        break
+            except (OSError, ValueError) as e:
+                if not self.running or isinstance(e, ValueError) or e.errno in (errno.EBADF, errno.ENOTSOCK):
+                    return
+                continue
+
+            to_ack = set()
+            for data, address in packets:
+                path = self._open(data, address)
+                if path is not None and path.ack_pending:
+                    to_ack.add(path)
+            for path in to_ack:
+                self._send_ack(path)
+
+    def _open(self, data, address) -> Optional[DatagramPath]:
+        if len(data) < PACKET_HEADER.size:
+            return None
+        header = data[:PACKET_HEADER.size]
+        local_id, packet_type, number = PACKET_HEADER.unpack(header)
+        path = self.by_id.get(local_id)
+        if path is None:
+            return None
+        keys = (self.receive_keys and self.receive_keys(path.key)) or (path.aes_gcm,)
+        for aes_gcm in keys:
+            try:
+                body = CryptoManager.decrypt_bytes(aes_gcm, data[PACKET_HEADER.size:], header)
+                break
+            except Exception:
+                continue
+        else:
+            return None
+
+        with self.lock:
+            if packet_type == PACKET_ACK:
+                self._handle_ack(path, body)
+                return path
+            if packet_type != PACKET_DATA or not body:
+                return None
+            path.ack_pending = True
+            fresh = path.replay.accept(number)
+            if fresh:
+                path.stats['received'] += 1
+                # Only the newest packet moves the path: a captured packet replayed
+                # from elsewhere is a duplicate or older, and acknowledgements carry no number
+                if number == path.replay.highest:
+                    path.remote_addr = address
+            else:
+                path.stats['duplicates'] += 1
+
+        if fresh:
+            # Delivered as it arrives: a gap before it does not hold it back
+            self.on_message(path.key, body[0], body[1:])
+        return path
+
+    def _handle_ack(self, path, body):
+        through, after, largest, before = ACK_BODY.unpack(body)
+        now = time.monotonic()
+        # Packets are numbered in the order they are sent, which the dict keeps
+        acked = []
+        for number in path.unacked:
+            if number > through:
+                break
+            acked.append(number)
+        acked += [through + 2 + i for i in range(64) if after >> i & 1]
+        acked += [largest] + [largest - 1 - i for i in range(64) if before >> i & 1]
+        for number in acked:
+            sent = path.unacked.pop(number, None)
+            if sent is not None and sent.tries == 1:
+                # Karn's rule: only unambiguous samples
+                path.sample_rtt(now - sent.first_sent, self.min_rto)
+
+    def _send_ack(self, path):
+        with self.lock:
+            path.ack_pending = False
+            if path.remote_id is None:
+                return
+            packet = self._seal(path, PACKET_ACK, 0, path.replay.ack_body())
+            address = path.remote_addr
+        try:
+            self.sock.sendto(packet, address)
+        except OSError:
+            pass
+
+    def _retransmit_loop(self):
+        while self.running:
+            resend = []
+            with self.lock:
+                give_up, self.orphans = self.orphans, []
+                now = time.monotonic()
+                next_due = now + 1.0
+                for path in self.paths.values():
+                    for number, sent in list(path.unacked.items()):
+                        due = sent.last_sent + path.rto * (2 ** (sent.tries - 1))
+                        if due > now:
+                            next_due = min(next_due, due)
+                            continue
+                        if sent.tries > self.max_retries:
+                            del path.unacked[number]
+                            path.stats['fallbacks'] += 1
+                            give_up.append((path.key, sent))
+                            continue
+                        sent.tries += 1
+                        sent.last_sent = now
+                        path.stats['retransmitted'] += 1
+                        resend.append((sent.packet, path.remote_addr))
+                        next_due = min(next_due, now + path.rto * (2 ** (sent.tries - 1)))
+                if not resend and not give_up:
+                    self.wakeup.wait(max(0.001, next_due - now))
+                    continue
+
+            for packet, address in resend:
+                try:
+                    self.sock.sendto(packet, address)
+                except OSError:
+                    pass
+            for key, sent in give_up:
+                self.on_undeliverable(key, sent.kind, sent.payload, sent.number)
+
+    def close(self):
+        self.running = False
+        with self.lock:
+            self.wakeup.notify()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
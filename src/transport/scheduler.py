@@ -0,0 +1,80 @@
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Tuple
+
+
+class ThreadScheduler:
+    """
+    Runs delayed callbacks on one background thread, in real time.
+
+    Each key holds at most one pending callback: scheduling it again keeps the
+    earlier deadline. The network layer uses it for delayed acknowledgements
+    and for flushing frames once credit returns; the simulator provides the
+    same interface over virtual time. Deadlines sit in a heap; an entry whose
+    key was rescheduled or cancelled since is skipped when it comes up.
+    """
+    # Callers may wait for another thread, such as a producer waiting for queue space
+    blocking = True
+
+    def __init__(self):
+        self.clock: Callable[[], float] = time.monotonic
+        self.due: Dict[Hashable, tuple] = {}  # {key: (deadline, seq, callback)}
+        self.heap: List[Tuple[float, int, Hashable]] = []  # (deadline, seq, key), stale ones included
+        self.counter = itertools.count()
+        self.wakeup = threading.Condition()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def call_at(self, key: Hashable, deadline: float, callback: Callable[[Hashable], None]) -> None:
+        """Runs callback(key) at deadline, unless the key is already due sooner"""
+        with self.wakeup:
+            current = self.due.get(key)
+            if current is None or deadline < current[0]:
+                seq = next(self.counter)
+                self.due[key] = (deadline, seq, callback)
+                heapq.heappush(self.heap, (deadline, seq, key))
+                self._compact()
+                # Only an earlier first deadline changes how long the loop sleeps
+                if self.heap[0][1] == seq:
+                    self.wakeup.notify()
+
+    def cancel(self, key: Hashable) -> None:
+        with self.wakeup:
+            if self.due.pop(key, None) is not None:
+                self._compact()
+
+    def _compact(self):
+        # Drops stale entries once they outnumber the live ones, so the heap stays
+        # proportional to the callbacks pending
+        if len(self.heap) > 2 * len(self.due) + 64:
+            self.heap = [(deadline, seq, key) for key, (deadline, seq, _) in self.due.items()]
+            heapq.heapify(self.heap)
+
+    def _loop(self):
+        while True:
+            ready = []
+            with self.wakeup:
+                heap, due = self.heap, self.due
+                now = self.clock()
+                while heap:
+                    deadline, seq, key = heap[0]
+                    current = due.get(key)
+                    if current is None or current[1] != seq:
+                        heapq.heappop(heap)
+                        continue
+                    if deadline > now:
+                        break
+                    heapq.heappop(heap)
+                    del due[key]
+                    ready.append((key, current[2]))
+                if not ready:
+                    self.wakeup.wait(heap[0][0] - now if heap else None)
+                    continue
+
+            for key, callback in ready:
+                try:
+                    callback(key)
+                except Exception:
+                    # One failing callback must not stop the others
+                    pass
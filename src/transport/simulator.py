@@ -0,0 +1,594 @@
+"""
+Deterministic in-process network for exercising many nodes faster than real time.
+
+    python -m src.transport.simulator --peers=1000 --degree=4 --duration=1800 --seed=7
+
+Nodes run the real peer directory, session manager and NetworkManager over
+simulated connections on virtual time. The RSA handshake, the listener and
+the input loop are left out: connected nodes share a fresh AES key directly.
+"""
+import errno
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from ..crypto_pool import CryptoPool
+from ..directory import PeerDirectory
+from ..network import FRAME_HEADER, MAX_FRAME_SIZE, NetworkManager
+from ..peer import SecurePeer
+from ..rooms import RoomRegistry
+from ..session import N0ctuaSessionManager, SessionError
+from ..utils.config import Settings, parse_overrides
+
+# Virtual wall clock at time zero, for session timestamps
+EPOCH = datetime(2000, 1, 1)
+
+# Simulation defaults applied under any --set overrides: nothing touches the disk,
+# sealing stays on the calling thread, and sessions rotate within a short run
+SIM_OVERRIDES = {
+    'storage.history_enabled': 0,
+    'storage.outbox_enabled': 0,
+    'network.crypto_workers': 1,
+    'session.rotation_interval': 300
+}
+
+
+class SimScheduler:
+    """
+    Discrete-event scheduler on virtual time. Events due at the same instant
+    run in an order drawn from the seeded generator, so a seed fixes one
+    interleaving and different seeds explore others.
+
+    Offers the call_at/cancel interface of ThreadScheduler to NetworkManager.
+    Callers never block: there is no other thread to wake them.
+    """
+    blocking = False
+
+    def __init__(self, seed: int):
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.events = 0
+        self._queue: List[tuple] = []
+        self._counter = itertools.count()
+        self._keyed: Dict[Hashable, Tuple[float, object]] = {}
+
+    def clock(self) -> float:
+        return self.now
+
+    def datetime(self) -> datetime:
+        return EPOCH + timedelta(seconds=self.now)
+
+    def call_later(self, delay: float, callback: Callable, *args) -> None:
+        when = self.now + max(0.0, delay)
+        heapq.heappush(self._queue, (when, self.random.random(), next(self._counter), callback, args))
+
+    def call_at(self, key: Hashable, deadline: float, callback: Callable[[Hashable], None]) -> None:
+        """Runs callback(key) at deadline, unless the key is already due sooner"""
+        current = self._keyed.get(key)
+        if current is not None and current[0] <= deadline:
+            return
+        token = object()
+        self._keyed[key] = (deadline, token)
+        self.call_later(deadline - self.now, self._fire, key, token, callback)
+
+    def _fire(self, key, token, callback):
+        current = self._keyed.get(key)
+        if current is None or current[1] is not token:
+            return
+        del self._keyed[key]
+        callback(key)
+
+    def cancel(self, key: Hashable) -> None:
+        self._keyed.pop(key, None)
+
+    def run(self, until: float) -> None:
+        """Runs every event due up to the given virtual time"""
+        queue = self._queue
+        while queue and queue[0][0] <= until:
+            when, _, _, callback, args = heapq.heappop(queue)
+            self.now = when
+            self.events += 1
+            callback(*args)
+        self.now = max(self.now, until)
+
+
+class SimSocket:
+    """One end of a simulated TCP connection, with the socket methods the network layer uses"""
+
+    def __init__(self, network: 'SimNetwork', owner: 'SimPeer', remote_addr: tuple):
+        self.network = network
+        self.owner = owner
+        self.remote_addr = remote_addr
+        self.peer_end: Optional['SimSocket'] = None
+        self.inbox = bytearray()
+        self.in_transit = deque()      # writes on their way to this end, oldest first
+        self.held: List[bytes] = []    # writes waiting out a partition
+        self.busy_until = 0.0          # when the outgoing link finishes serialising
+        self.last_arrival = 0.0        # keeps deliveries in order despite loss and jitter
+        self.closed = False
+
+    def sendmsg(self, buffers, ancdata=(), flags=0) -> int:
+        # The link queues whatever is written, so a write never blocks
+        data = b''.join(buffers)
+        self.sendall(data)
+        return len(data)
+
+    def sendall(self, data: bytes) -> None:
+        if self.closed:
+            raise OSError(errno.EPIPE, "Connection closed")
+        self.network.transmit(self, bytes(data))
+
+    def getpeername(self) -> tuple:
+        return self.remote_addr
+
+    def shutdown(self, how=None) -> None:
+        self.network.close(self)
+
+    def close(self) -> None:
+        self.network.close(self)
+
+
+class SimNetwork:
+    """
+    Links between simulated sockets. A write is serialised at the link
+    bandwidth, then arrives after the propagation latency plus optional jitter.
+    Losses cost a retransmission timeout, doubling on repeated loss, and hold
+    back everything behind them as TCP would. During a partition, writes across
+    it wait; a connection with data stuck for longer than tcp_timeout is reset.
+    """
+
+    def __init__(self, scheduler: SimScheduler, latency: float = 0.02, bandwidth: float = 1250000,
+                 loss: float = 0.0, jitter: float = 0.0, mss: int = 1448, min_rto: float = 0.2,
+                 tcp_timeout: float = 60.0):
+        self.scheduler = scheduler
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.jitter = jitter
+        self.mss = mss
+        self.min_rto = min_rto
+        self.tcp_timeout = tcp_timeout
+        self.side: Dict[str, int] = {}  # peer_id -> side of the current partition
+        self.sockets: Dict[SimSocket, None] = {}  # open sockets, in a reproducible order
+        self.addresses = itertools.count(1)
+        self.stats = {'writes': 0, 'bytes': 0, 'retransmissions': 0, 'resets': 0}
+
+    def pair(self, a: 'SimPeer', b: 'SimPeer') -> Tuple[SimSocket, SimSocket]:
+        """Creates both ends of a connection between two nodes"""
+        number = next(self.addresses)
+        end_a = SimSocket(self, a, (b.peer_id, number))
+        end_b = SimSocket(self, b, (a.peer_id, number))
+        end_a.peer_end, end_b.peer_end = end_b, end_a
+        self.sockets[end_a] = self.sockets[end_b] = None
+        return end_a, end_b
+
+    def partitioned(self, sock: SimSocket) -> bool:
+        return self.side.get(sock.owner.peer_id, 0) != self.side.get(sock.peer_end.owner.peer_id, 0)
+
+    def transmit(self, sock: SimSocket, data: bytes) -> None:
+        self.stats['writes'] += 1
+        self.stats['bytes'] += len(data)
+        if self.partitioned(sock) or sock.held:
+            sock.held.append(data)
+            return
+        self._send(sock, data)
+
+    def _send(self, sock: SimSocket, data: bytes) -> None:
+        now = self.scheduler.now
+        rng = self.scheduler.random
+        start = max(now, sock.busy_until)
+        sock.busy_until = start + len(data) / self.bandwidth
+
+        delay = self.latency + (rng.random() * self.jitter if self.jitter else 0.0)
+        if self.loss:
+            segments = math.ceil(len(data) / self.mss)
+            lost = 1 - (1 - self.loss) ** segments
+            rto = max(self.min_rto, 4 * self.latency)
+            while rng.random() < lost:
+                delay += rto
+                rto *= 2
+                self.stats['retransmissions'] += 1
+
+        arrival = max(sock.busy_until + delay, sock.last_arrival)
+        sock.last_arrival = arrival
+        # Arrivals at the same instant may run in any order, so each one takes the oldest write
+        sock.peer_end.in_transit.append(data)
+        self.scheduler.call_later(arrival - now, self._arrive, sock.peer_end)
+
+    def _arrive(self, sock: SimSocket) -> None:
+        data = sock.in_transit.popleft()
+        if sock.closed:
+            return
+        sock.inbox += data
+        sock.owner.frames_arrived(sock)
+
+    def close(self, sock: SimSocket) -> None:
+        if sock.closed:
+            return
+        sock.closed = True
+        self.sockets.pop(sock, None)
+        remote = sock.peer_end
+        # The FIN follows the data already sent
+        when = max(self.scheduler.now + self.latency, sock.last_arrival)
+        self.scheduler.call_later(when - self.scheduler.now, self._eof, remote)
+
+    def _eof(self, sock: SimSocket) -> None:
+        if not sock.closed:
+            sock.owner.connection_lost(sock)
+
+    def partition(self, peer_ids) -> None:
+        """Cuts the given nodes off from the rest until heal()"""
+        for peer_id in peer_ids:
+            self.side[peer_id] = 1
+        self.scheduler.call_later(self.tcp_timeout, self._expire_held, dict(self.side))
+
+    def _expire_held(self, side: Dict[str, int]) -> None:
+        if side != self.side:
+            return
+        for sock in list(self.sockets):
+            if sock.held and not sock.closed:
+                self.reset(sock)
+
+    def reset(self, sock: SimSocket) -> None:
+        """Drops a connection at both ends, as a retransmission timeout would"""
+        self.stats['resets'] += 1
+        for end in (sock, sock.peer_end):
+            end.held.clear()
+            if not end.closed:
+                end.closed = True
+                self.sockets.pop(end, None)
+                end.owner.connection_lost(end)
+
+    def heal(self) -> None:
+        self.side.clear()
+        for sock in list(self.sockets):
+            held, sock.held = sock.held, []
+            for data in held:
+                self._send(sock, data)
+
+
+class SimConsole:
+    """Stands in for the terminal: counts error lines instead of printing them"""
+
+    def __init__(self, simulation: 'Simulation'):
+        self.simulation = simulation
+
+    def print_message(self, message, end='\n'):
+        if '[-]' in message and 'disconnected' not in message:
+            self.simulation.error(message)
+
+
+class SimPeer(SecurePeer):
+    """
+    A node on the simulated network. It keeps SecurePeer's connection handling
+    and the real directory, sessions and NetworkManager, but has no listener,
+    handshake workers, receive threads, pipeline or storage.
+    """
+
+    def __init__(self, simulation: 'Simulation', peer_id: str, settings: Settings):
+        self.simulation = simulation
+        self.settings = settings
+        self.network_config = settings.network
+        self.storage_config = settings.storage
+        self.trace = None
+        self.listen_socket = None
+        self.listen_port = 0
+        self.hosts = [peer_id]
+        self.peer_id = peer_id
+        self.peers = PeerDirectory()
+        self.rooms = RoomRegistry()
+        self.print_lock = threading.Lock()
+        self.running = True
+        self.session_manager = N0ctuaSessionManager(settings.session, clock=simulation.scheduler.datetime)
+        self.message_handler = SimConsole(simulation)
+        self.crypto_pool = CryptoPool(workers=1, inline_threshold=0)
+        self.network = NetworkManager(self, simulation.scheduler)
+        self.message_log = None
+        self.outbox = None
+        self.datagram = None
+        self.handoff = None
+        # Messages are displayed on the simulation thread, in virtual time
+        self.pipeline = None
+
+    def print_message(self, message, end='\n'):
+        self.message_handler.print_message(message, end)
+
+    def display_message(self, remote_peer_id, session_id, message, sent_at=None, channel=None):
+        self.simulation.delivered(self.peer_id, message)
+
+    def attach(self, sock: SimSocket, remote_peer_id: str, aes_key: bytes) -> None:
+        """Registers a connection once the simulated handshake completes"""
+        session_id = self.session_manager.create_session(remote_peer_id)
+        self.peers.add(sock, remote_peer_id, sock.getpeername(), session_id, AESGCM(aes_key), aes_key)
+
+    def frames_arrived(self, sock: SimSocket) -> None:
+        """Handles every complete frame received, as a receive thread would"""
+        inbox = sock.inbox
+        while len(inbox) >= FRAME_HEADER.size:
+            record = self.peers.get(sock)
+            if record is None:
+                return
+            size = FRAME_HEADER.unpack_from(inbox)[0]
+            end = FRAME_HEADER.size + size
+            if size <= MAX_FRAME_SIZE and len(inbox) < end:
+                return
+            header, data = bytes(inbox[:FRAME_HEADER.size]), bytes(inbox[FRAME_HEADER.size:end])
+            del inbox[:end]
+
+            try:
+                if size > MAX_FRAME_SIZE:
+                    raise SessionError(f"Frame of {size} bytes exceeds limit")
+                if not self.session_manager.is_session_valid(record.session_id):
+                    raise SessionError("Invalid session")
+                self.network.process_frame(record, header, data)
+            except Exception as e:
+                self.print_message(f"[-] Error receiving message from {record.peer_id}: {e}")
+                self.remove_peer(sock)
+                return
+
+    def connection_lost(self, sock: SimSocket) -> None:
+        self.remove_peer(sock)
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Simulation:
+    """
+    Builds a random topology of SimPeers, drives a broadcast workload with
+    optional partitions, and reports what was delivered.
+
+    Every random choice comes from the seed, so two runs with the same
+    parameters produce the same report, apart from the wall clock figures.
+    """
+
+    def __init__(self, peers: int = 100, degree: int = 4, seed: int = 1, duration: float = 600.0,
+                 interval: float = 30.0, size: int = 64, latency: float = 0.02, bandwidth: float = 1250000,
+                 loss: float = 0.0, jitter: float = 0.0, partitions: int = 0, partition_length: float = 20.0,
+                 overrides: Optional[Dict[str, object]] = None):
+        self.params = {
+            'peers': peers, 'degree': degree, 'seed': seed, 'duration': duration, 'interval': interval,
+            'size': size, 'latency': latency, 'bandwidth': bandwidth, 'loss': loss, 'jitter': jitter,
+            'partitions': partitions, 'partition_length': partition_length
+        }
+        self.scheduler = SimScheduler(seed)
+        # Separate streams, so changing one parameter does not reshuffle unrelated choices
+        self.topology_random = random.Random(f"{seed}:topology")
+        self.workload_random = random.Random(f"{seed}:workload")
+        self.network = SimNetwork(self.scheduler, latency, bandwidth, loss, jitter)
+
+        # os.devnull keeps a local config file out of the run; environment variables still apply
+        self.settings = Settings(os.devnull, dict(SIM_OVERRIDES, **(overrides or {})))
+        self.nodes: Dict[str, SimPeer] = {}
+        for index in range(peers):
+            peer_id = f"sim{index:05d}"
+            self.nodes[peer_id] = SimPeer(self, peer_id, self.settings)
+
+        self.edges: Set[Tuple[str, str]] = set()
+        self.counters = {'connections': 0, 'broadcasts': 0, 'expected': 0, 'delivered': 0,
+                         'duplicates': 0, 'reordered': 0, 'errors': 0, 'reconnects': 0}
+        self.error_samples: List[str] = []
+        self.latencies: List[float] = []
+        self.last_seen: Dict[Tuple[str, str], int] = {}
+        self.sequence: Dict[str, int] = {}
+
+    def error(self, message: str) -> None:
+        self.counters['errors'] += 1
+        if len(self.error_samples) < 5:
+            self.error_samples.append(f"t={self.scheduler.now:.3f} {message}")
+
+    def connect(self, a: str, b: str) -> None:
+        """Opens a connection after the handshake round trips"""
+        node_a, node_b = self.nodes[a], self.nodes[b]
+        end_a, end_b = self.network.pair(node_a, node_b)
+        key = AESGCM.generate_key(bit_length=256)
+
+        def established():
+            if end_a.closed or end_b.closed:
+                return
+            node_a.attach(end_a, b, key)
+            node_b.attach(end_b, a, key)
+            self.counters['connections'] += 1
+            node_a.peer_established(end_a, b)
+            node_b.peer_established(end_b, a)
+
+        # Secret, identity and key exchange take three round trips
+        self.scheduler.call_later(6 * self.network.latency, established)
+
+    def build_topology(self) -> None:
+        peer_ids = list(self.nodes)
+        degree = min(self.params['degree'], len(peer_ids) - 1)
+        for peer_id in peer_ids:
+            others = [other for other in peer_ids if other != peer_id]
+            for other in self.topology_random.sample(others, degree):
+                edge = tuple(sorted((peer_id, other)))
+                if edge not in self.edges:
+                    self.edges.add(edge)
+        for a, b in sorted(self.edges):
+            self.scheduler.call_later(self.topology_random.random(), self.connect, a, b)
+
+    def schedule_messages(self, peer_id: str) -> None:
+        delay = self.workload_random.expovariate(1 / self.params['interval'])
+        if self.scheduler.now + delay < self.params['duration']:
+            self.scheduler.call_later(delay, self.broadcast, peer_id)
+
+    def broadcast(self, peer_id: str) -> None:
+        node = self.nodes[peer_id]
+        seq = self.sequence[peer_id] = self.sequence.get(peer_id, 0) + 1
+        text = f"{seq} {self.scheduler.now!r} "
+        text += 'x' * max(0, self.params['size'] - len(text))
+
+        receivers = [record for record in node.peers.snapshot()
+                     if node.session_manager.is_session_valid(record.session_id)]
+        self.counters['broadcasts'] += 1
+        self.counters['expected'] += len(receivers)
+        if receivers:
+            node.network.broadcast_message(f"{peer_id}: {text}")
+        self.schedule_messages(peer_id)
+
+    def delivered(self, receiver: str, message: str) -> None:
+        sender, _, body = message.partition(': ')
+        seq, sent_at, _ = body.split(' ', 2)
+        seq = int(seq)
+        key = (sender, receiver)
+        last = self.last_seen.get(key, 0)
+        if seq == last:
+            self.counters['duplicates'] += 1
+            return
+        if seq < last:
+            self.counters['reordered'] += 1
+        self.last_seen[key] = max(seq, last)
+        self.counters['delivered'] += 1
+        self.latencies.append(self.scheduler.now - float(sent_at))
+
+    def schedule_partitions(self) -> None:
+        for _ in range(self.params['partitions']):
+            start = self.workload_random.uniform(0, self.params['duration'])
+            cut = self.workload_random.sample(list(self.nodes), max(1, len(self.nodes) // 2))
+            self.scheduler.call_later(start, self.network.partition, cut)
+            self.scheduler.call_later(start + self.params['partition_length'], self.heal)
+
+    def heal(self) -> None:
+        self.network.heal()
+        # Pairs whose connection was reset dial again
+        for a, b in sorted(self.edges):
+            if not self.nodes[a].peers.has_peer_id(b):
+                self.counters['reconnects'] += 1
+                self.connect(a, b)
+
+    def run(self, drain: float = 30.0) -> Dict[str, object]:
+        """Runs the workload, then lets traffic settle for drain seconds, and returns the report"""
+        started = time.perf_counter()
+        self.build_topology()
+        for peer_id in self.nodes:
+            self.scheduler.call_later(1.0, self.schedule_messages, peer_id)
+        self.schedule_partitions()
+        self.scheduler.run(self.params['duration'] + drain)
+        wall = time.perf_counter() - started
+        return self.report(wall)
+
+    def report(self, wall: float) -> Dict[str, object]:
+        streams = {'stalls': 0, 'acks_sent': 0, 'acks_piggybacked': 0, 'in_flight_bytes': 0, 'queued_bytes': 0}
+        sessions = rotations = rotations_pending = open_connections = 0
+        for node in self.nodes.values():
+            sessions += len(node.session_manager.sessions)
+            rotations += node.session_manager.rotations
+            rotations_pending += len(node.session_manager.transition_tokens)
+            for record in node.peers.snapshot():
+                open_connections += 1
+                stats = node.network.stream_stats(record)
+                if stats:
+                    for key in streams:
+                        streams[key] += stats[key]
+
+        counters = self.counters
+        return {
+            'parameters': self.params,
+            'correctness': {
+                'broadcasts': counters['broadcasts'],
+                'expected_deliveries': counters['expected'],
+                'delivered': counters['delivered'],
+                'missing': counters['expected'] - counters['delivered'],
+                'duplicates': counters['duplicates'],
+                'reordered': counters['reordered'],
+                'errors': counters['errors'],
+                'error_samples': self.error_samples
+            },
+            'network': dict(self.network.stats, connections=counters['connections'],
+                            open_connections=open_connections // 2, reconnects=counters['reconnects']),
+            'sessions': {
+                'open': sessions,
+                'rotations': rotations,
+                'unconfirmed_rotations': rotations_pending
+            },
+            'streams': streams,
+            'latency': {
+                'p50': _percentile(self.latencies, 0.5),
+                'p95': _percentile(self.latencies, 0.95),
+                'p99': _percentile(self.latencies, 0.99),
+                'max': max(self.latencies) if self.latencies else None
+            },
+            'performance': {
+                'virtual_seconds': self.scheduler.now,
+                'events': self.scheduler.events,
+                # Not reproducible: depends on the machine
+                'wall_seconds': round(wall, 3),
+                'speedup': round(self.scheduler.now / wall, 1) if wall else None
+            }
+        }
+
+
+def format_report(report: Dict[str, object]) -> str:
+    lines = []
+    for section, values in report.items():
+        lines.append(f"[{section}]")
+        for key, value in values.items():
+            if isinstance(value, float):
+                value = f"{value:.6f}"
+            elif isinstance(value, list):
+                value = "; ".join(value) or "-"
+            lines.append(f"  {key}: {value}")
+    return "\n".join(lines)
+
+
+OPTIONS = {
+    '--peers=': ('peers', int),
+    '--degree=': ('degree', int),
+    '--seed=': ('seed', int),
+    '--duration=': ('duration', float),
+    '--interval=': ('interval', float),
+    '--size=': ('size', int),
+    '--latency=': ('latency', float),
+    '--bandwidth=': ('bandwidth', float),
+    '--loss=': ('loss', float),
+    '--jitter=': ('jitter', float),
+    '--partitions=': ('partitions', int),
+    '--partition-length=': ('partition_length', float)
+}
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    args = sys.argv[1:] if args is None else args
+    params = {}
+    json_path = None
+    try:
+        for arg in args:
+            if arg.startswith('--json='):
+                json_path = arg.split('=', 1)[1]
+                continue
+            for prefix, (name, cast) in OPTIONS.items():
+                if arg.startswith(prefix):
+                    params[name] = cast(arg[len(prefix):])
+                    break
+            else:
+                if not arg.startswith('--set='):
+                    raise ValueError(f"Unknown option {arg}")
+        simulation = Simulation(overrides=parse_overrides(args), **params)
+    except ValueError as e:
+        print(f"[-] Invalid simulation: {e}")
+        return 1
+
+    report = simulation.run()
+    print(format_report(report))
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    correctness = report['correctness']
+    return 1 if correctness['duplicates'] or correctness['reordered'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,13 @@
-from .helpers import clear_screen, find_available_port, generate_id, parse_connection_string
+from .helpers import clear_screen, discover_host_addresses, find_available_port, format_connection_string, generate_id, normalize_address, parse_connection_string, parse_duration, parse_since
 
 __all__ = [
     'clear_screen',
+    'discover_host_addresses',
     'find_available_port',
+    'format_connection_string',
     'generate_id',
-    'parse_connection_string'
+    'normalize_address',
+    'parse_connection_string',
+    'parse_duration',
+    'parse_since'
 ]
\ No newline at end of file
@@ -0,0 +1,99 @@
+import sys
+import threading
+import traceback
+from typing import Dict, List
+
+# Slabs come in power-of-two sizes from 2**MIN_SHIFT to 2**MAX_SHIFT bytes
+MIN_SHIFT = 13
+MAX_SHIFT = 20
+# The allocator recycles blocks this small faster than the pool's bookkeeping;
+# larger ones are where malloc starts to fault in fresh pages
+SMALL = 4096
+
+
+class BufferPool:
+    """
+    Reusable bytearray slabs in power-of-two size classes, lent out as writable
+    memoryviews of the exact size asked for. Requests up to SMALL bytes get a
+    plain bytearray, which costs less than the pool's bookkeeping.
+
+    A slab goes back to its class on release() only if nothing else still refers
+    to it, so a slice kept past the release costs a reuse, never corrupts data.
+    Larger sizes get a fresh buffer, and the pool keeps at most capacity bytes of
+    idle slabs. With debug set, every outstanding buffer remembers where it was
+    acquired, so leaks() can name the code that never released it.
+    """
+
+    def __init__(self, capacity: int = 8 * 1024 * 1024, debug: bool = False):
+        self.capacity = capacity
+        self.debug = debug
+        self.lock = threading.Lock()
+        self._free: List[List[bytearray]] = [[] for _ in range(MAX_SHIFT + 1)]
+        self._pooled_bytes = 0
+        self._outstanding: Dict[int, tuple] = {}  # debug only: {id(view): (view, stack)}
+        self.acquired = self.reused = self.released = self.discarded = 0
+        self.peak_in_use = 0
+
+    def acquire(self, size: int) -> memoryview:
+        """Returns a writable view of size bytes, backed by a pooled slab where possible"""
+        if size <= SMALL and not self.debug:
+            return memoryview(bytearray(size))
+        shift = max(MIN_SHIFT, (size - 1).bit_length())
+        slab = None
+        with self.lock:
+            self.acquired += 1
+            in_use = self.acquired - self.released
+            if in_use > self.peak_in_use:
+                self.peak_in_use = in_use
+            if shift <= MAX_SHIFT:
+                free = self._free[shift]
+                if free:
+                    slab = free.pop()
+                    self._pooled_bytes -= len(slab)
+                    self.reused += 1
+        if slab is None:
+            slab = bytearray(1 << shift if shift <= MAX_SHIFT else size)
+
+        view = memoryview(slab)[:size]
+        if self.debug:
+            with self.lock:
+                self._outstanding[id(view)] = (view, traceback.extract_stack(limit=8)[:-1])
+        return view
+
+    def release(self, view: memoryview) -> None:
+        """Returns a view from acquire(); the view must not be used afterwards"""
+        slab = view.obj
+        if len(slab) <= SMALL and not self.debug:
+            view.release()
+            return
+        try:
+            view.release()
+        except BufferError:
+            # Something still exports the view, so the slab cannot be reused
+            slab = None
+        slab_size = len(slab) if slab is not None else 0
+        shift = slab_size.bit_length() - 1
+        with self.lock:
+            if self.debug and self._outstanding.pop(id(view), None) is None:
+                raise ValueError("Buffer released twice or not acquired from this pool")
+            self.released += 1
+            # Two references: the local name and getrefcount's argument
+            if (not MIN_SHIFT <= shift <= MAX_SHIFT or slab_size != 1 << shift or type(slab) is not bytearray
+                    or sys.getrefcount(slab) > 2 or self._pooled_bytes + slab_size > self.capacity):
+                self.discarded += 1
+                return
+            self._free[shift].append(slab)
+            self._pooled_bytes += slab_size
+
+    def leaks(self) -> List[str]:
+        """Where each buffer still outstanding was acquired; empty unless debug is set"""
+        with self.lock:
+            outstanding = list(self._outstanding.values())
+        return [''.join(traceback.format_list(stack)).rstrip() for _, stack in outstanding]
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {'acquired': self.acquired, 'reused': self.reused, 'released': self.released,
+                    'discarded': self.discarded, 'in_use': self.acquired - self.released,
+                    'peak_in_use': self.peak_in_use, 'pooled_bytes': self._pooled_bytes,
+                    'pooled_slabs': sum(len(free) for free in self._free)}
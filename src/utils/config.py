@@ -1,101 +1,244 @@
-# config.py
+import configparser
 import os
-from typing import Dict, Any
-
-# Default session configuration
-SESSION_CONFIG = {
-    'token_lifetime': 30,  # Duration of transition tokens in seconds
-    'notification_window': 10,  # Time before rotation to notify peers in seconds
-    'max_queue_size': 100,  # Maximum number of messages to queue during rotation
-    'max_queue_age': 30,  # Maximum age of queued messages in seconds
-    'rotation_interval': 1800  # Time between session rotations (30 minutes)
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_CONFIG_PATH = os.path.join('~', '.n0ctua', 'n0ctua.conf')
+
+
+def _path(value) -> str:
+    return os.path.expanduser(str(value))
+
+
+class Option:
+    """One typed setting: default, valid range or choices, environment variable and reload policy"""
+    __slots__ = ('default', 'type', 'bounds', 'env', 'reloadable', 'choices')
+
+    def __init__(self, default, type_cast: Callable, bounds: Optional[Tuple] = None,
+                 env: Optional[str] = None, reloadable: bool = False, choices: Optional[Tuple] = None):
+        self.default = default
+        self.type = type_cast
+        self.bounds = bounds
+        self.env = env
+        self.reloadable = reloadable
+        self.choices = choices
+
+
+# Every setting, by section. Reloadable ones are read at use, so SIGHUP may change them
+SCHEMA: Dict[str, Dict[str, Option]] = {
+    'session': {
+        'token_lifetime': Option(30, int, (5, 300), 'N0CTUA_TOKEN_LIFETIME', True),
+        'notification_window': Option(10, int, (5, 60), 'N0CTUA_NOTIFICATION_WINDOW', True),
+        'rotation_interval': Option(1800, int, (300, 7200), 'N0CTUA_ROTATION_INTERVAL', True),
+        'rekey_overlap': Option(10, int, (1, 300), 'N0CTUA_REKEY_OVERLAP', True)
+    },
+    'network': {
+        # Empty listens on every interface, over IPv6 and IPv4 where supported
+        'bind_address': Option('', str, None, 'N0CTUA_BIND_ADDRESS'),
+        'listen_backlog': Option(128, int, (1, 65535), 'N0CTUA_LISTEN_BACKLOG', True),
+        'recv_buffer': Option(65536, int, (1024, 16 * 1024 * 1024), 'N0CTUA_RECV_BUFFER', True),
+        'handshake_workers': Option(16, int, (1, 1024), 'N0CTUA_HANDSHAKE_WORKERS'),
+        'handshake_queue': Option(64, int, (0, 65535), 'N0CTUA_HANDSHAKE_QUEUE'),
+        'handshake_timeout': Option(10, int, (1, 120), 'N0CTUA_HANDSHAKE_TIMEOUT', True),
+        'connect_timeout': Option(30, int, (1, 300), 'N0CTUA_CONNECT_TIMEOUT', True),
+        'connect_parallelism': Option(16, int, (1, 256), 'N0CTUA_CONNECT_PARALLELISM', True),
+        'rate_limit': Option(2.0, float, (0.01, 10000), 'N0CTUA_RATE_LIMIT', True),
+        'rate_burst': Option(10, int, (1, 100000), 'N0CTUA_RATE_BURST', True),
+        'max_tracked_sources': Option(10000, int, (100, 10000000), 'N0CTUA_MAX_TRACKED_SOURCES', True),
+        'group_broadcast': Option(0, int, (0, 1), 'N0CTUA_GROUP_BROADCAST', True),
+        # KiB reserved for each thread, one per connection; the platform default is often 8 MiB
+        'thread_stack_size': Option(512, int, (256, 65536), 'N0CTUA_THREAD_STACK_SIZE'),
+        'crypto_workers': Option(4, int, (1, 256), 'N0CTUA_CRYPTO_WORKERS'),
+        'crypto_inline_threshold': Option(256 * 1024, int, (0, 1024 * 1024 * 1024),
+                                          'N0CTUA_CRYPTO_INLINE_THRESHOLD', True),
+        # Applied to connections opened after a change
+        'socket_profile': Option('interactive', str, None, 'N0CTUA_SOCKET_PROFILE', True,
+                                 choices=('interactive', 'bulk')),
+        'socket_sndbuf': Option(0, int, (0, 64 * 1024 * 1024), 'N0CTUA_SOCKET_SNDBUF', True),
+        'socket_rcvbuf': Option(0, int, (0, 64 * 1024 * 1024), 'N0CTUA_SOCKET_RCVBUF', True),
+        # Credit advertised to peers: bytes and frames they may send before this node consumes them.
+        # Applied to connections opened after a change
+        'flow_window': Option(1024 * 1024, int, (64 * 1024, 256 * 1024 * 1024), 'N0CTUA_FLOW_WINDOW', True),
+        'flow_frames': Option(1024, int, (64, 1000000), 'N0CTUA_FLOW_FRAMES', True),
+        # Bytes queued per peer while it is out of credit, before senders block
+        'flow_queue': Option(4 * 1024 * 1024, int, (64 * 1024, 1024 * 1024 * 1024), 'N0CTUA_FLOW_QUEUE', True),
+        'flow_stall_timeout': Option(30, int, (1, 3600), 'N0CTUA_FLOW_STALL_TIMEOUT', True),
+        # Idle bytes kept for reuse by the frame read path; 0 allocates every buffer afresh
+        'buffer_pool': Option(8 * 1024 * 1024, int, (0, 1024 * 1024 * 1024), 'N0CTUA_BUFFER_POOL'),
+        # Records where each borrowed buffer was taken, so the memory command can show leaks
+        'buffer_debug': Option(0, int, (0, 1), 'N0CTUA_BUFFER_DEBUG'),
+        # Unix socket a new process connects to with --takeover, to inherit every connection
+        # ('' disables); the session snapshot is written next to it
+        'handoff_socket': Option('', _path, None, 'N0CTUA_HANDOFF_SOCKET'),
+        'handoff_timeout': Option(10, int, (1, 300), 'N0CTUA_HANDOFF_TIMEOUT', True),
+        # Chat frames over UDP on the listening port number, with TCP as fallback (0 disables)
+        'datagram': Option(0, int, (0, 1), 'N0CTUA_DATAGRAM'),
+        'datagram_min_rto': Option(0.05, float, (0.001, 5), 'N0CTUA_DATAGRAM_MIN_RTO'),
+        'datagram_retries': Option(6, int, (1, 20), 'N0CTUA_DATAGRAM_RETRIES'),
+        # Fraction of outgoing datagrams dropped on purpose, for loss testing only
+        'datagram_loss': Option(0.0, float, (0, 0.9), 'N0CTUA_DATAGRAM_LOSS')
+    },
+    'storage': {
+        'history_enabled': Option(1, int, (0, 1), 'N0CTUA_HISTORY_ENABLED'),
+        'history_dir': Option(os.path.join('~', '.n0ctua', 'history'), _path, None, 'N0CTUA_HISTORY_DIR'),
+        'segment_size': Option(64 * 1024 * 1024, int, (1024 * 1024, 1024 * 1024 * 1024), 'N0CTUA_SEGMENT_SIZE'),
+        'commit_interval': Option(0.005, float, (0, 1), 'N0CTUA_COMMIT_INTERVAL'),
+        'max_commit_batch': Option(1024, int, (1, 65536), 'N0CTUA_MAX_COMMIT_BATCH'),
+        'outbox_enabled': Option(1, int, (0, 1), 'N0CTUA_OUTBOX_ENABLED'),
+        'outbox_dir': Option(os.path.join('~', '.n0ctua', 'outbox'), _path, None, 'N0CTUA_OUTBOX_DIR'),
+        'outbox_capacity': Option(8 * 1024 * 1024, int, (64 * 1024, 1024 * 1024 * 1024), 'N0CTUA_OUTBOX_CAPACITY'),
+        'outbox_ttl': Option(86400, int, (60, 30 * 86400), 'N0CTUA_OUTBOX_TTL'),
+        # Bounded by IOV_MAX
+        'outbox_batch': Option(256, int, (1, 1024), 'N0CTUA_OUTBOX_BATCH', True)
+    },
+    'pipeline': {
+        # Worker threads of the stages before the handlers; each handler sets its own
+        'decode_workers': Option(1, int, (1, 64), 'N0CTUA_PIPELINE_DECODE_WORKERS'),
+        'dispatch_workers': Option(1, int, (1, 64), 'N0CTUA_PIPELINE_DISPATCH_WORKERS'),
+        # Messages waiting per worker of the dispatch and handler stages
+        'queue_size': Option(1024, int, (1, 1000000), 'N0CTUA_PIPELINE_QUEUE_SIZE'),
+        'batch_size': Option(64, int, (1, 4096), 'N0CTUA_PIPELINE_BATCH_SIZE'),
+        # Loads the handlers installed under the n0ctua.handlers entry point group
+        'plugins': Option(1, int, (0, 1), 'N0CTUA_PIPELINE_PLUGINS'),
+        # Further handler factories, as comma-separated module:attribute references
+        'handlers': Option('', str, None, 'N0CTUA_PIPELINE_HANDLERS')
+    }
 }
 
 
-def get_session_config() -> Dict[str, Any]:
+class Settings:
     """
-    Retrieves session configuration with environment variable overrides.
-
-    Environment Variables:
-        N0CTUA_TOKEN_LIFETIME: Override token lifetime
-        N0CTUA_NOTIFICATION_WINDOW: Override notification window
-        N0CTUA_MAX_QUEUE_SIZE: Override maximum queue size
-        N0CTUA_MAX_QUEUE_AGE: Override maximum queue message age
-        N0CTUA_ROTATION_INTERVAL: Override session rotation interval
+    The node configuration, parsed once from defaults, a config file, environment
+    variables and command line overrides, in increasing order of precedence.
 
-    Returns:
-        Dict containing the session configuration
+    Each section is a plain dict that components keep a reference to, so reload()
+    can change reloadable keys in place while connections stay up. Invalid values
+    raise ValueError instead of being replaced by defaults.
     """
-    config = SESSION_CONFIG.copy()
-
-    # Map environment variables to configuration keys
-    env_mappings = {
-        'N0CTUA_TOKEN_LIFETIME': ('token_lifetime', int),
-        'N0CTUA_NOTIFICATION_WINDOW': ('notification_window', int),
-        'N0CTUA_MAX_QUEUE_SIZE': ('max_queue_size', int),
-        'N0CTUA_MAX_QUEUE_AGE': ('max_queue_age', int),
-        'N0CTUA_ROTATION_INTERVAL': ('rotation_interval', int)
-    }
 
-    # Apply environment overrides
-    for env_var, (config_key, type_cast) in env_mappings.items():
-        if env_var in os.environ:
+    def __init__(self, path: Optional[str] = None, overrides: Optional[Dict[str, Any]] = None):
+        self.path = _path(path or os.environ.get('N0CTUA_CONFIG', DEFAULT_CONFIG_PATH))
+        self.overrides = dict(overrides or {})
+        self.lock = threading.Lock()
+        values = self._read()
+        self.session: Dict[str, Any] = values['session']
+        self.network: Dict[str, Any] = values['network']
+        self.storage: Dict[str, Any] = values['storage']
+        self.pipeline: Dict[str, Any] = values['pipeline']
+
+    def section(self, name: str) -> Dict[str, Any]:
+        return getattr(self, name)
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        raw = {section: {key: (option.default, 'default') for key, option in options.items()}
+               for section, options in SCHEMA.items()}
+
+        if os.path.exists(self.path):
+            parser = configparser.ConfigParser()
             try:
-                config[config_key] = type_cast(os.environ[env_var])
-            except ValueError as e:
-                print(f"Warning: Invalid value for {env_var}: {e}")
-
-    return config
-
-
-# Optional: Configuration validation
-def validate_config(config: Dict[str, Any]) -> bool:
-    """
-    Validates the session configuration values.
-
-    Args:
-        config: Configuration dictionary to validate
-
-    Returns:
-        bool: True if configuration is valid
-
-    Raises:
-        ValueError: If any configuration value is invalid
-    """
-    # Validate token lifetime
-    if config['token_lifetime'] < 5 or config['token_lifetime'] > 300:
-        raise ValueError("token_lifetime must be between 5 and 300 seconds")
-
-    # Validate notification window
-    if config['notification_window'] < 5 or config['notification_window'] > 60:
-        raise ValueError("notification_window must be between 5 and 60 seconds")
-
-    # Validate queue size
-    if config['max_queue_size'] < 10 or config['max_queue_size'] > 1000:
-        raise ValueError("max_queue_size must be between 10 and 1000 messages")
-
-    # Validate queue age
-    if config['max_queue_age'] < 10 or config['max_queue_age'] > 300:
-        raise ValueError("max_queue_age must be between 10 and 300 seconds")
-
-    # Validate rotation interval
-    if config['rotation_interval'] < 300 or config['rotation_interval'] > 7200:
-        raise ValueError("rotation_interval must be between 300 and 7200 seconds")
-
-    return True
-
-
-# Usage example
-def initialize_session_config() -> Dict[str, Any]:
-    """
-    Initializes and validates session configuration.
-
-    Returns:
-        Dict containing validated session configuration
-
-    Raises:
-        ValueError: If configuration validation fails
-    """
-    config = get_session_config()
-    if validate_config(config):
-        return config
\ No newline at end of file
+                parser.read(self.path)
+            except configparser.Error as e:
+                raise ValueError(f"Cannot parse {self.path}: {e}")
+            for section in parser.sections():
+                for key, value in parser.items(section):
+                    raw.setdefault(section, {})[key] = (value, self.path)
+
+        for section, options in SCHEMA.items():
+            for key, option in options.items():
+                if option.env and option.env in os.environ:
+                    raw[section][key] = (os.environ[option.env], option.env)
+
+        for name, value in self.overrides.items():
+            section, _, key = name.partition('.')
+            raw.setdefault(section, {})[key] = (value, 'command line')
+
+        errors = []
+        values: Dict[str, Dict[str, Any]] = {}
+        for section, entries in raw.items():
+            options = SCHEMA.get(section)
+            if options is None:
+                errors.append(f"Unknown section [{section}]")
+                continue
+            values[section] = {}
+            for key, (value, source) in entries.items():
+                option = options.get(key)
+                if option is None:
+                    errors.append(f"Unknown setting {section}.{key} ({source})")
+                    continue
+                try:
+                    value = option.type(value)
+                except (TypeError, ValueError):
+                    errors.append(f"Invalid {section}.{key}: {value!r} ({source})")
+                    continue
+                if option.bounds and not (option.bounds[0] <= value <= option.bounds[1]):
+                    errors.append(
+                        f"Invalid {section}.{key}: {value} ({source}). "
+                        f"Must be between {option.bounds[0]} and {option.bounds[1]}"
+                    )
+                    continue
+                if option.choices and value not in option.choices:
+                    errors.append(
+                        f"Invalid {section}.{key}: {value} ({source}). "
+                        f"Must be one of {', '.join(option.choices)}"
+                    )
+                    continue
+                values[section][key] = value
+
+        if errors:
+            raise ValueError("; ".join(errors))
+        return values
+
+    def reload(self) -> Tuple[List[str], List[str]]:
+        """
+        Re-reads the file and environment, keeping command line overrides.
+        Returns the keys that changed and the ones that need a restart to apply.
+        """
+        values = self._read()
+        changed, pending = [], []
+        with self.lock:
+            for section, options in SCHEMA.items():
+                current = self.section(section)
+                for key, option in options.items():
+                    value = values[section][key]
+                    if value == current[key]:
+                        continue
+                    if option.reloadable:
+                        current[key] = value
+                        changed.append(f"{section}.{key}")
+                    else:
+                        pending.append(f"{section}.{key}")
+        return changed, pending
+
+
+_settings: Optional[Settings] = None
+_settings_lock = threading.Lock()
+
+
+def load_settings(path: Optional[str] = None, overrides: Optional[Dict[str, Any]] = None) -> Settings:
+    """Parses the configuration and caches it for get_settings()"""
+    global _settings
+    settings = Settings(path, overrides)
+    with _settings_lock:
+        _settings = settings
+    return settings
+
+
+def get_settings() -> Settings:
+    """Returns the cached configuration, loading the defaults on first use"""
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings = Settings()
+        return _settings
+
+
+def parse_overrides(args: List[str]) -> Dict[str, str]:
+    """Collects --set=section.key=value command line arguments"""
+    overrides = {}
+    for arg in args:
+        if arg.startswith('--set='):
+            name, sep, value = arg[len('--set='):].partition('=')
+            if not sep or '.' not in name:
+                raise ValueError(f"Expected --set=section.key=value, got {arg}")
+            overrides[name] = value
+    return overrides
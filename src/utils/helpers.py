@@ -1,6 +1,7 @@
 import os
 import socket
 import secrets
+from datetime import date, datetime, timedelta
 
 def clear_screen():
     """Clears the terminal screen"""
@@ -14,17 +15,97 @@ def find_available_port():
     temp_socket.close()
     return port
 
+def _route_source(family, destination):
+    probe = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        probe.connect((destination, 9))
+        return probe.getsockname()[0]
+    except OSError:
+        return None
+    finally:
+        probe.close()
+
+def discover_host_addresses(bind_address=''):
+    """
+    Returns the addresses peers should use to reach this node, IPv6 first. A UDP
+    socket is "connected" to a documentation address only so the kernel picks
+    the outgoing interface from its routing table: no packet is sent and no DNS
+    is queried.
+    """
+    if bind_address not in ('', '0.0.0.0', '::'):
+        return [bind_address]
+
+    addresses = []
+    if bind_address != '0.0.0.0' and socket.has_ipv6:
+        address = _route_source(socket.AF_INET6, '2001:db8::1')
+        # Link-local addresses need a scope id and are useless to remote peers
+        if address and not address.lower().startswith('fe80'):
+            addresses.append(address)
+    if bind_address != '::' or socket.has_dualstack_ipv6():
+        addresses.append(_route_source(socket.AF_INET, '192.0.2.1') or '127.0.0.1')
+    return addresses
+
+def normalize_address(address):
+    """Reduces a socket address to (host, port), unwrapping IPv4-mapped IPv6 hosts"""
+    host, port = address[0], address[1]
+    if host.startswith('::ffff:') and '.' in host:
+        host = host[len('::ffff:'):]
+    return host, port
+
 def generate_id(prefix="Peer"):
     """Generates a unique ID for the peer"""
     return f"{prefix}_{secrets.token_hex(2)}"
 
+def format_address(host, port):
+    return f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+
+def format_connection_string(addresses, port, secret):
+    """Builds addr:port[,addr:port...]:secret, bracketing IPv6 literals"""
+    return ','.join(format_address(host, port) for host in addresses) + f":{secret}"
+
 def parse_connection_string(conn_str):
-    """Parses the connection string in the format ip:port:secret"""
+    """
+    Parses addr:port[,addr:port...]:secret into a list of (host, port)
+    candidates and the secret. IPv6 literals are written in brackets.
+    """
+    addresses, _, secret = conn_str.strip().rpartition(':')
+    if not addresses or not secret:
+        raise ValueError("Invalid format. Use: ip:port:secret")
+
+    candidates = []
+    for address in addresses.split(','):
+        address = address.strip()
+        if address.startswith('['):
+            host, sep, port = address[1:].partition(']:')
+        else:
+            host, sep, port = address.rpartition(':')
+        if (not sep or not host or not port.isdigit() or not 0 < int(port) < 65536
+                or (':' in host and not address.startswith('['))):
+            raise ValueError(f"Invalid address {address}. Use ip:port or [ipv6]:port")
+        candidates.append((host, int(port)))
+
+    return candidates, secret.strip()
+
+def parse_duration(value):
+    """Parses a duration such as 45s, 30m, 2h or 1d (plain numbers are seconds)"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    value = value.strip().lower()
+    if value.isdigit():
+        return int(value)
+    if value[-1:] in units and value[:-1].isdigit():
+        return int(value[:-1]) * units[value[-1]]
+    raise ValueError(f"Invalid duration: {value}")
+
+def parse_since(value):
+    """Parses a history start time: 30m, 2h, 1d, HH:MM or an ISO date/time"""
+    value = value.strip()
+    if value[-1:].lower() in 'smhd' and value[:-1].isdigit():
+        return datetime.now() - timedelta(seconds=parse_duration(value))
+
     try:
-        if conn_str.count(':') != 2:
-            raise ValueError("Invalid format. Use: ip:port:secret")
+        parsed = datetime.strptime(value, "%H:%M")
+        return datetime.combine(date.today(), parsed.time())
+    except ValueError:
+        pass
 
-        host, port, secret = conn_str.split(':')
-        return host.strip(), int(port.strip()), secret.strip()
-    except Exception as e:
-        return None, None, None
+    return datetime.fromisoformat(value)
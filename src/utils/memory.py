@@ -0,0 +1,83 @@
+import os
+import sys
+from collections import deque
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Dict, Optional, Tuple
+
+# Shared by the whole process, so never charged to one connection
+_SHARED = (type, ModuleType, FunctionType)
+# Counted, but not followed to the object they are bound to
+_SHALLOW = (MethodType, BuiltinFunctionType, str, bytes, bytearray, memoryview, int, float)
+
+COMPONENTS = ('record', 'socket', 'stream', 'session', 'aead', 'group keys', 'datagram')
+
+
+def deep_sizeof(obj, seen: Optional[set] = None) -> int:
+    """
+    Bytes held by obj and the objects it references, following containers,
+    instance dicts and __slots__. Objects whose id is in seen are skipped, so
+    sizing several components with one set never counts an object twice.
+    Memory outside the Python heap, such as kernel socket buffers or the
+    OpenSSL state behind an AEAD object, is not visible here.
+    """
+    seen = set() if seen is None else seen
+    size = 0
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            pending.extend(obj)
+        elif not isinstance(obj, _SHALLOW):
+            if hasattr(obj, '__dict__'):
+                pending.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for name in getattr(cls, '__slots__', ()):
+                    if name not in ('__dict__', '__weakref__') and hasattr(obj, name):
+                        pending.append(getattr(obj, name))
+    return size
+
+
+def process_rss() -> Optional[int]:
+    """Resident set size of this process in bytes, where /proc exposes it"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def connection_footprint(peer) -> Tuple[int, Dict[str, int]]:
+    """
+    Returns the number of connected peers and the bytes their per-connection
+    state holds, by component. Each component is sized before the record that
+    refers to it, so the record only counts what no component owns.
+    """
+    records = peer.peers.snapshot()
+    sessions = peer.session_manager.sessions
+    group_keys = peer.network.group_keys
+    datagram = peer.datagram
+    totals = dict.fromkeys(COMPONENTS, 0)
+    seen = set()
+
+    for record in records:
+        # The socket object only; its buffers live in the kernel
+        seen.add(id(record.socket))
+        totals['socket'] += sys.getsizeof(record.socket)
+        totals['aead'] += deep_sizeof(record.aes_gcm, seen) + deep_sizeof(record.ratchet, seen)
+        totals['stream'] += deep_sizeof(record.stream, seen)
+        session = sessions.get(record.session_id)
+        if session is not None:
+            totals['session'] += deep_sizeof(session, seen)
+        totals['group keys'] += deep_sizeof(group_keys.keys_for(record.socket), seen)
+        if datagram is not None:
+            totals['datagram'] += deep_sizeof(datagram.paths.get(record.socket), seen)
+        totals['record'] += deep_sizeof(record, seen)
+    return len(records), totals
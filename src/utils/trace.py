@@ -0,0 +1,23 @@
+import time
+from typing import List, Optional, Tuple
+
+
+class StartupTrace:
+    """Timestamps of startup milestones, reported once the first peer is accepted"""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self.marks: List[Tuple[str, float]] = []
+        self.reported = False
+
+    def mark(self, name: str) -> None:
+        self.marks.append((name, time.perf_counter()))
+
+    def report(self) -> str:
+        lines = ["[*] Startup trace:"]
+        previous = self.started
+        for name, at in self.marks:
+            lines.append(f"    {name:<20} {(at - self.started) * 1000:8.1f} ms  (+{(at - previous) * 1000:.1f})")
+            previous = at
+        self.reported = True
+        return '\n'.join(lines)
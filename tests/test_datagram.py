@@ -0,0 +1,85 @@
+import os
+import socket
+import time
+import unittest
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from src.crypto import CryptoManager
+from src.transport.datagram import ACK_BODY, PACKET_ACK, PACKET_DATA, PACKET_HEADER, DatagramTransport
+
+
+class AddressTest(unittest.TestCase):
+    """
+    A path follows its peer to a new address, but only on the newest data
+    packet: an attacker who captured a datagram and resends it from elsewhere
+    must not redirect what the node sends.
+    """
+
+    def setUp(self):
+        self.aes_gcm = AESGCM(os.urandom(32))
+        self.received = []
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        self.transport = DatagramTransport(sock, lambda key, kind, payload: self.received.append(payload),
+                                           lambda *args: None)
+        self.local_id = self.transport.open_path('peer', self.aes_gcm)
+        self.peer = self.endpoint()
+        self.attacker = self.endpoint()
+        self.transport.bind_remote('peer', self.aes_gcm, os.urandom(8), *self.peer.getsockname())
+        self.path = self.transport.paths['peer']
+
+    def tearDown(self):
+        self.transport.close()
+        self.peer.close()
+        self.attacker.close()
+
+    def endpoint(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        return sock
+
+    def packet(self, packet_type, number, body):
+        header = PACKET_HEADER.pack(self.local_id, packet_type, number)
+        return header + CryptoManager.encrypt_bytes(self.aes_gcm, body, header)
+
+    def deliver(self, sock, packet, until):
+        sock.sendto(packet, ('127.0.0.1', self.transport.port))
+        deadline = time.monotonic() + 5
+        while not until() and time.monotonic() < deadline:
+            time.sleep(0.005)
+        self.assertTrue(until(), "the packet was not handled")
+
+    def test_replayed_packet_keeps_address(self):
+        stats = self.path.stats
+        first = self.packet(PACKET_DATA, 1, b'\x00one')
+        self.deliver(self.peer, first, lambda: stats['received'] == 1)
+        self.deliver(self.peer, self.packet(PACKET_DATA, 3, b'\x00three'), lambda: stats['received'] == 2)
+        self.assertEqual(self.path.remote_addr, self.peer.getsockname())
+
+        self.deliver(self.attacker, first, lambda: stats['duplicates'] == 1)
+        self.assertEqual(self.path.remote_addr, self.peer.getsockname())
+
+        # Fresh, but older than one already received, as a delayed packet would be
+        self.deliver(self.attacker, self.packet(PACKET_DATA, 2, b'\x00two'), lambda: stats['received'] == 3)
+        self.assertEqual(self.path.remote_addr, self.peer.getsockname())
+
+        # Acknowledgements are not numbered, so a replayed one cannot be told apart
+        self.attacker.sendto(self.packet(PACKET_ACK, 0, ACK_BODY.pack(0, 0, 0, 0)), ('127.0.0.1', self.transport.port))
+        self.deliver(self.attacker, first, lambda: stats['duplicates'] == 2)
+        self.assertEqual(self.path.remote_addr, self.peer.getsockname())
+        self.assertEqual(self.received, [b'one', b'three', b'two'])
+
+    def test_newest_packet_moves_path(self):
+        stats = self.path.stats
+        self.deliver(self.peer, self.packet(PACKET_DATA, 1, b'\x00one'), lambda: stats['received'] == 1)
+        moved = self.endpoint()
+        try:
+            self.deliver(moved, self.packet(PACKET_DATA, 2, b'\x00two'), lambda: stats['received'] == 2)
+            self.assertEqual(self.path.remote_addr, moved.getsockname())
+        finally:
+            moved.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import socket
+import time
+import unittest
+
+from src.admission import HandshakeDeadline
+from src.dialer import dial, resolve_candidates
+from src.utils.helpers import parse_connection_string
+
+
+class ParseConnectionStringTest(unittest.TestCase):
+
+    def test_single_address(self):
+        self.assertEqual(parse_connection_string('192.168.1.5:8080:secret'), ([('192.168.1.5', 8080)], 'secret'))
+
+    def test_bracketed_ipv6(self):
+        self.assertEqual(parse_connection_string('[::1]:8080:secret'), ([('::1', 8080)], 'secret'))
+        self.assertEqual(parse_connection_string(' [fe80::1%eth0]:9000:key.part \n'),
+                         ([('fe80::1%eth0', 9000)], 'key.part'))
+
+    def test_multiple_addresses(self):
+        candidates, secret = parse_connection_string('[2001:db8::7]:8080, 203.0.113.9:8080,host.example:9000:s')
+        self.assertEqual(candidates, [('2001:db8::7', 8080), ('203.0.113.9', 8080), ('host.example', 9000)])
+        self.assertEqual(secret, 's')
+
+    def test_malformed(self):
+        for conn_str in ('127.0.0.1:secret', '127.0.0.1:port:secret', '127.0.0.1::secret', '127.0.0.1:-1:secret',
+                         '127.0.0.1:0:secret', '127.0.0.1:65536:secret', '::1:8080:secret', '[::1]8080:secret',
+                         '[::1]:80:81:secret', ':8080:secret', '127.0.0.1:8080,:secret', '127.0.0.1:8080:', ''):
+            with self.subTest(conn_str=conn_str), self.assertRaises(ValueError):
+                parse_connection_string(conn_str)
+
+
+class DialTest(unittest.TestCase):
+    """The dialer races candidates, so a dead address costs little"""
+
+    def setUp(self):
+        self.sockets = []
+        self.listener = self.listen()
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+    def listen(self, family=socket.AF_INET, host='127.0.0.1', backlog=8):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sockets.append(sock)
+        sock.bind((host, 0))
+        sock.listen(backlog)
+        return sock
+
+    def closed_port(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def dial(self, candidates, timeout=5, attempt_delay=0.25):
+        started = time.monotonic()
+        sock = dial(candidates, HandshakeDeadline(timeout), attempt_delay=attempt_delay)
+        self.sockets.append(sock)
+        return sock, time.monotonic() - started
+
+    def test_falls_back_when_first_refuses(self):
+        port = self.listener.getsockname()[1]
+        sock, elapsed = self.dial([('127.0.0.1', self.closed_port()), ('127.0.0.1', port)], attempt_delay=2)
+        self.assertEqual(sock.getpeername()[1], port)
+        self.assertTrue(sock.getblocking())
+        # A refused attempt starts the next one without waiting out the delay
+        self.assertLess(elapsed, 1)
+
+    def test_races_past_an_address_that_never_answers(self):
+        # A full backlog drops further SYNs, as a blackholed address would
+        silent = self.listen(backlog=0)
+        for _ in range(4):
+            filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sockets.append(filler)
+            filler.setblocking(False)
+            filler.connect_ex(silent.getsockname())
+        time.sleep(0.1)
+
+        port = self.listener.getsockname()[1]
+        sock, elapsed = self.dial([silent.getsockname(), ('127.0.0.1', port)], attempt_delay=0.2)
+        self.assertEqual(sock.getpeername()[1], port)
+        self.assertGreaterEqual(elapsed, 0.15)
+        self.assertLess(elapsed, 2)
+
+    def test_all_fail(self):
+        with self.assertRaises(OSError):
+            self.dial([('127.0.0.1', self.closed_port()), ('127.0.0.1', self.closed_port())])
+        with self.assertRaises(OSError):
+            self.dial([('host.invalid', 8080)])
+
+    def test_families_alternate(self):
+        try:
+            v6 = self.listen(socket.AF_INET6, '::1')
+        except OSError:
+            self.skipTest("No IPv6 loopback")
+        v4_port, v6_port = self.listener.getsockname()[1], v6.getsockname()[1]
+        ordered = resolve_candidates([('127.0.0.1', v4_port), ('127.0.0.1', v4_port + 1), ('::1', v6_port)])
+        self.assertEqual([(family, sockaddr[1]) for family, sockaddr in ordered],
+                         [(socket.AF_INET6, v6_port), (socket.AF_INET, v4_port), (socket.AF_INET, v4_port + 1)])
+
+        sock, _ = self.dial([('::1', v6_port)])
+        self.assertEqual(sock.family, socket.AF_INET6)
+
+
+if __name__ == '__main__':
+    unittest.main()
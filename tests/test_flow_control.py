@@ -0,0 +1,176 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+
+from src.peer import SecurePeer
+from src.pipeline import Handler
+from src.utils.config import Settings
+
+MESSAGES = 200
+MESSAGE_SIZE = 60 * 1024
+
+
+class Recorder(Handler):
+    """Keeps the text of every message a node receives, in order"""
+    name = 'recorder'
+
+    def __init__(self, peer):
+        self.peer = peer
+        peer.received = []
+
+    def handle(self, messages):
+        self.peer.received.extend(message.text for message in messages)
+
+
+class BothWaysTest(unittest.TestCase):
+    """
+    Two nodes with socket buffers far smaller than a frame, sending to each other
+    at once while their sessions keep rotating. Every writer spends most of its
+    time blocked in the socket, so a receive thread that waits on one, for an
+    acknowledgement, a control reply or a key change, stops both sides for good.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.peers = [self.start_peer('Alice'), self.start_peer('Bob')]
+        alice, bob = self.peers
+        bob.connect_to_peer(alice.connection_string(alice.secret))
+        deadline = time.monotonic() + 10
+        while not (len(alice.peers) and len(bob.peers)) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(len(alice.peers) and len(bob.peers), "nodes did not connect")
+
+    def tearDown(self):
+        for peer in self.peers:
+            peer.running = False
+            for record in peer.peers.snapshot():
+                peer.remove_peer(record.socket)
+            peer.listen_socket.close()
+            peer.admission.shutdown()
+            peer.crypto_pool.shutdown()
+            peer.pipeline.close()
+        self.directory.cleanup()
+
+    def start_peer(self, peer_id):
+        settings = Settings(path=os.path.join(self.directory.name, 'missing.conf'), overrides={
+            'network.bind_address': '127.0.0.1',
+            'network.socket_sndbuf': 8192,
+            'network.socket_rcvbuf': 8192,
+            'storage.history_enabled': 0,
+            'storage.outbox_enabled': 0,
+            'pipeline.plugins': 0,
+            'pipeline.handlers': f'{__name__}:Recorder'
+        })
+        peer = SecurePeer(peer_id=peer_id, settings=settings)
+        peer.print_message = lambda *args, **kwargs: None
+        threading.Thread(target=peer.start_listening, daemon=True).start()
+        return peer
+
+    def age_sessions(self, stop):
+        # Every session looks due for rotation, as if session.rotation_interval had passed
+        while not stop.wait(0.01):
+            for peer in self.peers:
+                with peer.session_manager.lock:
+                    for session in peer.session_manager.sessions.values():
+                        session.created_at -= timedelta(seconds=peer.session_manager.config['rotation_interval'])
+
+    def test_large_frames_both_ways_while_rotating(self):
+        stop = threading.Event()
+        threading.Thread(target=self.age_sessions, args=(stop,), daemon=True).start()
+        body = 'x' * MESSAGE_SIZE
+
+        def send(peer, tag):
+            record = peer.peers.snapshot()[0]
+            for i in range(MESSAGES):
+                peer.network.send_encrypted_message(record.socket, f"{tag}{i}:{body}", record.aes_gcm)
+
+        senders = [threading.Thread(target=send, args=(peer, peer.peer_id), daemon=True) for peer in self.peers]
+        for sender in senders:
+            sender.start()
+        deadline = time.monotonic() + 60
+        alice, bob = self.peers
+        while (len(alice.received) < MESSAGES or len(bob.received) < MESSAGES) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stop.set()
+
+        for peer, other in ((alice, bob), (bob, alice)):
+            self.assertEqual(len(peer.received), MESSAGES, f"{peer.peer_id} stopped receiving")
+            self.assertEqual([text.partition(':')[0] for text in peer.received],
+                             [f"{other.peer_id}{i}" for i in range(MESSAGES)])
+        self.assertGreater(alice.session_manager.rotations + bob.session_manager.rotations, 0)
+
+
+class StalledReaderTest(unittest.TestCase):
+    """
+    One service thread writes acknowledgements and queued frames for every
+    connection of a node, so a peer that stops reading, with credit still
+    left, must not stop it serving the others.
+    """
+    start_peer = BothWaysTest.start_peer
+    tearDown = BothWaysTest.tearDown
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.peers = [self.start_peer('Alice'), self.start_peer('Bob'), self.start_peer('Carol')]
+        alice, bob, carol = self.peers
+        for peer in (bob, carol):
+            peer.connect_to_peer(alice.connection_string(alice.secret))
+        deadline = time.monotonic() + 10
+        while len(alice.peers) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(alice.peers), 2, "nodes did not connect")
+        self.reading = threading.Event()
+
+    def tearDown(self):
+        self.reading.set()
+        BothWaysTest.tearDown(self)
+
+    def stall(self, peer):
+        # The receive thread waits before each read, once it is done with the current one
+        read = peer.network.recv_into_exact
+
+        def stalled(*args):
+            self.reading.wait()
+            return read(*args)
+        peer.network.recv_into_exact = stalled
+
+    def test_stalled_peer_does_not_hold_up_others(self):
+        alice, bob, carol = self.peers
+        self.stall(bob)
+        to_bob = alice.peers.get_by_peer_id('Bob')
+        alice.network.send_encrypted_message(to_bob.socket, 'wake', to_bob.aes_gcm)
+        # Control frames go out on the service thread, far more than Bob's socket buffers hold
+        for _ in range(16):
+            alice.network.queue_control(to_bob, {'type': 'padding', 'data': 'x' * MESSAGE_SIZE})
+        time.sleep(0.2)
+
+        # Carol sends several flow windows, which takes Alice's acknowledgements
+        body = 'x' * MESSAGE_SIZE
+        record = carol.peers.snapshot()[0]
+        sender = threading.Thread(target=lambda: [
+            carol.network.send_encrypted_message(record.socket, f"Carol{i}:{body}", record.aes_gcm)
+            for i in range(MESSAGES)], daemon=True)
+        sender.start()
+        sender.join(30)
+        self.assertFalse(sender.is_alive(), "Carol ran out of credit")
+        deadline = time.monotonic() + 10
+        while len(alice.received) < MESSAGES and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual([text.partition(':')[0] for text in alice.received], [f"Carol{i}" for i in range(MESSAGES)])
+
+        # What the service thread could not write reaches Bob once he reads again, in order
+        self.reading.set()
+        deadline = time.monotonic() + 10
+        stats = alice.network.stream_stats(to_bob)
+        while (stats['queued'] or stats['acked'] < stats['sent']) and time.monotonic() < deadline:
+            time.sleep(0.05)
+            stats = alice.network.stream_stats(to_bob)
+        self.assertEqual((stats['queued'], stats['acked']), (0, stats['sent']))
+        self.assertEqual(bob.received, ['wake'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import unittest
+
+from src.group_keys import GroupKeyManager
+
+
+class SenderKeyTest(unittest.TestCase):
+    """Each room is sealed with its own key, which members who leave do not keep"""
+
+    def setUp(self):
+        self.now = 0.0
+        self.keys = GroupKeyManager(60, clock=lambda: self.now)
+
+    def hand_over(self, key, *sockets):
+        for socket in sockets:
+            self.keys.mark_sent(key, socket)
+
+    def test_rooms_do_not_share_keys(self):
+        broadcast = self.keys.current()
+        self.hand_over(broadcast, 'alice', 'bob', 'carol')
+        room = self.keys.current('team', {'alice', 'bob'})
+        self.assertIsNot(room, broadcast)
+        self.assertIsNot(self.keys.current('other', {'alice'}), room)
+        self.assertTrue(self.keys.needs_key(room, 'carol'))
+        self.hand_over(room, 'alice', 'bob')
+        self.assertIs(self.keys.current('team', {'alice', 'bob'}), room)
+        self.assertIs(self.keys.current(), broadcast)
+
+    def test_room_key_rotates_when_a_member_leaves(self):
+        room = self.keys.current('team', {'alice', 'bob'})
+        self.hand_over(room, 'alice', 'bob')
+        # Joining keeps the key: the new member gets it, and may read what follows
+        self.assertIs(self.keys.current('team', {'alice', 'bob', 'carol'}), room)
+        after = self.keys.current('team', {'alice'})
+        self.assertIsNot(after, room)
+        self.assertTrue(self.keys.needs_key(after, 'alice'))
+        self.assertFalse(self.keys.needs_key(room, 'bob'))
+        self.assertTrue(self.keys.needs_key(after, 'bob'))
+
+    def test_disconnect_and_interval_rotate(self):
+        broadcast = self.keys.current()
+        room = self.keys.current('team', {'alice', 'bob'})
+        self.hand_over(broadcast, 'alice', 'bob')
+        self.hand_over(room, 'alice', 'bob')
+        other = self.keys.current('other', {'carol'})
+        self.hand_over(other, 'carol')
+
+        self.keys.forget_socket('bob')
+        self.assertIsNot(self.keys.current(), broadcast)
+        self.assertIsNot(self.keys.current('team', {'alice'}), room)
+        self.assertIs(self.keys.current('other', {'carol'}), other)
+
+        self.now += 60
+        self.assertIsNot(self.keys.current('other', {'carol'}), other)
+
+    def test_received_keys_are_kept_per_room(self):
+        broadcast_ids = [1, 2]
+        for key_id in broadcast_ids:
+            self.keys.install('alice', key_id, os.urandom(32))
+        for key_id in range(10, 20):
+            self.keys.install('alice', key_id, os.urandom(32), f"room{key_id}")
+        # A room's keys do not push out those of broadcasts or of other rooms
+        for key_id in broadcast_ids + list(range(10, 20)):
+            self.assertIsNotNone(self.keys.lookup('alice', key_id))
+        self.assertIsNone(self.keys.lookup('bob', 1))
+
+        self.keys.install('alice', 3, os.urandom(32))
+        self.assertIsNone(self.keys.lookup('alice', 1))
+        self.assertIsNotNone(self.keys.lookup('alice', 2))
+
+    def test_rooms_per_peer_is_bounded(self):
+        keys = GroupKeyManager(60, rooms_per_peer=4)
+        for key_id in range(10):
+            keys.install('alice', key_id, os.urandom(32), f"room{key_id}")
+        self.assertEqual(len(keys.keys_for('alice')), 4)
+        self.assertIsNone(keys.lookup('alice', 0))
+        self.assertIsNotNone(keys.lookup('alice', 9))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import time
+import unittest
+from unittest import mock
+
+from src import invites
+from src.invites import InviteTable
+
+
+class InviteTableTest(unittest.TestCase):
+    """Invite tokens open a connection only while their invite is valid, and cost the same when they do not"""
+
+    def setUp(self):
+        self.table = InviteTable()
+
+    def test_redeem(self):
+        token = self.table.create()
+        key_id, _, secret = token.partition('.')
+        invite = self.table.invites[key_id]
+        # Only a salted digest is kept, never the secret
+        self.assertNotIn(secret.encode(), (invite.salt, invite.digest))
+        self.assertEqual(invite.digest, invites._digest(invite.salt, secret.encode()))
+
+        self.assertTrue(self.table.verify(token))
+        # Without a use limit the invite stays
+        self.assertTrue(self.table.verify(token))
+        self.assertEqual(len(self.table), 1)
+
+    def test_expired(self):
+        token = self.table.create(ttl=60)
+        key_id = token.partition('.')[0]
+        with mock.patch.object(invites.time, 'time', return_value=time.time() + 61):
+            self.assertFalse(self.table.verify(token))
+        self.assertNotIn(key_id, self.table.invites)
+        self.assertFalse(self.table.verify(token))
+
+    def test_purge_expired(self):
+        self.table.create(ttl=60)
+        kept = self.table.create()
+        with mock.patch.object(invites.time, 'time', return_value=time.time() + 61):
+            self.assertEqual(self.table.purge_expired(), 1)
+        self.assertEqual([invite.key_id for invite in self.table.list()], [kept.partition('.')[0]])
+
+    def test_exhausted(self):
+        token = self.table.create(max_uses=2)
+        self.assertTrue(self.table.verify(token))
+        self.assertEqual(self.table.invites[token.partition('.')[0]].uses_left, 1)
+        self.assertTrue(self.table.verify(token))
+        self.assertEqual(len(self.table), 0)
+        self.assertFalse(self.table.verify(token))
+
+    def test_wrong_secret_uses_nothing(self):
+        token = self.table.create(max_uses=1)
+        key_id, _, secret = token.partition('.')
+        self.assertFalse(self.table.verify(f"{key_id}.{'A' * len(secret)}"))
+        self.assertFalse(self.table.verify(key_id))
+        self.assertEqual(self.table.invites[key_id].uses_left, 1)
+        self.assertTrue(self.table.verify(token))
+
+    def test_unknown_key_id_checks_the_decoy(self):
+        token = self.table.create()
+        secret = token.partition('.')[2]
+        with mock.patch.object(invites, '_digest', wraps=invites._digest) as digest:
+            self.assertFalse(self.table.verify(f"00000000.{secret}"))
+            self.assertFalse(self.table.verify(''))
+        # A digest is computed either way, with the decoy's salt, so the miss takes as long as a hit
+        self.assertEqual([call.args[0] for call in digest.call_args_list], [self.table._decoy.salt] * 2)
+        self.assertEqual(len(self.table), 1)
+        self.assertNotIn(self.table._decoy.key_id, self.table.invites)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import unittest
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from src.crypto import CryptoManager
+from src.session import KeyRatchet, SessionRotationError, derive_key
+from src.session.keys import MAX_GENERATION_STEP
+
+OVERLAP = 5.0
+
+
+class KeyRatchetTest(unittest.TestCase):
+    """Both ends of a connection reach the same keys, and old ones open frames only for a while"""
+
+    def setUp(self):
+        self.key = os.urandom(32)
+        self.aes_gcm = AESGCM(self.key)
+
+    def opens(self, keys, aes_gcm):
+        # Whether a frame sealed with aes_gcm opens with one of keys
+        sealed = CryptoManager.encrypt_bytes(aes_gcm, b'frame', b'header')
+        for key in keys:
+            try:
+                CryptoManager.decrypt_bytes(key, sealed, b'header')
+                return True
+            except InvalidTag:
+                pass
+        return False
+
+    def test_generations(self):
+        ratchet = KeyRatchet()
+        key, aes_gcm = self.key, self.aes_gcm
+        expected = self.key
+        for generation in range(1, 4):
+            self.assertEqual(ratchet.propose(key), generation)
+            # Proposing again before the peer confirms keeps the same key
+            self.assertEqual(ratchet.propose(key), generation)
+            self.assertTrue(self.opens(ratchet.receive_keys(aes_gcm, 0), ratchet.next_gcm))
+            key, aes_gcm = ratchet.advance(key, aes_gcm, generation, 0, OVERLAP)
+            expected = derive_key(expected, generation)
+            self.assertEqual(key, expected)
+            self.assertEqual(ratchet.generation, generation)
+            self.assertIsNone(ratchet.next_gcm)
+
+        # The peer derives the same key from the same start, without the steps in between
+        other = KeyRatchet()
+        other_key, _ = other.advance(self.key, self.aes_gcm, 3, 0, OVERLAP)
+        self.assertEqual(other_key, key)
+        self.assertNotEqual(key, self.key)
+        # A generation already reached changes nothing
+        self.assertIsNone(ratchet.advance(key, aes_gcm, 3, 0, OVERLAP))
+        self.assertIsNone(ratchet.advance(key, aes_gcm, 1, 0, OVERLAP))
+
+    def test_generation_step_bound(self):
+        ratchet = KeyRatchet()
+        with self.assertRaises(SessionRotationError):
+            ratchet.advance(self.key, self.aes_gcm, MAX_GENERATION_STEP + 1, 0, OVERLAP)
+        self.assertEqual(ratchet.generation, 0)
+
+        key, aes_gcm = ratchet.advance(self.key, self.aes_gcm, MAX_GENERATION_STEP, 0, OVERLAP)
+        self.assertEqual(ratchet.generation, MAX_GENERATION_STEP)
+        # Every key skipped over is kept for the overlap window, but no more than the bound
+        self.assertEqual(len(ratchet.previous_gcms), MAX_GENERATION_STEP)
+        self.assertTrue(self.opens(ratchet.receive_keys(aes_gcm, 1), self.aes_gcm))
+        skipped = AESGCM(derive_key(self.key, 1))
+        self.assertTrue(self.opens(ratchet.receive_keys(aes_gcm, 1), skipped))
+
+        # Within the window, the oldest key gives way to the one just replaced
+        _, aes_gcm = ratchet.advance(key, aes_gcm, MAX_GENERATION_STEP + 1, 2, OVERLAP)
+        self.assertEqual(len(ratchet.previous_gcms), MAX_GENERATION_STEP)
+        self.assertFalse(self.opens(ratchet.receive_keys(aes_gcm, 3), self.aes_gcm))
+        self.assertTrue(self.opens(ratchet.receive_keys(aes_gcm, 3), skipped))
+
+    def test_overlap_window(self):
+        ratchet = KeyRatchet()
+        key, aes_gcm = ratchet.advance(self.key, self.aes_gcm, 1, 100, OVERLAP)
+        keys = ratchet.receive_keys(aes_gcm, 100)
+        self.assertIs(keys[0], aes_gcm)
+        self.assertTrue(self.opens(keys, self.aes_gcm))
+        self.assertTrue(self.opens(ratchet.receive_keys(aes_gcm, 100 + OVERLAP - 0.01), self.aes_gcm))
+        self.assertEqual(ratchet.receive_keys(aes_gcm, 100 + OVERLAP), (aes_gcm,))
+
+        # A rotation inside the window keeps every key it still covers, newest first
+        next_key, next_gcm = ratchet.advance(key, aes_gcm, 2, 102, OVERLAP)
+        keys = ratchet.receive_keys(next_gcm, 103)
+        self.assertTrue(self.opens(keys[1:2], aes_gcm))
+        self.assertTrue(self.opens(keys, self.aes_gcm))
+        # After the window, only the current key opens frames
+        self.assertFalse(self.opens(ratchet.receive_keys(next_gcm, 102 + OVERLAP), aes_gcm))
+        self.assertTrue(self.opens(ratchet.receive_keys(next_gcm, 102 + OVERLAP), next_gcm))
+
+
+if __name__ == '__main__':
+    unittest.main()
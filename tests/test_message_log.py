@@ -0,0 +1,125 @@
+import glob
+import os
+import tempfile
+import unittest
+
+from src.storage.index import peer_hash
+from src.storage.keys import KEY_SIZE, load_or_create_key
+from src.storage.message_log import MessageLog
+
+MESSAGES = 2000
+SEGMENT_SIZE = 32 * 1024
+
+
+class RecoveryTest(unittest.TestCase):
+    """History survives a restart, with or without the index files beside the segments"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.key = os.urandom(32)
+        log = self.open()
+        for i in range(MESSAGES):
+            log.append(f"peer{i % 5}", None, f"m{i}")
+        log.flush()
+        self.last_timestamp = log._last_timestamp
+        log.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open(self):
+        return MessageLog(self.directory.name, segment_size=SEGMENT_SIZE, key=self.key)
+
+    def assertHistoryIntact(self):
+        log = self.open()
+        try:
+            expected = [f"m{i}" for i in range(MESSAGES) if i % 5 == 2]
+            self.assertEqual([record.message for record in log.history('peer2', limit=None)], expected)
+            self.assertEqual([record.message for record in log.history('peer2', limit=3)], expected[-3:])
+            self.assertGreaterEqual(log._last_timestamp, self.last_timestamp)
+            self.assertEqual(log.append('peer2', None, 'next'), MESSAGES + 1)
+        finally:
+            log.close()
+
+    def test_reopen(self):
+        self.assertGreater(len(glob.glob(os.path.join(self.directory.name, '*.pix'))), 1)
+        self.assertHistoryIntact()
+
+    def test_sealed_indexes_lost(self):
+        for path in glob.glob(os.path.join(self.directory.name, '00000000.*')):
+            if not path.endswith('.log'):
+                os.remove(path)
+        self.assertHistoryIntact()
+
+    def test_active_index_lost(self):
+        os.remove(sorted(glob.glob(os.path.join(self.directory.name, '*.idx')))[-1])
+        self.assertHistoryIntact()
+
+
+class HashCollisionTest(unittest.TestCase):
+    """The index buckets peers by a 32-bit hash, so peers sharing one must not shorten each other's history"""
+    peer, other = 'peer396', 'peer9575040'
+
+    def setUp(self):
+        self.assertEqual(peer_hash(self.peer), peer_hash(self.other))
+        self.directory = tempfile.TemporaryDirectory()
+        self.log = MessageLog(self.directory.name, segment_size=SEGMENT_SIZE, key=os.urandom(32))
+
+    def tearDown(self):
+        self.log.close()
+        self.directory.cleanup()
+
+    def test_limit_looks_past_collisions(self):
+        for i in range(10):
+            self.log.append(self.peer, None, f"m{i}")
+        # The newest entries in the bucket are all the other peer's
+        for i in range(300):
+            self.log.append(self.other, None, f"o{i}")
+        self.log.flush()
+
+        self.assertEqual([record.message for record in self.log.history(self.peer, limit=3)], ['m7', 'm8', 'm9'])
+        self.assertEqual(len(self.log.history(self.peer, limit=50)), 10)
+        self.assertEqual(len(self.log.history(self.peer, limit=None)), 10)
+        self.assertEqual([record.message for record in self.log.history(self.other, limit=2)], ['o298', 'o299'])
+
+
+class KeyFileTest(unittest.TestCase):
+    """The storage key file is either missing or whole, so a crash while creating it cannot lock the log"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'history.key')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_create_and_load(self):
+        key = load_or_create_key(self.path)
+        self.assertEqual(len(key), KEY_SIZE)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(load_or_create_key(self.path), key)
+        self.assertEqual(os.listdir(self.directory.name), ['history.key'])
+
+    def test_empty_file_from_crash(self):
+        open(self.path, 'wb').close()
+        key = load_or_create_key(self.path)
+        self.assertEqual(len(key), KEY_SIZE)
+        self.assertEqual(load_or_create_key(self.path), key)
+
+    def test_temporary_file_from_crash(self):
+        # A crash before the link leaves only the temporary file, which the next start overwrites
+        with open(f"{self.path}.{os.getpid()}.tmp", 'wb') as partial:
+            partial.write(b'partial')
+        key = load_or_create_key(self.path)
+        self.assertEqual(load_or_create_key(self.path), key)
+        self.assertEqual(os.listdir(self.directory.name), ['history.key'])
+
+    def test_invalid_key(self):
+        with open(self.path, 'wb') as key_file:
+            key_file.write(b'short')
+        with self.assertRaises(ValueError):
+            load_or_create_key(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import tempfile
+import unittest
+
+from src.storage.exceptions import StorageError
+from src.storage.outbox import MAX_PEER_ID, Outbox
+
+
+class OutboxTest(unittest.TestCase):
+    """Rings keep their peer id and the inbound sequence across a reopen"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.outbox = Outbox(self.directory.name)
+
+    def tearDown(self):
+        self.outbox.close()
+        self.directory.cleanup()
+
+    def reopen(self):
+        self.outbox.close()
+        self.outbox = Outbox(self.directory.name)
+
+    def test_long_multibyte_id_kept_whole(self):
+        peer_id = 'é' * (MAX_PEER_ID // 2)
+        self.outbox.remember(peer_id).put('hello')
+        self.reopen()
+        self.assertEqual(self.outbox.known_peers(), [peer_id])
+        records, _ = self.outbox.get(peer_id).read(None, 10, 3600)
+        self.assertEqual([message for _, _, message in records], ['hello'])
+
+    def test_id_too_long_rejected(self):
+        with self.assertRaises(StorageError):
+            self.outbox.remember('x' * (MAX_PEER_ID + 1))
+        self.assertEqual(self.outbox.known_peers(), [])
+
+    def test_inbound_seq_survives_reopen(self):
+        self.outbox.remember('Alice')
+        self.outbox.mark_inbound('Alice', 7)
+        self.outbox.mark_inbound('Alice', 3)
+        self.reopen()
+        self.assertEqual(self.outbox.inbound_seq('Alice'), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+
+from src.pipeline import Handler, Pipeline
+
+QUEUE_SIZE = 4
+MESSAGES = 50
+
+
+class Stuck(Handler):
+    """Takes the messages of one peer and blocks on them until released"""
+    name = 'stuck'
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.handled = []
+
+    def accepts(self, message):
+        return message.peer_id == 'slow'
+
+    def handle(self, messages):
+        self.release.wait()
+        self.handled.extend(message.text for message in messages)
+
+
+class Recorder(Handler):
+    """Keeps the messages of every other peer"""
+    name = 'recorder'
+
+    def __init__(self):
+        self.handled = []
+
+    def accepts(self, message):
+        return message.peer_id != 'slow'
+
+    def handle(self, messages):
+        self.handled.extend(message.text for message in messages)
+
+
+class DispatchTest(unittest.TestCase):
+    """A handler that stops keeps only its own peer's credit, not anyone else's"""
+
+    def setUp(self):
+        self.stuck, self.recorder = Stuck(), Recorder()
+        config = {'queue_size': QUEUE_SIZE, 'batch_size': 2, 'decode_workers': 1, 'dispatch_workers': 1}
+        self.pipeline = Pipeline(lambda kind, payload: (payload.decode(), None), [self.stuck, self.recorder],
+                                 config, on_error=self.fail)
+        self.done = {'slow': 0, 'fast': 0}
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.stuck.release.set()
+        self.pipeline.close()
+
+    def finished(self, peer_id):
+        with self.lock:
+            self.done[peer_id] += 1
+
+    def submit(self, peer_id, count):
+        for i in range(count):
+            self.pipeline.submit(peer_id, None, 0, f"{peer_id}{i}".encode(),
+                                 done=lambda peer_id=peer_id: self.finished(peer_id))
+
+    def test_stuck_handler_holds_back_only_its_peer(self):
+        self.submit('slow', MESSAGES)
+        self.submit('fast', MESSAGES)
+        deadline = time.monotonic() + 10
+        while self.done['fast'] < MESSAGES and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(self.recorder.handled, [f"fast{i}" for i in range(MESSAGES)])
+        self.assertEqual(self.done, {'slow': 0, 'fast': MESSAGES})
+        _, stages = self.pipeline.snapshot()
+        stuck = next(stage for stage in stages if stage['name'] == 'handler:stuck')
+        self.assertGreater(stuck['overflow'], 0)
+
+        self.stuck.release.set()
+        self.assertTrue(self.pipeline.drain(10))
+        self.assertEqual(self.stuck.handled, [f"slow{i}" for i in range(MESSAGES)])
+        self.assertEqual(self.done['slow'], MESSAGES)
+
+
+if __name__ == '__main__':
+    unittest.main()
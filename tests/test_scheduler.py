@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+
+from src.transport.scheduler import ThreadScheduler
+
+
+class ThreadSchedulerTest(unittest.TestCase):
+    """Callbacks run once each, in deadline order, whatever was rescheduled or cancelled"""
+
+    def setUp(self):
+        self.scheduler = ThreadScheduler()
+        self.fired = []
+        self.done = threading.Event()
+
+    def record(self, key):
+        self.fired.append(key)
+        if key == 'last':
+            self.done.set()
+
+    def test_order_reschedule_and_cancel(self):
+        scheduler = self.scheduler
+        start = scheduler.clock() + 0.1
+        for i in range(200):
+            scheduler.call_at(i, start + (200 - i) * 0.001, self.record)
+        # A later deadline keeps the earlier one, an earlier deadline replaces it
+        scheduler.call_at(0, start + 1, self.record)
+        scheduler.call_at(199, start - 0.05, self.record)
+        for i in range(1, 199, 2):
+            scheduler.cancel(i)
+        scheduler.call_at('last', start + 0.3, self.record)
+
+        self.assertTrue(self.done.wait(5))
+        expected = [199] + [i for i in range(198, 0, -1) if i % 2 == 0] + [0, 'last']
+        self.assertEqual(self.fired, expected)
+        self.assertEqual(scheduler.due, {})
+        self.assertEqual(scheduler.heap, [])
+
+    def test_stale_entries_do_not_pile_up(self):
+        scheduler = self.scheduler
+        later = scheduler.clock() + 60
+        for _ in range(20):
+            for key in range(1000):
+                scheduler.call_at(key, later, self.record)
+            for key in range(1000):
+                scheduler.cancel(key)
+        self.assertLessEqual(len(scheduler.heap), 64)
+
+        scheduler.call_at('last', scheduler.clock(), self.record)
+        self.assertTrue(self.done.wait(5))
+        time.sleep(0.05)
+        self.assertEqual(self.fired, ['last'])
+
+
+if __name__ == '__main__':
+    unittest.main()